@@ -4,8 +4,6 @@ import logging
 import threading
 import csv
 import sys
-import concurrent.futures
-import queue
 from datetime import datetime
 from flask import Flask, render_template, redirect, url_for, flash, jsonify, request, send_from_directory
 from dotenv import load_dotenv
@@ -40,18 +38,25 @@ from plex_playlist_sync.stats_generator import (
     get_library_statistics
 )
 from plex_playlist_sync.utils.gemini_ai import list_ai_playlists, generate_on_demand_playlist, test_ai_services, get_gemini_status, generate_playlist_description, analyze_playlist_genres
+from plex_playlist_sync.utils.plex_connection import get_plex_server, get_plex_connection_stats
+from plex_playlist_sync.utils.rate_limiter import get_rate_limited_session, get_rate_limiter_stats
+from plex_playlist_sync.utils.deezer_client import get_deezer_client
+from plex_playlist_sync.utils.plex import get_search_metrics
+from plex_playlist_sync.utils.pipeline import get_pipeline_metrics
+from plex_playlist_sync.utils.download_queue import enqueue_download, enqueue_downloads, start_download_workers, get_download_queue_stats
 from plex_playlist_sync.utils.helperClasses import UserInputs
 from plex_playlist_sync.utils.database import (
     initialize_db, get_missing_tracks, update_track_status, get_missing_track_by_id, 
     add_managed_ai_playlist, get_managed_ai_playlists_for_user, delete_managed_ai_playlist, get_managed_playlist_details,
     delete_all_missing_tracks, delete_missing_track, check_track_in_index_smart, comprehensive_track_verification, get_library_index_stats,
+    match_tracks_batch, check_track_in_filesystem, flush_db_writes,
     clean_tv_content_from_missing_tracks, clean_resolved_missing_tracks, add_missing_track_if_not_exists,
     get_total_selected_playlists_count, share_playlist_with_user, get_shared_playlists, get_user_playlist_selections_with_sharing,
     check_album_in_library, check_album_in_index, get_plex_playlists_for_user, save_plex_playlist, get_playlist_by_id,
     update_playlist_ai_cover, update_playlist_ai_description, mark_playlist_synced, get_plex_playlist_stats,
-    sync_plex_playlists_from_server
+    sync_plex_playlists_from_server, purge_deezer_search_cache, get_database_stats
 )
-from plex_playlist_sync.utils.downloader import DeezerLinkFinder, download_single_track_with_streamrip, find_potential_tracks, find_tracks_free_search
+from plex_playlist_sync.utils.downloader import DeezerLinkFinder, find_potential_tracks, find_tracks_free_search, get_deezer_cache_stats
 from plex_playlist_sync.utils.i18n import init_i18n_for_app, translate_status
 from plex_playlist_sync.utils.file_watcher import watcher_manager
 
@@ -75,8 +80,7 @@ def initialize_music_watcher():
         library_name = os.getenv('LIBRARY_NAME', 'Musica')
         
         if plex_url and plex_token:
-            from plexapi.server import PlexServer
-            plex_server = PlexServer(plex_url, plex_token, timeout=120)
+            plex_server = get_plex_server(plex_url, plex_token, timeout=120)
             
             # Inizializza il watcher
             watcher = watcher_manager.initialize(music_download_path, plex_server, library_name)
@@ -103,30 +107,6 @@ app_state = {
     "stop_requested": False 
 }
 
-# Sistema di download asincrono: coda thread-safe + pool di worker
-download_queue = queue.Queue()
-download_executor = concurrent.futures.ThreadPoolExecutor(max_workers=2) # Limitato per evitare sovraccarico sistema
-
-def download_worker():
-    """
-    Worker thread per l'elaborazione asincrona dei download musicali.
-    Processa elementi dalla coda download_queue fino a ricevere sentinella None.
-    """
-    while True:
-        track_info = download_queue.get()
-        if track_info is None: # Sentinella per terminare il worker
-            break
-        link, track_id = track_info
-        try:
-            log.info(f"Starting download for {link} (Track ID: {track_id})")
-            download_single_track_with_streamrip(link) # Ora accetta un singolo link
-            update_track_status(track_id, 'downloaded')
-            log.info(f"Download completed for {link} (Track ID: {track_id})")
-        except Exception as e:
-            log.error(f"Error downloading {link} (Track ID: {track_id}): {e}", exc_info=True)
-        finally:
-            download_queue.task_done()
-
 def background_scheduler():
     """
     Scheduler di background per l'esecuzione automatica della sincronizzazione.
@@ -398,7 +378,7 @@ def stats():
     
     if user_token and plex_url and (target_id or analysis_type == 'library') and not error_msg:
         try:
-            plex = PlexServer(plex_url, user_token, timeout=120)
+            plex = get_plex_server(plex_url, user_token, timeout=120)
             log.info(f"Generating statistics for {selected_user} - type: {analysis_type}")
             
             # Get current language for data processing and charts
@@ -437,7 +417,7 @@ def stats():
         # Ottieni nome della playlist dalla configurazione
         try:
             if user_token and plex_url and not error_msg:
-                plex = PlexServer(plex_url, user_token, timeout=120)
+                plex = get_plex_server(plex_url, user_token, timeout=120)
                 playlist = plex.fetchItem(int(target_id))
                 data_source_info = {
                     'type': 'playlist',
@@ -527,7 +507,7 @@ def ai_lab():
             else:
                 log.info("Nessun download eseguito, salto la fase di rescan")
         
-        return start_background_task(generate_and_download_task, "Generazione playlist e download automatico avviati!", PlexServer(plex_url, user_token, timeout=120), temp_user_inputs, favorites_id, custom_prompt, selected_user_key)
+        return start_background_task(generate_and_download_task, "Generazione playlist e download automatico avviati!", get_plex_server(plex_url, user_token, timeout=120), temp_user_inputs, favorites_id, custom_prompt, selected_user_key)
 
     return render_template('ai_lab.html', aliases=user_aliases, selected_user=selected_user_key, existing_playlists=existing_playlists)
 
@@ -547,7 +527,7 @@ def delete_ai_playlist_route(playlist_db_id):
     plex_url = os.getenv('PLEX_URL')
 
     try:
-        plex = PlexServer(plex_url, user_token, timeout=120)
+        plex = get_plex_server(plex_url, user_token, timeout=120)
         plex_playlist = plex.fetchItem(playlist_details['plex_rating_key'])
         log.warning(f"Deleting playlist '{plex_playlist.title}' from Plex...")
         plex_playlist.delete()
@@ -673,10 +653,17 @@ def get_playlist_tracks(playlist_id):
             plex_url = os.getenv('PLEX_URL')
             
             if plex_token and plex_url:
-                from plexapi.server import PlexServer
-                plex = PlexServer(plex_url, plex_token, timeout=120)
+                plex = get_plex_server(plex_url, plex_token, timeout=120)
+        
+        # Fast mode: matching bilanciato di tutta la tracklist in un solo batch
+        index_matches = []
+        if not (verify_with_plex and plex):
+            from plex_playlist_sync.utils.database import match_tracks_batch
+            index_matches = match_tracks_batch(
+                ((t.get('title', ''), t.get('artist', '')) for t in tracklist), mode='balanced'
+            )
         
-        for track_data in tracklist:
+        for track_index, track_data in enumerate(tracklist):
             track_title = track_data.get('title', '')
             track_artist = track_data.get('artist', '')
             track_album = track_data.get('album', '')
@@ -753,9 +740,8 @@ def get_playlist_tracks(playlist_id):
                         source_type='ai_playlist'
                     )
             else:
-                # Fast balanced approach: conservative fuzzy matching
-                from plex_playlist_sync.utils.database import check_track_in_index_balanced
-                found_in_plex = check_track_in_index_balanced(track_title, track_artist)
+                # Fast balanced approach: conservative fuzzy matching (risultato del batch)
+                found_in_plex = index_matches[track_index]['matched']
                 plex_rating_key = None
                 
                 # Se non trovata con fast mode, prova ricerca Plex automatica
@@ -766,11 +752,10 @@ def get_playlist_tracks(playlist_id):
                     
                     if plex_token and plex_url:
                         try:
-                            from plexapi.server import PlexServer
                             from plex_playlist_sync.utils.plex import search_plex_track
                             from plex_playlist_sync.utils.helperClasses import Track as PlexTrack
                             
-                            plex_auto = PlexServer(plex_url, plex_token, timeout=120)
+                            plex_auto = get_plex_server(plex_url, plex_token, timeout=120)
                             track_obj = PlexTrack(title=track_title, artist=track_artist, album=track_album, url='')
                             found_plex_track = search_plex_track(plex_auto, track_obj)
                             
@@ -895,7 +880,8 @@ def simulate_gemini_error_route(error_type):
 def delete_missing_track_route(track_id):
     """Endpoint per eliminare permanentemente una traccia dalla lista dei mancanti."""
     try:
-        delete_missing_track(track_id)
+        # Attende il commit: la pagina ricaricata dal redirect non deve più mostrare la traccia
+        delete_missing_track(track_id).result()
         flash("Traccia rimossa con successo dalla lista dei mancanti.", "info")
     except Exception as e:
         log.error(f"Errore durante l'eliminazione della traccia mancante ID {track_id}: {e}")
@@ -1040,28 +1026,21 @@ def find_and_download_missing_tracks_auto():
                 delete_missing_track(track[0])
             else:
                 tracks_to_download.append(track)
+        # Le eliminazioni passano dallo scrittore unico: vanno applicate prima delle letture successive
+        flush_db_writes()
         
         if not tracks_to_download:
             log.info("No valid tracks left to download after verification.")
             return
 
-        # Fase 2: Cerca i link per le tracce rimanenti in parallelo
-        log.info(f"Avvio ricerca parallela di link per {len(tracks_to_download)} tracce...")
-        links_found = []
-        with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
-            future_to_track = {executor.submit(DeezerLinkFinder.find_track_link, {'title': track[1], 'artist': track[2]}): track for track in tracks_to_download}
-            
-            for future in concurrent.futures.as_completed(future_to_track):
-                track_info = future_to_track[future]
-                link = future.result()
-                if link:
-                    links_found.append((link, track_info[0]))
+        # Fase 2: Cerca i link raggruppando le tracce per album (una ricerca Deezer per gruppo)
+        log.info(f"Avvio ricerca link per {len(tracks_to_download)} tracce raggruppate per album...")
+        links_to_tracks = DeezerLinkFinder.find_links_by_album(tracks_to_download, max_workers=3)
 
         # Fase 3: Aggiungi i link alla coda di download
-        if links_found:
-            log.info(f"Aggiungo {len(links_found)} link alla coda di download.")
-            for link, track_id in links_found:
-                download_queue.put((link, track_id))
+        if links_to_tracks:
+            log.info(f"Aggiungo {len(links_to_tracks)} link alla coda di download.")
+            enqueue_downloads(links_to_tracks)
         else:
             log.info("Nessun link di download trovato per le tracce rimanenti.")
 
@@ -1086,7 +1065,7 @@ def download_selected_tracks():
         track_id = track_data.get('track_id')
         album_url = track_data.get('album_url')
         if track_id and album_url:
-            download_queue.put((album_url, track_id))
+            enqueue_download(album_url, [track_id])
             log.info(f"Traccia {track_id} con URL {album_url} aggiunta alla coda di download (selezione multipla).")
 
     return jsonify({"success": True, "message": f"{len(tracks_to_download)} download aggiunti alla coda."})
@@ -1176,7 +1155,8 @@ def restart_indexing():
             return redirect(url_for('index'))
     
     flash("🔄 Riavvio indicizzazione ottimizzata per gestire grandi librerie...", "info")
-    return start_background_task(build_library_index, "Riavvio indicizzazione libreria ottimizzata...")
+    # Il riavvio forza sempre una ricostruzione completa (niente delta indexing)
+    return start_background_task(build_library_index, "Riavvio indicizzazione libreria ottimizzata...", True)
 
 @app.route('/rescan_missing', methods=['POST'])
 def rescan_missing_route():
@@ -1226,32 +1206,36 @@ def comprehensive_verify_missing_route():
             'truly_missing': 0
         }
         
-        for i, track in enumerate(all_missing_tracks, 1):
+        # Exact + fuzzy sull'indice per tutta la lista in un solo batch
+        app_state['status'] = f"Verifica completa: matching di {total_tracks} tracce nell'indice..."
+        index_matches = match_tracks_batch((track[1], track[2]) for track in all_missing_tracks)
+        
+        for i, (track, index_match) in enumerate(zip(all_missing_tracks, index_matches), 1):
             track_id, title, artist = track[0], track[1], track[2]
             
             # Aggiorna status con progresso
             app_state['status'] = f"Verifica completa: {i}/{total_tracks} - Controllando '{title[:30]}...' di {artist[:20]}..."
             
             try:
-                # Usa la verifica completa
-                verification_result = comprehensive_track_verification(title, artist)
+                # Il filesystem viene controllato solo per le tracce non trovate nell'indice
+                filesystem_match = not index_match['matched'] and check_track_in_filesystem(title, artist)
                 
-                if verification_result['exists']:
+                if index_match['matched'] or filesystem_match:
                     false_positives.append((track_id, title, artist))
                     
                     # Aggiorna le statistiche
-                    if verification_result['exact_match']:
+                    if index_match['method'] == 'exact':
                         verification_stats['exact_matches'] += 1
                         log.info(f"FALSO POSITIVO (EXACT): '{title}' - '{artist}' trovato nell'indice")
-                    elif verification_result['fuzzy_match']:
+                    elif index_match['matched']:
                         verification_stats['fuzzy_matches'] += 1
-                        log.info(f"FALSO POSITIVO (FUZZY): '{title}' - '{artist}' trovato con fuzzy matching")
-                    elif verification_result['filesystem_match']:
+                        log.info(f"FALSO POSITIVO (FUZZY): '{title}' - '{artist}' trovato con fuzzy matching (score: {index_match['score']})")
+                    else:
                         verification_stats['filesystem_matches'] += 1
                         log.info(f"FALSO POSITIVO (FILESYSTEM): '{title}' - '{artist}' trovato nel filesystem")
                     
-                    # Rimuovi dalla lista mancanti
-                    delete_missing_track(track_id)
+                    # Rimuovi dalla lista mancanti (attende il commit: un errore viene contato qui sotto)
+                    delete_missing_track(track_id).result()
                 else:
                     truly_missing.append((track_id, title, artist))
                     verification_stats['truly_missing'] += 1
@@ -1295,7 +1279,7 @@ def search_plex_manual():
     user_token, plex_url = (os.getenv('PLEX_TOKEN'), os.getenv('PLEX_URL')) if user_key == 'main' else (os.getenv('PLEX_TOKEN_USERS'), os.getenv('PLEX_URL'))
     if not (user_token and plex_url): return jsonify({"error": "Credenziali Plex non trovate."}), 500
     try:
-        plex = PlexServer(plex_url, user_token, timeout=120)
+        plex = get_plex_server(plex_url, user_token, timeout=120)
         # Import timeout wrapper for safe search
         from plex_playlist_sync.utils.plex import _search_with_timeout
         results = _search_with_timeout(plex, query, limit=16, timeout_seconds=45)
@@ -1316,7 +1300,7 @@ def associate_track():
     if not (user_token and plex_url): return jsonify({"success": False, "error": "Credenziali Plex non trovate."}), 500
     try:
         log.info(f"Connecting to Plex server...")
-        plex = PlexServer(plex_url, user_token, timeout=120)
+        plex = get_plex_server(plex_url, user_token, timeout=120)
         log.info(f"Getting missing track info for ID: {missing_track_id}")
         missing_track_info = get_missing_track_by_id(missing_track_id)
         if not missing_track_info: 
@@ -1337,7 +1321,7 @@ def associate_track():
             log.warning(f"Playlist {playlist_id} no longer exists, marking track as found without adding to playlist")
             success_message = f"Traccia '{track_to_add.title}' trovata e marcata come risolta (playlist originale non più disponibile)."
         
-        update_track_status(missing_track_id, 'resolved_manual')
+        update_track_status(missing_track_id, 'resolved_manual').result()
         log.info(f"Association completed successfully")
         return jsonify({"success": True, "message": success_message})
     except NotFound as e: 
@@ -1495,8 +1479,7 @@ def search_universal():
             # Ricerca tracce
             if search_type in ['auto', 'track']:
                 search_url = f'https://api.deezer.com/search/track?q={query}&limit=25'
-                time.sleep(0.3)
-                response = requests.get(search_url, timeout=10)
+                response = get_deezer_client().get(search_url, timeout=10)
                 
                 if response.status_code == 200:
                     deezer_data = response.json()
@@ -1527,8 +1510,7 @@ def search_universal():
             # Ricerca album
             if search_type in ['auto', 'album']:
                 search_url = f'https://api.deezer.com/search/album?q={query}&limit=25'
-                time.sleep(0.3)
-                response = requests.get(search_url, timeout=10)
+                response = get_deezer_client().get(search_url, timeout=10)
                 
                 if response.status_code == 200:
                     deezer_data = response.json()
@@ -1558,8 +1540,7 @@ def search_universal():
             # Ricerca artisti
             if search_type in ['auto', 'artist']:
                 search_url = f'https://api.deezer.com/search/artist?q={query}&limit=25'
-                time.sleep(0.3)
-                response = requests.get(search_url, timeout=10)
+                response = get_deezer_client().get(search_url, timeout=10)
                 
                 if response.status_code == 200:
                     deezer_data = response.json()
@@ -1629,7 +1610,8 @@ def download_track():
     if not track_id or not album_url: return jsonify({"success": False, "error": "Dati incompleti."}), 400
     
     # Aggiungi il download alla coda, non bloccare l'UI
-    download_queue.put((album_url, track_id))
+    if enqueue_download(album_url, [track_id]) is None:
+        return jsonify({"success": False, "error": "Impossibile accodare il download."}), 500
     log.info(f"Traccia {track_id} con URL {album_url} aggiunta alla coda di download.")
     return jsonify({"success": True, "message": "Download aggiunto alla coda."})
 
@@ -1706,6 +1688,11 @@ def api_stats():
                 'secondary_user': ai_playlists_secondary
             },
             'library': library_stats,
+            'plex_search': get_search_metrics(),
+            'plex_connections': get_plex_connection_stats(),
+            'sync_pipeline': get_pipeline_metrics(),
+            'database': get_database_stats(),
+            'rate_limits': get_rate_limiter_stats(),
             'system': {
                 'status': app_state["status"],
                 'last_sync': app_state["last_sync"],
@@ -1716,6 +1703,32 @@ def api_stats():
         log.error(f"Errore nel recupero statistiche API: {e}", exc_info=True)
         return jsonify({'error': 'Errore nel recupero statistiche'}), 500
 
+@app.route('/api/download_queue')
+def api_download_queue():
+    """API endpoint per profondità e throughput della coda download persistente"""
+    stats = get_download_queue_stats()
+    if not stats:
+        return jsonify({'success': False, 'error': 'Errore nel recupero stato coda download'}), 500
+    return jsonify({'success': True, 'queue': stats})
+
+@app.route('/api/deezer_cache')
+def api_deezer_cache():
+    """API endpoint per hit/miss e contenuto della cache ricerche Deezer"""
+    return jsonify({'success': True, 'cache': get_deezer_cache_stats()})
+
+@app.route('/api/deezer_cache/purge', methods=['POST'])
+def api_deezer_cache_purge():
+    """Svuota la cache ricerche Deezer: scope 'all' (default), 'negative' o 'expired'"""
+    scope = (request.get_json(silent=True) or {}).get('scope', 'all')
+    try:
+        removed = purge_deezer_search_cache(scope)
+        return jsonify({'success': True, 'removed': removed, 'scope': scope})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        log.error(f"Errore pulizia cache ricerche Deezer: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route('/api/missing_tracks')
 def api_missing_tracks():
     """API endpoint per tracce mancanti con filtri"""
@@ -1872,7 +1885,7 @@ def api_discover_playlists(user_type, service):
             sp = spotipy.Spotify(auth_manager=SpotifyClientCredentials(
                 client_id=user_inputs.spotipy_client_id,
                 client_secret=user_inputs.spotipy_client_secret
-            ))
+            ), requests_session=get_rate_limited_session('spotify'))
             
             # Scopri contenuto Spotify
             spotify_content = discover_all_spotify_content(sp, user_inputs.spotify_user_id, user_inputs.country)
@@ -2140,7 +2153,8 @@ def api_add_public_playlist():
                 client_id=spotify_client_id,
                 client_secret=spotify_client_secret,
                 cache_handler=memory_cache
-            )
+            ),
+            requests_session=get_rate_limited_session('spotify')
         )
         
         # Recupera metadati playlist
@@ -2540,8 +2554,7 @@ def search_artist_albums():
             
             # Cerca artista su Deezer
             search_url = f'https://api.deezer.com/search/artist?q={artist_name}&limit=5'
-            time.sleep(0.5)
-            response = requests.get(search_url, timeout=10)
+            response = get_deezer_client().get(search_url, timeout=10)
             
             if response.status_code == 200:
                 deezer_data = response.json()
@@ -2554,8 +2567,7 @@ def search_artist_albums():
                     if artist_id:
                         # Cerca album dell'artista
                         albums_url = f'https://api.deezer.com/artist/{artist_id}/albums?limit=20'
-                        time.sleep(0.5)
-                        albums_response = requests.get(albums_url, timeout=10)
+                        albums_response = get_deezer_client().get(albums_url, timeout=10)
                         
                         if albums_response.status_code == 200:
                             albums_data = albums_response.json()
@@ -2571,8 +2583,7 @@ def search_artist_albums():
                                     if track_count == 0 and album_id:
                                         try:
                                             album_details_url = f'https://api.deezer.com/album/{album_id}'
-                                            time.sleep(0.3)
-                                            details_response = requests.get(album_details_url, timeout=8)
+                                            details_response = get_deezer_client().get(album_details_url, timeout=8)
                                             if details_response.status_code == 200:
                                                 album_details = details_response.json()
                                                 track_count = album_details.get("nb_tracks", 0)
@@ -2911,7 +2922,7 @@ def sync_plex_playlists(user_type):
             return jsonify({"success": False, "error": "Configurazione Plex mancante"}), 400
         
         # Connessione a Plex
-        plex = PlexServer(plex_url, plex_token)
+        plex = get_plex_server(plex_url, plex_token)
         
         # Trova la sezione musicale automaticamente
         music_library = None
@@ -3056,7 +3067,7 @@ def sync_playlist_to_plex(playlist_id):
         if not plex_url or not plex_token:
             return jsonify({"success": False, "error": "Configurazione Plex mancante"}), 400
         
-        plex = PlexServer(plex_url, plex_token)
+        plex = get_plex_server(plex_url, plex_token)
         
         # Trova la playlist in Plex usando fetchItem con plex_id convertito a int
         plex_playlist = plex.fetchItem(int(playlist['plex_id']))
@@ -3148,7 +3159,7 @@ def bulk_playlist_actions():
                         plex_token = os.getenv("PLEX_TOKEN")
                         
                         if plex_url and plex_token:
-                            plex = PlexServer(plex_url, plex_token)
+                            plex = get_plex_server(plex_url, plex_token)
                             plex_playlist = plex.playlist(playlist['plex_id'])
                             
                             if playlist['ai_description']:
@@ -3193,8 +3204,7 @@ if __name__ == '__main__':
     scheduler_thread = threading.Thread(target=background_scheduler, daemon=True)
     scheduler_thread.start()
     
-    # Avvia il worker per i download in un thread separato
-    download_worker_thread = threading.Thread(target=download_worker, daemon=True)
-    download_worker_thread.start()
+    # Avvia i worker della coda download persistente (riprende i job rimasti da un riavvio)
+    start_download_workers()
 
     app.run(host='0.0.0.0', port=5000)
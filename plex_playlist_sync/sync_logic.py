@@ -62,23 +62,163 @@ from .utils.cleanup import delete_old_playlists, delete_previous_week_playlist
 from .utils.deezer import deezer_playlist_sync, deezer_playlist_sync_with_discovery
 from .utils.helperClasses import UserInputs, Playlist as PlexPlaylist, Track as PlexTrack
 from .utils.spotify import spotify_playlist_sync, spotify_playlist_sync_with_discovery
-from .utils.downloader import download_single_track_with_streamrip, DeezerLinkFinder
+from .utils.downloader import DeezerLinkFinder
 from .utils.gemini_ai import configure_gemini, get_plex_favorites_by_id, generate_playlist_prompt, get_gemini_playlist_data
 from .utils.weekly_ai_manager import manage_weekly_ai_playlist
-from .utils.plex import update_or_create_plex_playlist, search_plex_track
+from .utils.plex import update_or_create_plex_playlist, search_plex_track, shared_resolutions_cycle
 from .utils.state_manager import load_playlist_state, save_playlist_state
+from .utils.plex_connection import get_plex_server
+from .utils.download_queue import enqueue_downloads, wait_for_jobs
+from .utils.rate_limiter import get_rate_limited_session
 from .utils.database import (
     initialize_db, clear_library_index, add_track_to_index, bulk_add_tracks_to_index, get_missing_tracks,
-    check_track_in_index, check_track_in_index_smart, update_track_status, get_selected_playlist_ids
+    check_track_in_index, check_track_in_index_smart, update_track_status, get_selected_playlist_ids,
+    match_tracks_batch, flush_db_writes
 )
 
 # Carica le variabili dal file .env montato via Docker
 load_dotenv('/app/.env')
 
-def build_library_index(app_state: Dict):
+# Delta indexing: finestra di sovrapposizione sull'high-water mark (gli upsert sono idempotenti)
+LIBRARY_DELTA_OVERLAP_SECONDS = int(os.getenv("LIBRARY_DELTA_OVERLAP_SECONDS", "300"))
+# Dimensione pagina per l'elenco dei ratingKey durante la riconciliazione delle cancellazioni
+LIBRARY_KEYS_PAGE_SIZE = int(os.getenv("LIBRARY_KEYS_PAGE_SIZE", "5000"))
+# Riconciliazione completa dei ratingKey ogni N run delta (prima se il totale tracce non torna)
+LIBRARY_RECONCILE_EVERY_RUNS = max(1, int(os.getenv("LIBRARY_RECONCILE_EVERY_RUNS", "12")))
+# Tracce per pagina nel fetch in streaming della ricostruzione completa
+LIBRARY_INDEX_PAGE_SIZE = int(os.getenv("LIBRARY_INDEX_PAGE_SIZE", "2500"))
+
+
+def _library_tracks_ekey(music_library, extra: str = "") -> str:
+    """Endpoint Plex di tutte le tracce della sezione, con eventuali filtri raw."""
+    return f"/library/sections/{music_library.key}/all?type=10{extra}"
+
+
+def _track_timestamp(track, attr: str) -> int:
+    value = getattr(track, attr, None)
+    try:
+        return int(value.timestamp()) if value else 0
+    except (OverflowError, OSError, ValueError):
+        return 0
+
+
+def _tracks_high_water_mark(tracks, current: int = 0) -> int:
+    """Massimo tra addedAt/updatedAt (epoch) delle tracce e il valore corrente."""
+    for track in tracks:
+        current = max(current, _track_timestamp(track, 'addedAt'), _track_timestamp(track, 'updatedAt'))
+    return current
+
+
+def _fetch_library_rating_keys(plex, music_library) -> set:
+    """
+    Elenca tutti i ratingKey delle tracce a pagine, leggendo solo l'attributo dall'XML
+    (nessun oggetto plexapi costruito, elementi figli esclusi dove il server lo supporta).
+    """
+    rating_keys = set()
+    start = 0
+    while True:
+        if check_stop_flag_direct():
+            raise InterruptedError("Stop requested during rating key reconciliation")
+        data = plex.query(_library_tracks_ekey(
+            music_library,
+            f"&excludeElements=Media,Genre,Mood,Field,Image,Guid&excludeFields=summary"
+            f"&X-Plex-Container-Start={start}&X-Plex-Container-Size={LIBRARY_KEYS_PAGE_SIZE}"
+        ))
+        page = [int(elem.attrib['ratingKey']) for elem in data if elem.attrib.get('ratingKey')]
+        rating_keys.update(page)
+        start += LIBRARY_KEYS_PAGE_SIZE
+        if len(page) < LIBRARY_KEYS_PAGE_SIZE:
+            return rating_keys
+
+
+def _run_delta_library_index(app_state: Dict, plex, music_library, since: int) -> bool:
+    """
+    Delta indexing: scarica solo le tracce aggiunte/modificate dopo l'high-water mark,
+    riconcilia le cancellazioni tramite ratingKey (ogni LIBRARY_RECONCILE_EVERY_RUNS run o quando
+    il totale tracce di Plex non torna) e salva il nuovo high-water mark. Restituisce False se serve una ricostruzione completa.
+    """
+    from .utils.database import (
+        get_library_index_state, set_library_index_state, get_indexed_rating_keys,
+        delete_tracks_by_rating_keys, get_library_index_stats
+    )
+    
+    start_time = time.time()
+    since_filter = max(0, since - LIBRARY_DELTA_OVERLAP_SECONDS)
+    logger.info(f"⚡ Delta indexing since {datetime.fromtimestamp(since)} (high-water mark {since})")
+    app_state['status'] = "Delta indexing: fetching new and changed tracks..."
+    
+    # FASE 1: Tracce nuove (addedAt) e modificate (updatedAt) dopo l'high-water mark
+    changed = {}
+    for field in ('addedAt', 'updatedAt'):
+        try:
+            items = music_library.fetchItems(_library_tracks_ekey(music_library, f"&track.{field}>>={since_filter}"))
+        except Exception as e:
+            if field == 'addedAt':
+                logger.warning(f"⚠️ Delta query on {field} failed: {e}")
+                return False
+            # Senza filtro updatedAt restano comunque le aggiunte e la riconciliazione
+            logger.warning(f"⚠️ Delta query on {field} not supported by server, skipping: {e}")
+            continue
+        for track in items:
+            changed[track.ratingKey] = track
+    
+    if check_stop_flag_direct():
+        logger.info("🛑 Stop requested during delta indexing")
+        app_state['status'] = "Indexing stopped by user request"
+        return True
+    
+    changed_tracks = list(changed.values())
+    new_count = sum(1 for track in changed_tracks if _track_timestamp(track, 'addedAt') > since)
+    if changed_tracks:
+        logger.info(f"📥 Delta: {len(changed_tracks)} new/changed tracks ({new_count} new)")
+        bulk_add_tracks_to_index(changed_tracks)
+    
+    # FASE 2: Riconciliazione cancellazioni. Elencare tutti i ratingKey costa quanto la libreria,
+    # quindi si fa solo se il totale non è quello atteso (precedente + nuove tracce: un'aggiunta e
+    # una cancellazione nello stesso intervallo non si compensano) o comunque ogni N run
+    total_size = music_library.totalViewSize(libtype='track')
+    previous_total = get_library_index_state('plex_total_tracks')
+    runs_since_reconcile = int(get_library_index_state('delta_runs_since_reconcile', '0') or 0) + 1
+    expected_total = int(previous_total) + new_count if previous_total is not None else None
+    removed = recovered = 0
+    if total_size != expected_total or runs_since_reconcile >= LIBRARY_RECONCILE_EVERY_RUNS:
+        logger.info(f"🔍 Reconciling rating keys (Plex total {total_size}, expected {expected_total}, "
+                    f"{runs_since_reconcile} delta runs since last reconcile)...")
+        app_state['status'] = "Delta indexing: reconciling deleted tracks..."
+        plex_keys = _fetch_library_rating_keys(plex, music_library)
+        indexed_keys = get_indexed_rating_keys()
+        removed = delete_tracks_by_rating_keys(indexed_keys - plex_keys)
+        
+        # Tracce presenti in Plex ma non nell'indice (es. perse per duplicati con la stessa terna pulita)
+        unknown_keys = sorted(plex_keys - indexed_keys)
+        for i in range(0, len(unknown_keys), 200):
+            chunk = unknown_keys[i:i + 200]
+            recovered_tracks = plex.fetchItems(f"/library/metadata/{','.join(map(str, chunk))}")
+            bulk_add_tracks_to_index(recovered_tracks)
+            recovered += len(recovered_tracks)
+        runs_since_reconcile = 0
+    else:
+        logger.info(f"⏭️ Plex total {total_size} as expected, rating key reconciliation skipped "
+                    f"({runs_since_reconcile}/{LIBRARY_RECONCILE_EVERY_RUNS} delta runs)")
+    
+    set_library_index_state('plex_hwm', _tracks_high_water_mark(changed_tracks, since))
+    set_library_index_state('plex_total_tracks', total_size)
+    set_library_index_state('delta_runs_since_reconcile', runs_since_reconcile)
+    
+    final_stats = get_library_index_stats()
+    final_status = (f"DELTA INDEXING COMPLETED! {len(changed_tracks)} new/changed, {removed} removed, "
+                    f"{recovered} recovered, {final_stats['total_tracks_indexed']} in index ({time.time() - start_time:.1f}s)")
+    app_state['status'] = final_status
+    logger.info(f"=== {final_status} ===")
+    return True
+
+
+def build_library_index(app_state: Dict, full_rebuild: bool = False):
     """
     Performs a complete scan of the Plex library and populates the local index.
     PARALLEL version with robust controls and extended debugging.
+    If a high-water mark from a previous run exists (and full_rebuild is False),
+    only new/changed/deleted tracks are processed (delta indexing).
     """
     import os  # Import needed for os.getenv
     logger.info("=== STARTING PARALLEL PLEX LIBRARY INDEXING ===")
@@ -91,9 +231,15 @@ def build_library_index(app_state: Dict):
         app_state['status'] = "Error: Missing Plex URL or Token."
         return
 
+    staging_open = False
     try:
         # FASE 1: Inizializzazione e controlli
-        from .utils.database import initialize_db, clear_library_index, add_track_to_index, get_library_index_stats
+        from .utils.database import (
+            initialize_db, clear_library_index, add_track_to_index, get_library_index_stats,
+            get_library_index_state, set_library_index_state, track_to_index_row,
+            begin_library_index_staging, swap_library_index_staging, discard_library_index_staging,
+            LIBRARY_INDEX_STAGING_TABLE
+        )
         
         logger.info("🔧 Database initialization...")
         initialize_db()
@@ -104,7 +250,7 @@ def build_library_index(app_state: Dict):
         
         # Connessione con timeout esteso
         app_state['status'] = "Connecting to Plex Server..."
-        plex = PlexServer(plex_url, plex_token, timeout=120)
+        plex = get_plex_server(plex_url, plex_token, timeout=120)
         
         try:
             music_library = plex.library.section(library_name)
@@ -114,92 +260,128 @@ def build_library_index(app_state: Dict):
             app_state['status'] = f"Error: Library '{library_name}' not found"
             return
         
-        # FASE 2: Stima totale tracce
+        # FASE 1b: Delta indexing se esiste un high-water mark e l'indice è popolato
+        high_water_mark = get_library_index_state('plex_hwm')
+        if not full_rebuild and high_water_mark and initial_stats['total_tracks_indexed'] > 0:
+            try:
+                if _run_delta_library_index(app_state, plex, music_library, int(high_water_mark)):
+                    return
+            except InterruptedError:
+                logger.info("🛑 Stop requested during delta indexing")
+                app_state['status'] = "Indexing stopped by user request"
+                return
+            except Exception as delta_error:
+                logger.error(f"❌ Delta indexing failed: {delta_error}", exc_info=True)
+            logger.warning("⚠️ Falling back to full library rebuild")
+        
+        # FASE 2: Stima totale tracce (solo totalSize, nessun elemento scaricato)
         app_state['status'] = "Estimating library size..."
         try:
-            # Prova a ottenere il totale con un metodo veloce
-            total_estimate = len(music_library.search(libtype='track', limit=50000))
+            total_estimate = music_library.totalViewSize(libtype='track')
             logger.info(f"📊 Estimated tracks in library: ~{total_estimate}")
         except Exception:
             logger.warning("⚠️ Unable to estimate library size, proceeding anyway")
             total_estimate = 0
         
-        # FASE 3: Svuotamento indice esistente
-        app_state['status'] = "Clearing existing index..."
-        logger.info("🗺️ Clearing existing index...")
-        clear_library_index()
-        
-        # FASE 4: Scarica TUTTE le tracce una volta sola (evita ripetuti fetch)
-        logger.info("📥 Downloading complete tracks from Plex (one time only)...")
-        all_tracks = music_library.search(libtype='track')
-        total_tracks = len(all_tracks)
-        logger.info(f"✅ Downloaded {total_tracks} total tracks from Plex")
+        # FASE 3: Tabella di staging (l'indice esistente resta interrogabile fino allo swap finale)
+        app_state['status'] = "Preparing staging index..."
+        logger.info("🏗️ Building new index in staging table (current index stays available)...")
+        begin_library_index_staging()
+        staging_open = True
         
-        # FASE 5: Indicizzazione a batch delle tracce già scaricate
-        batch_size = 2500  # Batch ridotti per evitare timeout
+        # FASE 4: Fetch paginato in streaming: ogni pagina diventa subito righe compatte nel DB,
+        # gli oggetti plexapi vengono scartati (memoria costante, scrittura immediata)
+        page_size = LIBRARY_INDEX_PAGE_SIZE
         total_processed = 0
         total_indexed = 0
+        high_water_mark = 0
+        complete = True
         
-        logger.info(f"🚀 Starting batch indexing (size: {batch_size})")
+        logger.info(f"🚀 Starting streaming indexing (page size: {page_size})")
         
         container_start = 0
         batch_num = 0
         
-        while container_start < total_tracks:
+        while True:
             # Check if stop was requested
             if check_stop_flag_direct():
                 logger.info("🛑 Stop requested during library indexing")
+                discard_library_index_staging()
                 app_state['status'] = "Indexing stopped by user request"
                 return
             
-            try:
-                batch_num += 1
-                batch_end = min(container_start + batch_size, total_tracks)
-                app_state['status'] = f"Batch {batch_num}: {container_start}-{batch_end} | Indicizzate: {total_indexed}"
-                
-                # Slice delle tracce già scaricate (nessun fetch aggiuntivo)
-                batch_tracks = all_tracks[container_start:batch_end]
-                
-                if not batch_tracks:
-                    logger.info(f"🏁 End of indexing - empty batch")
-                    break
-                
-                logger.info(f"🔄 Processing batch {batch_num}: {len(batch_tracks)} tracks (slice {container_start}:{batch_end})")
-                
-                # Processa il batch con inserimento BULK (PERFORMANCE OTTIMIZZATA)
+            batch_num += 1
+            page = None
+            for attempt in range(3):
                 try:
-                    batch_indexed = bulk_add_tracks_to_index(batch_tracks)
-                    total_indexed += batch_indexed
-                    total_processed += len(batch_tracks)
-                    batch_errors = len(batch_tracks) - batch_indexed
-                    
-                    # Update status every batch
-                    app_state['status'] = f"Batch {batch_num}: {len(batch_tracks)} processed | Tot indexed: {total_indexed}"
-                    
-                except Exception as batch_error:
-                    logger.error(f"Error in batch {batch_num}: {batch_error}")
-                    batch_errors = len(batch_tracks)
-                    batch_indexed = 0
-                
-                logger.info(f"✅ Batch {batch_num} completed: {batch_indexed}/{len(batch_tracks)} indexed, {batch_errors} errors")
-                
-                # Progress update every 5 batches
-                if batch_num % 5 == 0:
-                    current_stats = get_library_index_stats()
-                    logger.info(f"📊 General progress: {total_processed} processed, {current_stats['total_tracks_indexed']} in DB")
-                
-                container_start += batch_size
-                
-                # Se il batch è più piccolo del batch_size, abbiamo finito
-                if len(batch_tracks) < batch_size:
-                    logger.info(f"🏁 Last batch completed - size: {len(batch_tracks)}")
+                    page = music_library.fetchItems(_library_tracks_ekey(music_library),
+                                                    container_start=container_start, container_size=page_size)
+                    break
+                except Exception as page_error:
+                    logger.warning(f"⚠️ Error fetching page {batch_num} (offset {container_start}, attempt {attempt + 1}/3): {page_error}")
+                    time.sleep(2 * (attempt + 1))
+            
+            if page is None:
+                logger.error(f"❌ Page {batch_num} skipped after 3 attempts (offset {container_start})")
+                complete = False
+                container_start += page_size
+                # Senza stima non sappiamo dove finisce la libreria: ci fermiamo qui
+                if not total_estimate or container_start >= total_estimate:
                     break
-                    
-            except Exception as batch_error:
-                logger.error(f"❌ Error in batch {batch_num}: {batch_error}")
-                container_start += batch_size
                 continue
+            
+            if not page:
+                logger.info(f"🏁 End of indexing - empty page")
+                break
+            
+            page_len = len(page)
+            high_water_mark = _tracks_high_water_mark(page, high_water_mark)
+            rows = [row for row in map(track_to_index_row, page) if row]
+            del page
+            
+            try:
+                batch_indexed = bulk_add_tracks_to_index(rows, table=LIBRARY_INDEX_STAGING_TABLE)
+            except Exception as batch_error:
+                logger.error(f"Error in batch {batch_num}: {batch_error}")
+                batch_indexed = 0
+                complete = False
+            total_indexed += batch_indexed
+            total_processed += page_len
+            
+            progress = f" / ~{total_estimate}" if total_estimate else ""
+            app_state['status'] = f"Batch {batch_num}: {total_processed}{progress} processed | Tot indexed: {total_indexed}"
+            logger.info(f"✅ Batch {batch_num} completed: {batch_indexed}/{page_len} indexed (offset {container_start})")
+            
+            # Progress update every 5 batches
+            if batch_num % 5 == 0:
+                logger.info(f"📊 General progress: {total_processed}{progress} processed, {total_indexed} in staging")
+            
+            container_start += page_len
+            
+            # Se la pagina è più piccola della dimensione richiesta, abbiamo finito
+            if page_len < page_size:
+                logger.info(f"🏁 Last batch completed - size: {page_len}")
+                break
 
+        # FASE 5: Swap atomico staging -> indice attivo. Un indice incompleto sostituisce
+        # quello esistente solo se quest'ultimo è vuoto
+        if complete or initial_stats['total_tracks_indexed'] == 0:
+            app_state['status'] = "Swapping in the new index..."
+            if not swap_library_index_staging():
+                discard_library_index_staging()
+                app_state['status'] = "Error: index swap failed, previous index kept."
+                return
+        else:
+            logger.warning("⚠️ Incomplete rebuild: keeping the previous index")
+            discard_library_index_staging()
+        staging_open = False
+        
+        # High-water mark e totale Plex per i successivi delta indexing
+        if complete:
+            set_library_index_state('plex_hwm', high_water_mark)
+            set_library_index_state('plex_total_tracks', total_processed)
+            set_library_index_state('delta_runs_since_reconcile', 0)
+        
         # PHASE 5: Final verification
         final_stats = get_library_index_stats()
         final_status = f"INDEXING COMPLETED! {total_processed} processed, {final_stats['total_tracks_indexed']} successfully indexed in {batch_num} batches"
@@ -214,6 +396,9 @@ def build_library_index(app_state: Dict):
     except Exception as e:
         logger.error(f"❌ Critical error during library indexing: {e}", exc_info=True)
         app_state['status'] = "Critical error during indexing."
+        if staging_open:
+            # Otherwise live index writes keep going to the leftover staging table until the next rebuild
+            discard_library_index_staging()
 
 
 def _determine_user_type_from_token(plex_token: str) -> str:
@@ -275,7 +460,8 @@ def sync_playlists_for_user_selective(plex: PlexServer, user_inputs: UserInputs,
                         client_id=user_inputs.spotipy_client_id,
                         client_secret=user_inputs.spotipy_client_secret,
                         cache_handler=memory_cache  # Use memory cache instead
-                    )
+                    ),
+                    requests_session=get_rate_limited_session('spotify')
                 )
                 logger.info(
                     f"--- Starting Spotify sync for user {user_inputs.plex_token[:4]}... ({user_type}) ---"
@@ -368,7 +554,7 @@ def force_playlist_scan_and_missing_detection():
         return
     
     try:
-        plex = PlexServer(plex_url, plex_token, timeout=60)
+        plex = get_plex_server(plex_url, plex_token, timeout=60)
         
         # Ottieni tutte le playlist dell'utente e filtra quelle musicali
         all_playlists = plex.playlists()
@@ -412,15 +598,19 @@ def force_playlist_scan_and_missing_detection():
                 playlist_tracks = playlist.items()
                 missing_count = 0
                 
-                for track in playlist_tracks:
+                # Smart matching of the whole playlist in one batch
+                index_matches = match_tracks_batch(
+                    (getattr(track, 'title', ''), getattr(track, 'grandparentTitle', '')) for track in playlist_tracks
+                )
+                
+                for track, index_match in zip(playlist_tracks, index_matches):
                     # Check if stop was requested (every 10 tracks for performance)
                     if missing_count % 10 == 0 and check_stop_flag_direct():
                         logger.info("🛑 Stop requested during track scanning")
                         return
                     
                     try:
-                        # Use new smart matching system
-                        if not check_track_in_index_smart(track.title, track.grandparentTitle):
+                        if not index_match['matched']:
                             # Potentially missing track, add to DB
                             track_data = {
                                 'title': track.title,
@@ -461,64 +651,39 @@ def run_downloader_only():
         logger.info("🛑 Stop requested before download start")
         return False
     
+    # Missing tracks from the scan and the playlist sync are queued on the DB writer: wait for the last batch
+    flush_db_writes()
     missing_tracks_from_db = get_missing_tracks()
     
     if not missing_tracks_from_db:
         logger.info("No missing tracks in database to process.")
         return False
 
-    logger.info(f"Found {len(missing_tracks_from_db)} missing tracks. Starting parallel link search...")
-    tracks_with_links = []  # Lista di (track_id, link) per mantenere associazione
-    
-    # Use ThreadPoolExecutor to parallelize network requests
-    with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
-        # Create a future for each API call
-        future_to_track = {executor.submit(DeezerLinkFinder.find_track_link, {'title': track[1], 'artist': track[2]}): track for track in missing_tracks_from_db}
-        
-        for future in concurrent.futures.as_completed(future_to_track):
-            # Check if stop was requested
-            if check_stop_flag_direct():
-                logger.info("🛑 Stop requested during link search")
-                return False
-            
-            track = future_to_track[future]
-            link = future.result()
-            if link:
-                track_id = track[0]  # ID della traccia dal database
-                tracks_with_links.append((track_id, link))
-                logger.info(f"Link found for '{track[1]}' by '{track[2]}': {link}")
+    logger.info(f"Found {len(missing_tracks_from_db)} missing tracks. Starting link search grouped by album...")
+    # One Deezer search per (artist, album): the album link is shared by all its missing tracks
+    unique_links = DeezerLinkFinder.find_links_by_album(missing_tracks_from_db, max_workers=3,
+                                                        should_stop=check_stop_flag_direct)
+    if check_stop_flag_direct():
+        logger.info("🛑 Stop requested during link search")
+        return False
 
-    if tracks_with_links:
-        logger.info(f"Found {len(tracks_with_links)} links to download.")
+    if unique_links:
+        logger.info(f"Found {len(unique_links)} unique links for {sum(len(ids) for ids in unique_links.values())} tracks.")
         
-        # Group by unique links to avoid duplicate downloads
-        unique_links = {}
-        for track_id, link in tracks_with_links:
-            if link not in unique_links:
-                unique_links[link] = []
-            unique_links[link].append(track_id)
-        
-        # Download each unique link and update all associated tracks
-        for link, track_ids in unique_links.items():
-            # Check if stop was requested
-            if check_stop_flag_direct():
-                logger.info("🛑 Stop requested during download")
-                return False
-            
-            try:
-                logger.info(f"Starting download: {link} (for {len(track_ids)} tracks)")
-                download_single_track_with_streamrip(link)
-                
-                # Update status of all tracks associated with this link
-                for track_id in track_ids:
-                    update_track_status(track_id, 'downloaded')
-                    logger.info(f"Status updated to 'downloaded' for track ID {track_id}")
-                    
-            except Exception as e:
-                logger.error(f"Error during download of {link}: {e}")
-                # Mark tracks as error instead of downloaded
-                for track_id in track_ids:
-                    logger.warning(f"Download failed for track ID {track_id}")
+        # Enqueue into the persistent download queue and wait for the worker pool,
+        # so the post-download rescan still sees the files
+        job_ids = enqueue_downloads(unique_links)
+        logger.info(f"Enqueued {len(job_ids)} download jobs, waiting for workers...")
+        states = wait_for_jobs(job_ids, should_stop=check_stop_flag_direct)
+        if check_stop_flag_direct():
+            logger.info("🛑 Stop requested during download (remaining jobs stay queued)")
+            return False
+
+        done = sum(1 for state in states.values() if state == 'done')
+        failed = len(job_ids) - done
+        logger.info(f"Download jobs finished: {done} completed, {failed} failed")
+        if failed:
+            logger.warning(f"{failed} download jobs did not complete, see /api/download_queue")
         
         return True
     else:
@@ -535,7 +700,7 @@ def rescan_and_update_missing():
         return
 
     try:
-        plex = PlexServer(plex_url, plex_token, timeout=120)
+        plex = get_plex_server(plex_url, plex_token, timeout=120)
         library_name = os.getenv("LIBRARY_NAME", "Musica")
         logger.debug(f"Using library name: {library_name}")
         music_library = plex.library.section(library_name)
@@ -551,6 +716,8 @@ def rescan_and_update_missing():
                 add_track_to_index(track)
                 newly_indexed_count += 1
         
+        # Index rows go through the single DB writer: make them visible before matching against the index
+        flush_db_writes()
         if newly_indexed_count > 0:
             logger.info(f"Added {newly_indexed_count} new tracks to local index.")
         else:
@@ -560,9 +727,10 @@ def rescan_and_update_missing():
         logger.info(f"Verifying {len(tracks_to_verify)} tracks from missing list...")
 
         updated_tracks = []
-        for track_info in tracks_to_verify:
-            if check_track_in_index_smart(track_info[1], track_info[2]):
-                logger.info(f"SUCCESS: Track '{track_info[1]}' is now present. Updating status.")
+        index_matches = match_tracks_batch((track_info[1], track_info[2]) for track_info in tracks_to_verify)
+        for track_info, index_match in zip(tracks_to_verify, index_matches):
+            if index_match['matched']:
+                logger.info(f"SUCCESS: Track '{track_info[1]}' is now present ({index_match['method']}, score {index_match['score']}). Updating status.")
                 update_track_status(track_info[0], 'downloaded')
                 updated_tracks.append(track_info)
         
@@ -582,7 +750,7 @@ def run_cleanup_only():
         user_tokens = [os.getenv("PLEX_TOKEN"), os.getenv("PLEX_TOKEN_USERS")]
         for token in filter(None, user_tokens):
             try:
-                plex = PlexServer(os.getenv("PLEX_URL"), token, timeout=120)
+                plex = get_plex_server(os.getenv("PLEX_URL"), token, timeout=120)
                 logger.info(f"--- Starting cleanup of old playlists for user {token[:4]}... ---")
                 library_name = os.getenv("LIBRARY_NAME", "Musica")
                 logger.debug(f"Using library name: {library_name}")
@@ -627,7 +795,7 @@ def run_selective_sync_cycle(app_state=None, enable_spotify=True, enable_deezer=
     
     gemini_model, gemini_model_name = configure_gemini() if RUN_GEMINI_PLAYLIST_CREATION else (None, "")
     
-    for user_config in user_configs:
+    def _process_user(user_config):
         # Check if stop was requested
         if check_stop_flag_direct():
             logger.info("🛑 Stop requested during sync cycle")
@@ -637,8 +805,6 @@ def run_selective_sync_cycle(app_state=None, enable_spotify=True, enable_deezer=
         name = user_config["name"]
         favorites_playlist_id = user_config["favorites_id"]
 
-        if not token: continue
-
         logger.info(f"--- Processing user: {name} ---")
         user_inputs = UserInputs(
             plex_url=os.getenv("PLEX_URL"), plex_token=token,
@@ -653,11 +819,12 @@ def run_selective_sync_cycle(app_state=None, enable_spotify=True, enable_deezer=
             spotify_user_id=os.getenv("SPOTIFY_USER_ID"), deezer_user_id=os.getenv("DEEZER_USER_ID"),
             deezer_playlist_ids=os.getenv("DEEZER_PLAYLIST_ID_SECONDARY") if name == "secondary user" else os.getenv("DEEZER_PLAYLIST_ID"),
             spotify_playlist_ids=os.getenv("SPOTIFY_PLAYLIST_IDS_SECONDARY") if name == "secondary user" else os.getenv("SPOTIFY_PLAYLIST_IDS"),
-            spotify_categories=[], country=os.getenv("COUNTRY")
+            spotify_categories=[], country=os.getenv("COUNTRY"),
+            sync_workers=int(os.getenv("PLAYLIST_SYNC_WORKERS", 4))
         )
         
         try:
-            plex = PlexServer(user_inputs.plex_url, user_inputs.plex_token, timeout=120)
+            plex = get_plex_server(user_inputs.plex_url, user_inputs.plex_token, timeout=120)
             sync_playlists_for_user_selective(plex, user_inputs, sync_options)
             
             if gemini_model and favorites_playlist_id and enable_ai:
@@ -674,11 +841,26 @@ def run_selective_sync_cycle(app_state=None, enable_spotify=True, enable_deezer=
                         logger.warning(f"⚠️ Issues managing weekly AI playlist for {name}")
                 except Exception as ai_error:
                     logger.error(f"❌ Error managing weekly AI playlist for {name}: {ai_error}")
-                    continue
 
         except Exception as e:
             logger.error(f"Critical error during processing of {name}: {e}", exc_info=True)
 
+    # Gli utenti hanno playlist indipendenti ma condividono indice, cache di risoluzione e missing_tracks:
+    # le pipeline girano in parallelo e una traccia risolta per un utente vale anche per l'altro
+    active_users = [user_config for user_config in user_configs if user_config["token"]]
+    with shared_resolutions_cycle():
+        if len(active_users) > 1 and os.getenv("PARALLEL_USER_SYNC", "1") == "1":
+            logger.info(f"⚡ Processing {len(active_users)} users in parallel")
+            with concurrent.futures.ThreadPoolExecutor(max_workers=len(active_users), thread_name_prefix="user-sync") as executor:
+                list(executor.map(_process_user, active_users))
+        else:
+            for user_config in active_users:
+                _process_user(user_config)
+
+    if check_stop_flag_direct():
+        logger.info("🛑 Stop requested during sync cycle")
+        return
+
     logger.info("Synchronization and AI cycle completed.")
     
     # REFRESH AI PLAYLISTS: Regenerate managed AI playlists with new content from library
@@ -774,9 +956,9 @@ def auto_update_ai_playlists(plex, updated_tracks):
         # Create separate connections for each user
         plex_connections = {}
         if main_token:
-            plex_connections['main'] = PlexServer(plex_url, main_token, timeout=120)
+            plex_connections['main'] = get_plex_server(plex_url, main_token, timeout=120)
         if secondary_token:
-            plex_connections['secondary'] = PlexServer(plex_url, secondary_token, timeout=120)
+            plex_connections['secondary'] = get_plex_server(plex_url, secondary_token, timeout=120)
         
         # Get playlists for each user
         updated_count = 0
@@ -892,7 +1074,7 @@ def refresh_managed_ai_playlists():
         
         # Create connections and UserInputs for each user
         if main_token:
-            plex_connections['main'] = PlexServer(plex_url, main_token, timeout=120)
+            plex_connections['main'] = get_plex_server(plex_url, main_token, timeout=120)
             user_inputs_map['main'] = UserInputs(
                 plex_url=plex_url, plex_token=main_token,
                 plex_token_others=secondary_token,
@@ -912,7 +1094,7 @@ def refresh_managed_ai_playlists():
             )
             
         if secondary_token:
-            plex_connections['secondary'] = PlexServer(plex_url, secondary_token, timeout=120)
+            plex_connections['secondary'] = get_plex_server(plex_url, secondary_token, timeout=120)
             user_inputs_map['secondary'] = UserInputs(
                 plex_url=plex_url, plex_token=secondary_token,
                 plex_token_others=main_token,
@@ -0,0 +1,255 @@
+"""
+Indice inverso n-gram in memoria sopra plex_library_index.
+Restituisce in tempo sub-millisecondo un piccolo insieme ordinato di candidati
+per il fuzzy matching, al posto delle scansioni LIKE '%xxxx%' sull'intera tabella.
+"""
+import os
+import time
+import logging
+import sqlite3
+import threading
+from array import array
+from collections import Counter
+from heapq import nlargest
+from operator import itemgetter
+from typing import Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+GRAM_SIZE = 3
+
+# Numero massimo di candidati restituiti al fuzzy matcher
+CANDIDATE_LIMIT = int(os.getenv("LIBRARY_CANDIDATE_LIMIT", "100"))
+# Ogni quanti secondi verificare se altri processi hanno scritto nuove righe
+REFRESH_SECONDS = int(os.getenv("LIBRARY_CANDIDATE_REFRESH_SECONDS", "30"))
+# Gram presenti in più di questa frazione di righe vengono ignorati (tipo stop-word)
+MAX_GRAM_FREQUENCY = 0.05
+# ...ma ne usiamo sempre almeno questi, i più rari, per non restare senza candidati
+MIN_GRAMS_USED = 2
+
+
+def _grams(text: str) -> set:
+    """Trigrammi di una stringa già pulita, con padding per pesare inizio/fine parola."""
+    if not text:
+        return set()
+    padded = f" {text} "
+    return {padded[i:i + GRAM_SIZE] for i in range(len(padded) - GRAM_SIZE + 1)}
+
+
+class LibraryCandidateIndex:
+    """
+    Indice inverso trigrammi -> righe per title_clean e artist_clean.
+    Gli artisti sono indicizzati una sola volta (artista -> righe) per contenere la memoria.
+    Costruito pigramente al primo utilizzo, aggiornato in modo incrementale dalle scritture.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self._built = False
+        self._max_id = 0
+        self._generation = None
+        self._last_refresh = 0.0
+        self._pairs = {}              # (title, artist) -> posizione riga
+        self._titles: List[str] = []
+        self._row_artist = array('i')  # posizione riga -> id artista
+        self._artists: List[str] = []
+        self._artist_ids = {}          # artista -> id artista
+        self._artist_rows: List[array] = []
+        self._title_postings = {}      # gram -> array di posizioni riga
+        self._artist_postings = {}     # gram -> array di id artista
+
+    # --- Costruzione e aggiornamento ---
+
+    def _add_pair(self, title: str, artist: str):
+        key = (title or '', artist or '')
+        if key in self._pairs:
+            return
+        pos = len(self._titles)
+        self._pairs[key] = pos
+        self._titles.append(key[0])
+
+        aid = self._artist_ids.get(key[1])
+        if aid is None:
+            aid = len(self._artists)
+            self._artist_ids[key[1]] = aid
+            self._artists.append(key[1])
+            self._artist_rows.append(array('i'))
+            for gram in _grams(key[1]):
+                self._artist_postings.setdefault(gram, array('i')).append(aid)
+        self._row_artist.append(aid)
+        self._artist_rows[aid].append(pos)
+
+        for gram in _grams(key[0]):
+            self._title_postings.setdefault(gram, array('i')).append(pos)
+
+    def _load_rows_since(self, min_id: int) -> int:
+        """Carica dal DB le righe con id > min_id. Restituisce il numero di righe lette."""
+        with sqlite3.connect(self.db_path, timeout=30) as con:
+            rows = con.execute(
+                "SELECT id, title_clean, artist_clean FROM plex_library_index WHERE id > ? ORDER BY id",
+                (min_id,)
+            ).fetchall()
+        for row_id, title, artist in rows:
+            self._add_pair(title, artist)
+            if row_id > self._max_id:
+                self._max_id = row_id
+        return len(rows)
+
+    def _read_generation(self, con) -> Optional[str]:
+        """Contatore incrementato quando l'indice viene sostituito (swap staging) o perde righe."""
+        try:
+            row = con.execute("SELECT value FROM library_index_state WHERE key = 'index_generation'").fetchone()
+            return row[0] if row else None
+        except sqlite3.Error:
+            return None
+
+    def _ensure_built(self):
+        if self._built:
+            if time.time() - self._last_refresh >= REFRESH_SECONDS:
+                self._refresh_if_stale()
+            return
+        start = time.time()
+        try:
+            with sqlite3.connect(self.db_path, timeout=30) as con:
+                self._generation = self._read_generation(con)
+            loaded = self._load_rows_since(0)
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Indice candidati non costruibile: {e}")
+            return
+        self._built = True
+        self._last_refresh = time.time()
+        logger.info(f"🧮 Indice candidati n-gram costruito: {loaded} righe, {len(self._titles)} coppie "
+                    f"titolo/artista, {len(self._title_postings)} trigrammi in {time.time() - start:.2f}s")
+
+    def _refresh_if_stale(self):
+        """Recupera le righe inserite da altri processi (script di manutenzione, auto-sync album)."""
+        self._last_refresh = time.time()
+        try:
+            with sqlite3.connect(self.db_path, timeout=30) as con:
+                max_id = con.execute("SELECT MAX(id) FROM plex_library_index").fetchone()[0]
+                generation = self._read_generation(con)
+        except sqlite3.Error as e:
+            logger.debug(f"Verifica aggiornamenti indice candidati fallita: {e}")
+            return
+        if generation != self._generation:
+            logger.info("🧮 Indice libreria sostituito o ridotto da un altro processo: ricarico indice candidati")
+            self._reset()
+            self._ensure_built()
+        elif max_id is None:
+            if self._titles:
+                logger.info("🧮 Tabella indice vuota: reset indice candidati")
+                self._reset()
+                self._built = True
+                self._last_refresh = time.time()
+        elif max_id > self._max_id:
+            loaded = self._load_rows_since(self._max_id)
+            logger.debug(f"🧮 Indice candidati aggiornato con {loaded} nuove righe")
+
+    def add_rows(self, rows: Iterable[Tuple[str, str]]):
+        """Patch incrementale con coppie (title_clean, artist_clean) appena scritte nel DB."""
+        with self.lock:
+            if not self._built:
+                return  # Verrà caricato tutto al primo utilizzo
+            for title, artist in rows:
+                self._add_pair(title, artist)
+
+    def build(self):
+        """Costruisce subito l'indice (es. prima di un matching batch), se non già pronto."""
+        with self.lock:
+            self._ensure_built()
+
+    def is_built(self) -> bool:
+        return self._built
+
+    def invalidate(self):
+        """Scarta l'indice: verrà ricostruito al prossimo utilizzo."""
+        with self.lock:
+            if self._built:
+                logger.info("🧮 Indice candidati invalidato")
+            self._reset()
+
+    # --- Interrogazione ---
+
+    def _count_hits(self, grams: set, postings: dict, population: int) -> Tuple[Counter, int]:
+        """Conta per ogni elemento quanti trigrammi della query contiene, saltando quelli troppo comuni."""
+        lists = sorted((postings[g] for g in grams if g in postings), key=len)
+        max_len = max(1, int(population * MAX_GRAM_FREQUENCY))
+        selected = [p for i, p in enumerate(lists) if i < MIN_GRAMS_USED or len(p) <= max_len]
+        hits = Counter()
+        for posting in selected:
+            hits.update(posting)
+        return hits, len(selected)
+
+    def candidates(self, title_clean: str, artist_clean: str = '', limit: int = CANDIDATE_LIMIT,
+                   title_weight: float = 0.7) -> List[Tuple[str, str]]:
+        """
+        Restituisce fino a `limit` coppie (title_clean, artist_clean) ordinate per
+        sovrapposizione di trigrammi con la query. Stringhe in input già pulite.
+        """
+        with self.lock:
+            self._ensure_built()
+            if not self._titles:
+                return []
+
+            scores = {}
+            title_hits, title_used = Counter(), 0
+            title_grams = _grams(title_clean)
+            if title_grams:
+                title_hits, title_used = self._count_hits(title_grams, self._title_postings, len(self._titles))
+                # Solo le righe che condividono almeno un terzo dei trigrammi, e tra queste
+                # le più promettenti, ricevono un punteggio
+                min_hits = max(1, title_used // 3)
+                promising = [item for item in title_hits.items() if item[1] >= min_hits]
+                for pos, n in nlargest(limit * 3, promising, key=itemgetter(1)):
+                    scores[pos] = title_weight * n / title_used
+
+            artist_grams = _grams(artist_clean)
+            if artist_grams:
+                artist_hits, used = self._count_hits(artist_grams, self._artist_postings, len(self._artists))
+                if used:
+                    artist_weight = 1.0 - title_weight if title_grams else 1.0
+                    for aid, n in nlargest(20, artist_hits.items(), key=itemgetter(1)):
+                        ratio = n / used
+                        if ratio < 0.5:
+                            break
+                        bonus = artist_weight * ratio
+                        for pos in self._artist_rows[aid]:
+                            if pos not in scores:
+                                scores[pos] = title_weight * title_hits.get(pos, 0) / title_used if title_used else 0.0
+                            scores[pos] += bonus
+
+            best = nlargest(limit, scores.items(), key=itemgetter(1))
+            return [(self._titles[pos], self._artists[self._row_artist[pos]]) for pos, _ in best]
+
+    def title_candidates(self, title_clean: str, limit: int = CANDIDATE_LIMIT) -> List[str]:
+        """Candidati basati solo sul titolo (fallback title-only)."""
+        return [title for title, _ in self.candidates(title_clean, '', limit=limit, title_weight=1.0)]
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'built': self._built,
+                'pairs': len(self._titles),
+                'artists': len(self._artists),
+                'title_grams': len(self._title_postings),
+                'max_id': self._max_id,
+            }
+
+
+_candidate_index: Optional[LibraryCandidateIndex] = None
+_candidate_index_lock = threading.Lock()
+
+
+def get_candidate_index() -> LibraryCandidateIndex:
+    """Ottieni l'istanza globale (per processo) dell'indice candidati."""
+    global _candidate_index
+    if _candidate_index is None:
+        with _candidate_index_lock:
+            if _candidate_index is None:
+                from .database import DB_PATH
+                _candidate_index = LibraryCandidateIndex(DB_PATH)
+    return _candidate_index
@@ -6,32 +6,61 @@ import json
 import queue
 import threading
 import time
+import atexit
+import concurrent.futures
 from contextlib import contextmanager
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from datetime import datetime
 from plexapi.server import PlexServer
 from plexapi.exceptions import NotFound
 from plexapi.audio import Track
 
+from .candidate_index import get_candidate_index, CANDIDATE_LIMIT
+
 # Usiamo la cartella 'state_data' che è persistente
 DB_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "state_data", "sync_database.db")
 
+# Indice libreria attivo e tabella di staging usata dalla ricostruzione completa (swap atomico)
+LIBRARY_INDEX_TABLE = "plex_library_index"
+LIBRARY_INDEX_STAGING_TABLE = "plex_library_index_staging"
+
+# Journal mode impostato all'inizializzazione (WAL: le letture non si bloccano dietro le scritture).
+# DELETE per tornare al journal classico, es. su filesystem di rete dove WAL non è supportato.
+DB_JOURNAL_MODE = os.getenv("DB_JOURNAL_MODE", "WAL").upper()
+# Connessioni di sola lettura per le richieste web (Flask) e altri lettori
+DB_READER_POOL_SIZE = int(os.getenv("DB_READER_POOL_SIZE", "8"))
+# Checkpoint WAL periodico (secondi, minimo 1) dallo scrittore unico; oltre questa dimensione il WAL viene troncato.
+# È anche il timeout di attesa dello scrittore inattivo: con 0 o meno il thread girerebbe a vuoto
+DB_CHECKPOINT_INTERVAL = max(1, int(os.getenv("DB_CHECKPOINT_INTERVAL", "60")))
+DB_WAL_TRUNCATE_MB = int(os.getenv("DB_WAL_TRUNCATE_MB", "64"))
+
 class DatabasePool:
     """
     Database connection pool per SQLite con thread safety e ottimizzazioni performance.
     Risolve problemi di concurrent access e migliora le performance del 70%.
+    read_only: connessioni con PRAGMA query_only, limitate a pool_size contemporanee
+    (chi arriva oltre attende una connessione libera; l'attesa viene misurata).
     """
     
-    def __init__(self, db_path: str, pool_size: int = 10, timeout: int = 30):
+    def __init__(self, db_path: str, pool_size: int = 10, timeout: int = 30, read_only: bool = False):
         self.db_path = db_path
         self.pool_size = pool_size
         self.timeout = timeout
+        self.read_only = read_only
         self.pool = queue.Queue(maxsize=pool_size)
         self.lock = threading.Lock()
         self.connections_created = 0
         self.total_connections = 0
+        # Solo il pool di lettura è limitato: le connessioni di scrittura possono essere annidate
+        self._slots = threading.BoundedSemaphore(pool_size) if read_only else None
+        self.in_use = 0
+        self.acquired = 0
+        self.waited = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
         
-        logging.info(f"🔗 Inizializzazione database pool: {pool_size} connessioni, timeout: {timeout}s")
+        kind = "lettura" if read_only else "scrittura"
+        logging.info(f"🔗 Inizializzazione database pool ({kind}): {pool_size} connessioni, timeout: {timeout}s")
         
     def _create_connection(self) -> sqlite3.Connection:
         """Crea una nuova connessione SQLite ottimizzata."""
@@ -48,8 +77,10 @@ class DatabasePool:
             conn.execute("PRAGMA cache_size=50000")
             conn.execute("PRAGMA temp_store=MEMORY")
             conn.execute("PRAGMA busy_timeout=30000")   # 30s busy timeout
+            if self.read_only:
+                conn.execute("PRAGMA query_only=ON")
             
-            # Non toccare journal_mode o mmap_size per evitare transaction conflicts
+            # journal_mode è persistente nel file DB: lo imposta una sola volta initialize_db()
             logging.debug("✅ SQLite ottimizzazioni di base applicate")
         except sqlite3.Error as e:
             logging.warning(f"⚠️ Errore durante ottimizzazioni SQLite: {e}")
@@ -66,6 +97,18 @@ class DatabasePool:
         
     def get_connection(self) -> sqlite3.Connection:
         """Ottieni una connessione dal pool."""
+        if self._slots is not None:
+            wait_start = time.monotonic()
+            if not self._slots.acquire(timeout=self.timeout):
+                raise sqlite3.OperationalError(f"Nessuna connessione di lettura libera dopo {self.timeout}s")
+            waited = time.monotonic() - wait_start
+            with self.lock:
+                self.waited += waited > 0.001
+                self.total_wait += waited
+                self.max_wait = max(self.max_wait, waited)
+        with self.lock:
+            self.acquired += 1
+            self.in_use += 1
         try:
             # Prova a prendere una connessione esistente
             conn = self.pool.get_nowait()
@@ -74,11 +117,24 @@ class DatabasePool:
         except queue.Empty:
             # Pool vuoto, crea nuova connessione
             logging.debug("🔄 Pool vuoto, creo nuova connessione")
-            return self._create_connection()
+            try:
+                return self._create_connection()
+            except Exception:
+                self._release_slot()
+                raise
             
+    def _release_slot(self):
+        with self.lock:
+            self.in_use -= 1
+        if self._slots is not None:
+            self._slots.release()
+
     def return_connection(self, conn: sqlite3.Connection):
         """Restituisci una connessione al pool."""
         try:
+            # Chiude l'eventuale transazione di lettura aperta, così il WAL può essere checkpointato
+            if self.read_only and conn.in_transaction:
+                conn.rollback()
             # Verifica che la connessione sia ancora valida
             conn.execute("SELECT 1").fetchone()
             self.pool.put_nowait(conn)
@@ -87,6 +143,23 @@ class DatabasePool:
             # Pool pieno o connessione danneggiata, chiudi
             logging.debug(f"❌ Chiusura connessione: {e}")
             conn.close()
+        finally:
+            self._release_slot()
+
+    def stats(self) -> Dict[str, Any]:
+        """Connessioni in uso e tempo di attesa per ottenerne una."""
+        with self.lock:
+            return {
+                'read_only': self.read_only,
+                'size': self.pool_size,
+                'in_use': self.in_use,
+                'idle': self.pool.qsize(),
+                'created': self.connections_created,
+                'acquired': self.acquired,
+                'waited': self.waited,
+                'avg_wait_ms': round(self.total_wait / self.acquired * 1000, 2) if self.acquired else 0.0,
+                'max_wait_ms': round(self.max_wait * 1000, 2),
+            }
             
     @contextmanager
     def get_connection_context(self):
@@ -114,79 +187,53 @@ class DatabasePool:
                 break
         logging.info(f"🔒 Chiuse {closed_count} connessioni dal pool")
 
-# Istanza globale del pool
-_db_pool = None
+# Istanza globale del pool di sola lettura (le scritture passano tutte dallo scrittore unico)
+_db_read_pool = None
 
-def get_db_pool() -> DatabasePool:
-    """Ottieni l'istanza globale del database pool."""
-    global _db_pool
-    if _db_pool is None:
-        _db_pool = DatabasePool(DB_PATH)
-    return _db_pool
+def get_db_read_pool() -> DatabasePool:
+    """Pool di sola lettura (query_only), dimensionato sulla concorrenza delle richieste web."""
+    global _db_read_pool
+    if _db_read_pool is None:
+        _db_read_pool = DatabasePool(DB_PATH, pool_size=DB_READER_POOL_SIZE, read_only=True)
+    return _db_read_pool
 
 @contextmanager
 def get_db_connection():
-    """Context manager per ottenere connessioni dal pool."""
-    pool = get_db_pool()
-    with pool.get_connection_context() as conn:
-        yield conn
-
-class DatabaseTransaction:
     """
-    Context manager per transazioni atomiche robuste.
-    Garantisce 90% riduzione crash e timeout con retry automatico.
+    Connessione per blocchi che scrivono: è quella dello scrittore unico (vedi writer_connection),
+    con righe sqlite3.Row. Per le sole letture usare get_db_read_connection.
     """
-    
-    def __init__(self, max_retries: int = 3, retry_delay: float = 0.1):
-        self.max_retries = max_retries
-        self.retry_delay = retry_delay
-        self.conn = None
-        
-    def __enter__(self):
-        for attempt in range(self.max_retries):
-            try:
-                self.conn = get_db_pool().get_connection()
-                self.conn.execute("BEGIN IMMEDIATE")  # Lock esclusivo immediato
-                return self.conn.cursor()
-            except sqlite3.OperationalError as e:
-                if "database is locked" in str(e).lower() and attempt < self.max_retries - 1:
-                    logging.warning(f"⏳ Database locked, retry {attempt + 1}/{self.max_retries} in {self.retry_delay}s")
-                    time.sleep(self.retry_delay * (2 ** attempt))  # Exponential backoff
-                    continue
-                raise
-        raise sqlite3.OperationalError("Failed to acquire database lock after retries")
-        
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        try:
-            if exc_type is None:
-                self.conn.commit()
-                logging.debug("✅ Transazione completata con successo")
-            else:
-                self.conn.rollback()
-                logging.warning(f"🔄 Transazione rollback: {exc_type.__name__}: {exc_val}")
-        except Exception as e:
-            logging.error(f"❌ Errore in transazione cleanup: {e}")
-        finally:
-            if self.conn:
-                get_db_pool().return_connection(self.conn)
+    with writer_connection() as conn:
+        yield conn
+
+@contextmanager
+def get_db_read_connection():
+    """Come get_db_connection ma dal pool di sola lettura: qualsiasi scrittura fallisce."""
+    pool = get_db_read_pool()
+    with pool.get_connection_context() as conn:
+        yield conn
 
 @contextmanager
 def atomic_transaction(max_retries: int = 3):
-    """Context manager semplificato per transazioni atomiche."""
-    with DatabaseTransaction(max_retries=max_retries) as cursor:
-        yield cursor
+    """
+    Context manager semplificato per transazioni atomiche: il blocco gira nella transazione
+    dello scrittore unico (che gestisce anche i retry sui lock, max_retries resta per compatibilità).
+    """
+    with writer_connection() as conn:
+        yield conn.cursor()
 
 def execute_with_retry(query: str, params: tuple = (), max_retries: int = 3) -> any:
     """
     Esegue una query con retry automatico per gestire lock e timeout.
-    Aumenta stabilità del 90% riducendo errori transitori.
+    Le SELECT usano il pool di lettura, le altre istruzioni lo scrittore unico.
     """
+    is_select = query.strip().upper().startswith('SELECT')
     for attempt in range(max_retries):
         try:
-            with get_db_connection() as conn:
+            with (get_db_read_connection() if is_select else writer_connection()) as conn:
                 cursor = conn.cursor()
                 cursor.execute(query, params)
-                return cursor.fetchall() if query.strip().upper().startswith('SELECT') else cursor.rowcount
+                return cursor.fetchall() if is_select else cursor.rowcount
         except sqlite3.OperationalError as e:
             if ("database is locked" in str(e).lower() or "timeout" in str(e).lower()) and attempt < max_retries - 1:
                 delay = 0.1 * (2 ** attempt)  # Exponential backoff
@@ -200,6 +247,380 @@ def execute_with_retry(query: str, params: tuple = (), max_retries: int = 3) ->
     
     raise sqlite3.OperationalError(f"Query failed after {max_retries} retries")
 
+# Scrittore unico: operazioni per transazione e attesa massima (ms) prima del commit di un lotto
+DB_WRITER_BATCH_SIZE = int(os.getenv("DB_WRITER_BATCH_SIZE", "200"))
+DB_WRITER_FLUSH_MS = int(os.getenv("DB_WRITER_FLUSH_MS", "50"))
+
+def _is_lock_error(error: Exception) -> bool:
+    message = str(error).lower()
+    return "locked" in message or "busy" in message
+
+class DatabaseWriter:
+    """
+    Thread scrittore unico per le scritture frequenti (tracce mancanti, stati, indice libreria).
+    Possiede l'unica connessione di scrittura e raggruppa le richieste in transazioni:
+    commit ogni DB_WRITER_BATCH_SIZE operazioni o dopo DB_WRITER_FLUSH_MS, invece di un
+    connect + fsync per riga. Ogni operazione gira in un savepoint, così un errore non annulla
+    le altre del lotto; il Future restituito si risolve solo dopo il commit.
+    """
+
+    def __init__(self, db_path: str, batch_size: int = DB_WRITER_BATCH_SIZE, flush_ms: int = DB_WRITER_FLUSH_MS):
+        self.db_path = db_path
+        self.batch_size = max(1, batch_size)
+        self.flush_seconds = max(0, flush_ms) / 1000
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self._thread = None
+        self.ops = 0
+        self.failed_ops = 0
+        self.commits = 0
+        self.lock_retries = 0
+        self.largest_batch = 0
+        self.checkpoints = 0
+        self.last_checkpoint = None    # (busy, frame nel WAL, frame checkpointati)
+        self.last_checkpoint_at = None
+        self._dirty = False            # Commit dopo l'ultimo checkpoint
+
+    def submit(self, op, *args) -> concurrent.futures.Future:
+        """Accoda op(cursor, *args); il Future riceve il valore restituito o l'eccezione."""
+        future = concurrent.futures.Future()
+        with self.lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+                self._thread.start()
+        self.queue.put((op, args, future))
+        return future
+
+    def in_writer_thread(self) -> bool:
+        return self._thread is not None and threading.current_thread() is self._thread
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Attende il commit di tutte le scritture accodate finora. False se scade il timeout."""
+        if getattr(_writer_local, 'conn', None) is not None or self.in_writer_thread():
+            raise RuntimeError("flush_db_writes() dentro un blocco writer_connection: il commit avviene all'uscita del blocco")
+        try:
+            self.submit(lambda cur: None).result(timeout=timeout)
+            return True
+        except concurrent.futures.TimeoutError:
+            return False
+
+    def stop(self, timeout: float = 5.0):
+        """Svuota la coda e ferma il thread (usato all'uscita del processo)."""
+        with self.lock:
+            thread = self._thread
+        if thread is not None and thread.is_alive():
+            self.queue.put(None)
+            thread.join(timeout=timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                'queue_depth': self.queue.qsize(),
+                'ops': self.ops,
+                'failed_ops': self.failed_ops,
+                'commits': self.commits,
+                'avg_batch': round(self.ops / self.commits, 1) if self.commits else 0.0,
+                'largest_batch': self.largest_batch,
+                'lock_retries': self.lock_retries,
+                'running': self._thread is not None and self._thread.is_alive(),
+                'checkpoints': self.checkpoints,
+            }
+
+    def checkpoint_stats(self) -> Dict[str, Any]:
+        """Ultimo checkpoint WAL: frame rimasti da riportare nel DB (lag) ed età."""
+        with self.lock:
+            busy, log_frames, checkpointed = self.last_checkpoint or (0, 0, 0)
+            return {
+                'checkpoints': self.checkpoints,
+                'last_busy': bool(busy),
+                'last_log_frames': log_frames,
+                'last_lag_frames': max(0, log_frames - checkpointed),
+                'seconds_since_checkpoint': round(time.time() - self.last_checkpoint_at, 1) if self.last_checkpoint_at else None,
+            }
+
+    def _checkpoint(self, conn: sqlite3.Connection):
+        """
+        PASSIVE: riporta nel DB le pagine del WAL senza aspettare i lettori.
+        TRUNCATE (attende i lettori per poco) solo quando il WAL supera DB_WAL_TRUNCATE_MB.
+        """
+        try:
+            wal_size = os.path.getsize(f"{self.db_path}-wal")
+        except OSError:
+            wal_size = 0
+        mode = "TRUNCATE" if wal_size > DB_WAL_TRUNCATE_MB * 1024 * 1024 else "PASSIVE"
+        try:
+            if mode == "TRUNCATE":
+                conn.execute("PRAGMA busy_timeout=2000")
+            result = tuple(conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone())
+        except sqlite3.Error as e:
+            logging.warning(f"⚠️ Checkpoint WAL ({mode}) fallito: {e}")
+            return
+        finally:
+            if mode == "TRUNCATE":
+                conn.execute("PRAGMA busy_timeout=30000")
+        with self.lock:
+            self.checkpoints += 1
+            self.last_checkpoint = result
+            self.last_checkpoint_at = time.time()
+            self._dirty = False
+        if mode == "TRUNCATE" or result[0]:
+            logging.info(f"🧹 Checkpoint WAL {mode}: WAL {wal_size // 1024} KB, esito {result}")
+
+    def _checkpoint_due(self) -> bool:
+        with self.lock:
+            return self._dirty and (self.last_checkpoint_at is None
+                                    or time.time() - self.last_checkpoint_at >= DB_CHECKPOINT_INTERVAL)
+
+    def _connect(self) -> sqlite3.Connection:
+        # Transazioni gestite a mano (BEGIN IMMEDIATE / COMMIT)
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA busy_timeout=30000")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _run(self):
+        conn = None
+        stopping = False
+        while not stopping:
+            try:
+                # Da fermo si sveglia comunque per il checkpoint periodico del WAL
+                item = self.queue.get(timeout=DB_CHECKPOINT_INTERVAL)
+            except queue.Empty:
+                if conn is not None and self._checkpoint_due():
+                    self._checkpoint(conn)
+                continue
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.flush_seconds
+            while len(batch) < self.batch_size:
+                try:
+                    item = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            conn = self._commit_batch(conn, batch)
+            if conn is not None and self._checkpoint_due():
+                self._checkpoint(conn)
+        if conn is not None:
+            conn.close()
+
+    def _commit_batch(self, conn: Optional[sqlite3.Connection], batch: list) -> Optional[sqlite3.Connection]:
+        max_retries = 3
+        for attempt in range(max_retries):
+            outcomes = []
+            try:
+                if conn is None:
+                    conn = self._connect()
+                conn.execute("BEGIN IMMEDIATE")
+                cur = conn.cursor()
+                for op, args, future in batch:
+                    cur.execute("SAVEPOINT write_op")
+                    try:
+                        outcomes.append((future, op(cur, *args), None))
+                        cur.execute("RELEASE write_op")
+                    except Exception as e:
+                        if isinstance(e, sqlite3.OperationalError) and _is_lock_error(e):
+                            raise
+                        cur.execute("ROLLBACK TO write_op")
+                        cur.execute("RELEASE write_op")
+                        outcomes.append((future, None, e))
+                conn.execute("COMMIT")
+                break
+            except sqlite3.Error as e:
+                try:
+                    if conn is not None and conn.in_transaction:
+                        conn.execute("ROLLBACK")
+                except sqlite3.Error:
+                    conn.close()
+                    conn = None
+                if _is_lock_error(e) and attempt < max_retries - 1:
+                    with self.lock:
+                        self.lock_retries += 1
+                    logging.warning(f"⏳ Scrittore DB: database locked, ritento il lotto di {len(batch)} operazioni ({attempt + 1}/{max_retries})")
+                    time.sleep(0.1 * (2 ** attempt))
+                    continue
+                logging.error(f"❌ Scrittore DB: lotto di {len(batch)} operazioni fallito: {e}")
+                outcomes = [(future, None, e) for _, _, future in batch]
+                break
+
+        failed = sum(1 for _, _, error in outcomes if error is not None)
+        with self.lock:
+            self.ops += len(batch)
+            self.failed_ops += failed
+            if failed < len(batch):
+                self.commits += 1
+                self._dirty = True
+            self.largest_batch = max(self.largest_batch, len(batch))
+        for future, result, error in outcomes:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+        return conn
+
+_db_writer = None
+_db_writer_lock = threading.Lock()
+
+def get_db_writer() -> DatabaseWriter:
+    """Ottieni lo scrittore DB globale (il thread parte alla prima scrittura)."""
+    global _db_writer
+    if _db_writer is None:
+        with _db_writer_lock:
+            if _db_writer is None:
+                _db_writer = DatabaseWriter(DB_PATH)
+                atexit.register(_db_writer.stop)
+    return _db_writer
+
+def submit_db_write(op, *args, description: str = "scrittura") -> concurrent.futures.Future:
+    """
+    Accoda una scrittura sullo scrittore unico. Gli errori vengono sempre loggati, quindi chi
+    non ha bisogno di conferma può ignorare il Future; chi ne ha bisogno chiama .result().
+    """
+    future = get_db_writer().submit(op, *args)
+
+    def _log_error(done: concurrent.futures.Future):
+        if done.exception() is not None:
+            logging.error(f"Errore DB ({description}): {done.exception()}")
+
+    future.add_done_callback(_log_error)
+    return future
+
+def flush_db_writes(timeout: Optional[float] = None) -> bool:
+    """Barriera: attende che le scritture accodate finora siano visibili ai lettori."""
+    return get_db_writer().flush(timeout)
+
+# Connessione dello scrittore prestata al thread che sta eseguendo un blocco writer_connection
+_writer_local = threading.local()
+
+class _BlockAborted(Exception):
+    """Il blocco writer_connection è terminato con un errore: lo scrittore annulla il suo savepoint."""
+
+class _WriterConnection:
+    """
+    Vista sulla connessione dello scrittore per un blocco with: cursori con la row_factory richiesta
+    (senza toccare la connessione condivisa); commit e rollback li fa lo scrittore all'uscita del blocco.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, row_factory):
+        self._conn = conn
+        self.row_factory = row_factory
+
+    def cursor(self) -> sqlite3.Cursor:
+        cur = self._conn.cursor()
+        cur.row_factory = self.row_factory
+        return cur
+
+    def execute(self, sql: str, parameters=()) -> sqlite3.Cursor:
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql: str, seq_of_parameters) -> sqlite3.Cursor:
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    @property
+    def total_changes(self) -> int:
+        return self._conn.total_changes
+
+    def commit(self):
+        """Nessun effetto: il commit avviene quando il blocco with termina senza errori."""
+
+@contextmanager
+def writer_connection(row_factory=sqlite3.Row):
+    """
+    Esegue un blocco di scritture sincrono sulla connessione dello scrittore unico, dentro la sua
+    transazione: il thread scrittore resta fermo finché il blocco non termina, poi fa il commit.
+    Un'eccezione nel blocco annulla solo le sue scritture. Così nessuna scrittura compete per il lock
+    del database con lo scrittore. I blocchi annidati nello stesso thread condividono la transazione;
+    dentro il blocco non si può attendere lo scrittore (flush_db_writes, Future.result()).
+    """
+    held = getattr(_writer_local, 'conn', None)
+    if held is not None:
+        yield _WriterConnection(held, row_factory)
+        return
+    writer = get_db_writer()
+    if writer.in_writer_thread():
+        raise RuntimeError("writer_connection() non può essere usato da un'operazione dello scrittore")
+
+    entered, release = threading.Event(), threading.Event()
+    state = {}
+
+    def _hold(cur):
+        if 'finished' in state:
+            # Lotto ritentato dopo che il blocco era già terminato: le sue scritture sono andate perse
+            raise sqlite3.DatabaseError("lotto dello scrittore ritentato dopo un blocco writer_connection")
+        state['conn'] = cur.connection
+        entered.set()
+        release.wait()
+        if 'error' in state:
+            raise _BlockAborted(state['error'])
+
+    future = writer.submit(_hold)
+    future.add_done_callback(lambda _: entered.set())
+    entered.wait()
+    if 'conn' not in state:
+        future.result()  # Lotto fallito prima di arrivare al blocco (es. database bloccato da un altro processo)
+    _writer_local.conn = state['conn']
+    try:
+        yield _WriterConnection(state['conn'], row_factory)
+    except BaseException as e:
+        state['error'] = e
+        raise
+    finally:
+        _writer_local.conn = None
+        state['finished'] = True
+        release.set()
+    future.result()  # Attende il commit
+
+def get_db_writer_stats() -> Dict[str, Any]:
+    return get_db_writer().stats()
+
+def _configure_journal_mode():
+    """
+    Imposta DB_JOURNAL_MODE (persistente nel file DB). Va fatto prima di aprire altre connessioni:
+    se non riesce (DB occupato o filesystem senza memoria condivisa) resta il journal attuale.
+    """
+    con = sqlite3.connect(DB_PATH, timeout=30)
+    try:
+        mode = con.execute(f"PRAGMA journal_mode={DB_JOURNAL_MODE}").fetchone()[0].upper()
+        if mode == "WAL":
+            # synchronous=NORMAL è sicuro con WAL: un crash può perdere solo gli ultimi commit, mai corrompere
+            con.execute("PRAGMA synchronous=NORMAL")
+        if mode != DB_JOURNAL_MODE:
+            logging.warning(f"⚠️ Journal mode {DB_JOURNAL_MODE} non attivabile, il database resta in {mode}")
+        else:
+            logging.info(f"📒 Database in journal mode {mode}")
+    except sqlite3.Error as e:
+        logging.warning(f"⚠️ Impossibile impostare journal mode {DB_JOURNAL_MODE}: {e}")
+    finally:
+        con.close()
+
+def _applied_journal_mode() -> str:
+    """Journal mode effettivamente in uso nel file DB (può differire da DB_JOURNAL_MODE se non attivabile)."""
+    try:
+        with get_db_read_connection() as con:
+            return con.execute("PRAGMA journal_mode").fetchone()[0].upper()
+    except sqlite3.Error as e:
+        logging.warning(f"⚠️ Lettura journal mode non riuscita: {e}")
+        return "UNKNOWN"
+
+def get_database_stats() -> Dict[str, Any]:
+    """Pool (attese per connessione), WAL (dimensione e lag dell'ultimo checkpoint) e scrittore unico."""
+    try:
+        wal_bytes = os.path.getsize(f"{DB_PATH}-wal")
+    except OSError:
+        wal_bytes = 0
+    wal = get_db_writer().checkpoint_stats()
+    wal['wal_bytes'] = wal_bytes
+    return {
+        'journal_mode': _applied_journal_mode(),
+        'reader_pool': get_db_read_pool().stats(),
+        'writer': get_db_writer_stats(),
+        'wal': wal,
+    }
+
 def initialize_db():
     """Crea o aggiorna le tabelle necessarie nel database con controlli robusti."""
     try:
@@ -214,6 +635,8 @@ def initialize_db():
             logging.error(f"❌ Nessun permesso di scrittura in {db_dir}")
             raise PermissionError(f"Cannot write to {db_dir}")
         
+        _configure_journal_mode()
+        
         # Usa il nuovo connection pool per l'inizializzazione
         with get_db_connection() as con:
             cur = con.cursor()
@@ -288,6 +711,83 @@ def initialize_db():
                 )
             """)
             
+            # Colonne per l'indicizzazione incrementale (delta): ratingKey Plex e updatedAt (epoch)
+            try:
+                cur.execute("ALTER TABLE plex_library_index ADD COLUMN rating_key INTEGER;")
+            except sqlite3.OperationalError:
+                pass # La colonna esiste già
+                
+            try:
+                cur.execute("ALTER TABLE plex_library_index ADD COLUMN updated_at INTEGER;")
+            except sqlite3.OperationalError:
+                pass # La colonna esiste già
+            
+            # Stato persistente dell'indicizzazione (high-water mark, totale Plex all'ultima riconciliazione)
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS library_index_state (
+                    key TEXT PRIMARY KEY,
+                    value TEXT,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
+            # Cache persistente traccia sorgente -> ratingKey Plex (evita le ricerche Plex a ogni sync)
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS plex_resolution_cache (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    title_clean TEXT NOT NULL,
+                    artist_clean TEXT NOT NULL,
+                    album_clean TEXT NOT NULL DEFAULT '',
+                    source_track_id TEXT,
+                    rating_key INTEGER NOT NULL,
+                    confidence REAL,
+                    resolved_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    UNIQUE(title_clean, artist_clean, album_clean)
+                )
+            """)
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_resolution_rating_key ON plex_resolution_cache (rating_key)")
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_resolution_source_id ON plex_resolution_cache (source_track_id)")
+
+            # Cache delle ricerche Deezer, incluse quelle senza risultato (TTL più breve)
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS deezer_search_cache (
+                    kind TEXT NOT NULL, -- 'track_link', 'album_link', 'potential_tracks'
+                    query_key TEXT NOT NULL,
+                    result_json TEXT,
+                    found BOOLEAN NOT NULL,
+                    created_at REAL NOT NULL,
+                    expires_at REAL NOT NULL,
+                    PRIMARY KEY (kind, query_key)
+                )
+            """)
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_deezer_search_cache_expires ON deezer_search_cache (expires_at)")
+
+            # Coda persistente dei download (sopravvive ai riavvii del container)
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS download_jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    link TEXT NOT NULL,
+                    track_ids TEXT NOT NULL DEFAULT '[]', -- ID missing_tracks serviti da questo link (JSON)
+                    state TEXT NOT NULL DEFAULT 'queued', -- queued, running, done, failed, dead
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    max_attempts INTEGER NOT NULL DEFAULT 3,
+                    lease_owner TEXT,
+                    lease_expires REAL,
+                    available_at REAL NOT NULL DEFAULT 0, -- prossimo tentativo (backoff dopo un errore)
+                    last_error TEXT,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL
+                )
+            """)
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_download_jobs_state ON download_jobs (state, available_at)")
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_download_jobs_finished ON download_jobs (finished_at)")
+            # Un solo job attivo per link: i nuovi ID traccia si accodano a quello esistente
+            cur.execute("""
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_download_jobs_active_link
+                ON download_jobs (link) WHERE state IN ('queued', 'running', 'failed')
+            """)
+
             # --- NUOVA TABELLA PER LE PLAYLIST AI PERMANENTI ---
             cur.execute("""
                 CREATE TABLE IF NOT EXISTS managed_ai_playlists (
@@ -304,19 +804,12 @@ def initialize_db():
             # Crea indici ottimizzati per performance (70% miglioramento query)
             logging.info("🔍 Creazione indici database ottimizzati...")
             
-            # Indici principali per ricerca tracce (query più frequenti)
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_library_artist_title ON plex_library_index (artist_clean, title_clean)")
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_library_title_clean ON plex_library_index (title_clean)")
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_library_artist_clean ON plex_library_index (artist_clean)")
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_library_album_clean ON plex_library_index (album_clean)")
-            
-            # Indice composito per fuzzy matching ottimizzato
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_library_composite ON plex_library_index (artist_clean, album_clean, title_clean)")
-            
-            # Indici per filtering e sorting
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_library_year ON plex_library_index (year)")
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_library_added_at ON plex_library_index (added_at)")
-            
+            # Indici dell'indice libreria (ricerca tracce, fuzzy matching, filtering, ratingKey)
+            _create_library_index_indexes(cur)
+
+            # Tabella ombra FTS5 per la ricerca dei candidati (al posto delle scansioni LIKE '%...%')
+            _create_library_fts(cur)
+
             # Indici per missing_tracks (operazioni CRUD frequenti)
             cur.execute("CREATE INDEX IF NOT EXISTS idx_missing_tracks_title_artist ON missing_tracks (title, artist)")
             cur.execute("CREATE INDEX IF NOT EXISTS idx_missing_tracks_status ON missing_tracks (status)")
@@ -375,6 +868,34 @@ def initialize_db():
             except sqlite3.OperationalError:
                 pass # La colonna esiste già
             
+            # Colonne per saltare le playlist sorgente invariate (snapshot_id Spotify / checksum Deezer)
+            try:
+                cur.execute("ALTER TABLE user_playlist_selections ADD COLUMN source_snapshot TEXT;")
+                logging.info("✅ Aggiunta colonna source_snapshot per sync incrementale playlist")
+            except sqlite3.OperationalError:
+                pass # La colonna esiste già
+                
+            try:
+                cur.execute("ALTER TABLE user_playlist_selections ADD COLUMN synced_library_state TEXT;")
+            except sqlite3.OperationalError:
+                pass # La colonna esiste già
+                
+            try:
+                cur.execute("ALTER TABLE user_playlist_selections ADD COLUMN synced_missing_count INTEGER;")
+            except sqlite3.OperationalError:
+                pass # La colonna esiste già
+                
+            # Playlist Plex scritta all'ultimo sync: se sparisce o cambia numero di voci va risincronizzata
+            try:
+                cur.execute("ALTER TABLE user_playlist_selections ADD COLUMN synced_plex_rating_key INTEGER;")
+            except sqlite3.OperationalError:
+                pass # La colonna esiste già
+                
+            try:
+                cur.execute("ALTER TABLE user_playlist_selections ADD COLUMN synced_plex_item_count INTEGER;")
+            except sqlite3.OperationalError:
+                pass # La colonna esiste già
+            
             # Indici per user_playlist_selections (per performance nelle query)
             cur.execute("CREATE INDEX IF NOT EXISTS idx_playlist_selections_user_service ON user_playlist_selections (user_type, service)")
             cur.execute("CREATE INDEX IF NOT EXISTS idx_playlist_selections_selected ON user_playlist_selections (user_type, service, is_selected)")
@@ -422,7 +943,7 @@ def get_managed_ai_playlist_by_id(playlist_id: int) -> Dict:
 def add_managed_ai_playlist(playlist_info: Dict[str, Any]):
     """Aggiunge una nuova playlist AI permanente al database."""
     try:
-        with sqlite3.connect(DB_PATH) as con:
+        with writer_connection(None) as con:
             cur = con.cursor()
             cur.execute("""
                 INSERT INTO managed_ai_playlists (plex_rating_key, title, description, user, tracklist_json)
@@ -443,8 +964,7 @@ def get_managed_ai_playlists_for_user(user: str) -> List[Dict]:
     """Recupera tutte le playlist AI permanenti per un dato utente con dettagli aggiuntivi."""
     playlists = []
     try:
-        with sqlite3.connect(DB_PATH) as con:
-            con.row_factory = sqlite3.Row
+        with get_db_read_connection() as con:
             cur = con.cursor()
             # Selezioniamo tutte le colonne che ci servono
             res = cur.execute("SELECT id, title, description, tracklist_json, created_at FROM managed_ai_playlists WHERE user = ? ORDER BY created_at DESC", (user,))
@@ -472,7 +992,7 @@ def get_managed_ai_playlists_for_user(user: str) -> List[Dict]:
 def delete_managed_ai_playlist(playlist_id: int):
     """Elimina una playlist AI permanente dal database."""
     try:
-        with sqlite3.connect(DB_PATH) as con:
+        with writer_connection(None) as con:
             cur = con.cursor()
             cur.execute("DELETE FROM managed_ai_playlists WHERE id = ?", (playlist_id,))
             con.commit()
@@ -484,7 +1004,7 @@ def delete_managed_ai_playlist(playlist_id: int):
 def update_managed_ai_playlist_content(playlist_id: int, new_tracklist_json: str):
     """Aggiorna il contenuto di una playlist AI gestita con nuove tracce."""
     try:
-        with sqlite3.connect(DB_PATH) as con:
+        with writer_connection(None) as con:
             cur = con.cursor()
             cur.execute(
                 "UPDATE managed_ai_playlists SET tracklist_json = ? WHERE id = ?", 
@@ -508,24 +1028,34 @@ def get_managed_playlist_details(playlist_db_id: int) -> Optional[Dict]:
         logging.error(f"Errore nel recuperare i dettagli della playlist AI ID {playlist_db_id} dal DB: {e}")
         return None
 
-def add_missing_track(track_info: Dict[str, Any]):
-    """Aggiunge una traccia al database, includendo titolo e ID della playlist di origine."""
-    try:
-        with sqlite3.connect(DB_PATH) as con:
-            cur = con.cursor()
-            cur.execute("""
-                INSERT OR IGNORE INTO missing_tracks (title, artist, album, source_playlist_title, source_playlist_id)
-                VALUES (?, ?, ?, ?, ?)
-            """, (
-                track_info['title'], 
-                track_info['artist'], 
-                track_info['album'], 
-                track_info['source_playlist_title'], 
-                track_info['source_playlist_id']
-            ))
-            con.commit()
-    except Exception as e:
-        logging.error(f"Errore nell'aggiungere la traccia mancante al DB: {e}")
+_MISSING_TRACK_INSERT_SQL = """
+    INSERT OR IGNORE INTO missing_tracks (title, artist, album, source_playlist_title, source_playlist_id)
+    VALUES (?, ?, ?, ?, ?)
+"""
+
+def _missing_track_row(track_info: Dict[str, Any]) -> tuple:
+    return (track_info['title'], track_info['artist'], track_info['album'],
+            track_info['source_playlist_title'], track_info['source_playlist_id'])
+
+def _insert_missing_tracks(cur, tracks_info: List[Dict[str, Any]]) -> int:
+    before = cur.connection.total_changes
+    cur.executemany(_MISSING_TRACK_INSERT_SQL, [_missing_track_row(t) for t in tracks_info])
+    return cur.connection.total_changes - before
+
+def add_missing_track(track_info: Dict[str, Any]) -> concurrent.futures.Future:
+    """
+    Aggiunge una traccia al database, includendo titolo e ID della playlist di origine.
+    La scrittura passa dallo scrittore unico: il Future si risolve dopo il commit.
+    """
+    return submit_db_write(_insert_missing_tracks, [track_info], description="traccia mancante")
+
+def add_missing_tracks(tracks_info: List[Dict[str, Any]]) -> concurrent.futures.Future:
+    """
+    Come add_missing_track ma per un lotto di tracce nella stessa transazione.
+    Il Future restituisce il numero di righe effettivamente inserite (i duplicati vengono ignorati).
+    """
+    return submit_db_write(_insert_missing_tracks, list(tracks_info),
+                           description=f"{len(tracks_info)} tracce mancanti")
 
 def add_missing_track_if_not_exists(title: str, artist: str, album: str = "", source_playlist: str = "", source_type: str = ""):
     """
@@ -533,7 +1063,7 @@ def add_missing_track_if_not_exists(title: str, artist: str, album: str = "", so
     Supporta sia playlist sync che playlist AI.
     """
     try:
-        with sqlite3.connect(DB_PATH) as con:
+        with writer_connection(None) as con:
             cur = con.cursor()
             
             # Controlla se la traccia esiste già nelle missing tracks
@@ -572,18 +1102,17 @@ def add_missing_track_if_not_exists(title: str, artist: str, album: str = "", so
     except Exception as e:
         logging.error(f"Errore nell'aggiungere la traccia mancante: {e}")
 
-def delete_missing_track(track_id: int):
+def _delete_missing_track(cur, track_id: int):
+    cur.execute("DELETE FROM missing_tracks WHERE id = ?", (track_id,))
+    logging.info(f"Traccia mancante con ID {track_id} eliminata permanentemente dal database.")
+
+def delete_missing_track(track_id: int) -> concurrent.futures.Future:
     """
     Elimina permanentemente una traccia dalla tabella dei brani mancanti.
+    Restituisce il Future dello scrittore unico (risolto dopo il commit).
     """
-    try:
-        with sqlite3.connect(DB_PATH) as con:
-            cur = con.cursor()
-            cur.execute("DELETE FROM missing_tracks WHERE id = ?", (track_id,))
-            con.commit()
-            logging.info(f"Traccia mancante con ID {track_id} eliminata permanentemente dal database.")
-    except Exception as e:
-        logging.error(f"Errore nell'eliminare la traccia mancante ID {track_id} dal DB: {e}")
+    return submit_db_write(_delete_missing_track, track_id,
+                           description=f"eliminazione traccia mancante ID {track_id}")
         
         
 def get_missing_tracks():
@@ -593,21 +1122,20 @@ def get_missing_tracks():
             logging.warning(f"Database non trovato al path: {DB_PATH}. Inizializzazione...")
             initialize_db()
         
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
         # Verifica se la tabella esiste
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='missing_tracks'")
-        if not cursor.fetchone():
+        with get_db_read_connection() as read_con:
+            table_exists = read_con.execute(
+                "SELECT name FROM sqlite_master WHERE type='table' AND name='missing_tracks'").fetchone()
+        if not table_exists:
             logging.warning("Tabella missing_tracks non trovata. Inizializzazione...")
-            conn.close()
             initialize_db()
-            conn = sqlite3.connect(DB_PATH)
-            cursor = conn.cursor()
         
-        cursor.execute("SELECT * FROM missing_tracks WHERE status = 'missing' OR status IS NULL ORDER BY id DESC")
-        rows = cursor.fetchall()
-        conn.close()
+        with get_db_read_connection() as read_con:
+            # Tuple semplici, come le restituisce sqlite3 senza row_factory (i chiamanti le serializzano)
+            read_cur = read_con.cursor()
+            read_cur.row_factory = None
+            read_cur.execute("SELECT * FROM missing_tracks WHERE status = 'missing' OR status IS NULL ORDER BY id DESC")
+            rows = read_cur.fetchall()
         logging.info(f"Recuperate {len(rows)} tracce mancanti dal database")
         
         # Debug: log ALL tracks to see if Reggae tracks are there
@@ -616,13 +1144,15 @@ def get_missing_tracks():
             logging.info(f"   {i+1}. ID={row[0]}, Title='{row[1]}', Artist='{row[2]}', Playlist='{row[4] if len(row)>4 else 'N/A'}'")
         
         # Debug: search specifically for missing Reggae Vibes tracks
-        cursor = sqlite3.connect(DB_PATH).cursor()
-        cursor.execute("SELECT * FROM missing_tracks WHERE source_playlist_title LIKE '%Reggae Vibes%' AND (status = 'missing' OR status IS NULL)")
-        missing_reggae_tracks = cursor.fetchall()
-        
-        # Also check for any Reggae tracks with invalid status values
-        cursor.execute("SELECT * FROM missing_tracks WHERE source_playlist_title LIKE '%Reggae Vibes%' AND status NOT IN ('missing', 'downloaded', 'resolved_manual')")
-        invalid_reggae_tracks = cursor.fetchall()
+        with get_db_read_connection() as read_con:
+            read_cur = read_con.cursor()
+            read_cur.row_factory = None
+            read_cur.execute("SELECT * FROM missing_tracks WHERE source_playlist_title LIKE '%Reggae Vibes%' AND (status = 'missing' OR status IS NULL)")
+            missing_reggae_tracks = read_cur.fetchall()
+            
+            # Also check for any Reggae tracks with invalid status values
+            read_cur.execute("SELECT * FROM missing_tracks WHERE source_playlist_title LIKE '%Reggae Vibes%' AND status NOT IN ('missing', 'downloaded', 'resolved_manual')")
+            invalid_reggae_tracks = read_cur.fetchall()
         
         if missing_reggae_tracks:
             logging.info(f"🎵 DEBUG: Tracce Reggae Vibes MANCANTI ({len(missing_reggae_tracks)}):")
@@ -642,8 +1172,11 @@ def get_missing_tracks():
                 logging.info(f"✅ Status corretto per {fixed_count} tracce totali")
                 
                 # Re-query the data after fix
-                cursor.execute("SELECT * FROM missing_tracks WHERE status = 'missing' OR status IS NULL ORDER BY id DESC")
-                rows = cursor.fetchall()
+                with get_db_read_connection() as read_con:
+                    read_cur = read_con.cursor()
+                    read_cur.row_factory = None
+                    read_cur.execute("SELECT * FROM missing_tracks WHERE status = 'missing' OR status IS NULL ORDER BY id DESC")
+                    rows = read_cur.fetchall()
                 logging.info(f"🔄 Dopo il fix: {len(rows)} tracce missing trovate")
                 
             except Exception as fix_error:
@@ -659,11 +1192,8 @@ def get_missing_tracks():
         return []
 
 def delete_all_missing_tracks():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM missing_tracks")
-    conn.commit()
-    conn.close()
+    with writer_connection(None) as con:
+        con.execute("DELETE FROM missing_tracks")
 
 def find_missing_track_in_db(title, artist):
     conn = sqlite3.connect(DB_PATH)
@@ -686,16 +1216,17 @@ def get_missing_track_by_id(track_id: int) -> Optional[Dict]:
         logging.error(f"Errore nel recuperare la traccia mancante ID {track_id}: {e}")
         return None
 
-def update_track_status(track_id: int, new_status: str):
-    """Aggiorna lo stato di una traccia nel database."""
-    try:
-        with sqlite3.connect(DB_PATH) as con:
-            cur = con.cursor()
-            cur.execute("UPDATE missing_tracks SET status = ? WHERE id = ?", (new_status, track_id))
-            con.commit()
-        logging.info(f"Stato della traccia ID {track_id} aggiornato a '{new_status}'.")
-    except Exception as e:
-        logging.error(f"Errore nell'aggiornare lo stato della traccia ID {track_id}: {e}")
+def _update_track_status(cur, track_id: int, new_status: str):
+    cur.execute("UPDATE missing_tracks SET status = ? WHERE id = ?", (new_status, track_id))
+    logging.info(f"Stato della traccia ID {track_id} aggiornato a '{new_status}'.")
+
+def update_track_status(track_id: int, new_status: str) -> concurrent.futures.Future:
+    """
+    Aggiorna lo stato di una traccia nel database.
+    Restituisce il Future dello scrittore unico (risolto dopo il commit).
+    """
+    return submit_db_write(_update_track_status, track_id, new_status,
+                           description=f"stato traccia ID {track_id}")
 
 def reset_downloaded_tracks_to_missing():
     """
@@ -703,7 +1234,7 @@ def reset_downloaded_tracks_to_missing():
     Utile quando si sospetta che alcune tracce siano state erroneamente marcate come scaricate.
     """
     try:
-        with sqlite3.connect(DB_PATH) as con:
+        with writer_connection(None) as con:
             cur = con.cursor()
             
             # Conta quante tracce verranno resettate
@@ -733,7 +1264,7 @@ def verify_downloaded_tracks_in_plex():
     """
     try:
         import os
-        from plexapi.server import PlexServer
+        from .plex_connection import get_plex_server
         from plex_playlist_sync.utils.plex import search_plex_track
         from plex_playlist_sync.utils.helperClasses import Track as PlexTrack
         
@@ -744,46 +1275,46 @@ def verify_downloaded_tracks_in_plex():
             logging.error("❌ Credenziali Plex non configurate per verifica")
             return 0, 0
         
-        plex = PlexServer(plex_url, plex_token, timeout=120)
+        plex = get_plex_server(plex_url, plex_token, timeout=120)
         
-        with sqlite3.connect(DB_PATH) as con:
-            cur = con.cursor()
-            
+        with get_db_read_connection() as con:
             # Ottieni tutte le tracce downloaded
-            cur.execute("SELECT id, title, artist, album FROM missing_tracks WHERE status = 'downloaded'")
-            downloaded_tracks = cur.fetchall()
-            
-            if not downloaded_tracks:
-                logging.info("✅ Nessuna traccia downloaded da verificare")
-                return 0, 0
-            
-            logging.info(f"🔍 Verifica di {len(downloaded_tracks)} tracce marcate come downloaded...")
-            
-            confirmed_count = 0
-            reset_count = 0
-            
-            for track_id, title, artist, album in downloaded_tracks:
-                try:
-                    track_obj = PlexTrack(title=title, artist=artist, album=album, url='')
-                    found_plex_track = search_plex_track(plex, track_obj)
+            downloaded_tracks = [tuple(row) for row in con.execute(
+                "SELECT id, title, artist, album FROM missing_tracks WHERE status = 'downloaded'")]
+        
+        if not downloaded_tracks:
+            logging.info("✅ Nessuna traccia downloaded da verificare")
+            return 0, 0
+        
+        logging.info(f"🔍 Verifica di {len(downloaded_tracks)} tracce marcate come downloaded...")
+        
+        confirmed_count = 0
+        reset_ids = []
+        
+        # Le ricerche Plex avvengono fuori da qualsiasi transazione: lo scrittore non resta bloccato
+        for track_id, title, artist, album in downloaded_tracks:
+            try:
+                track_obj = PlexTrack(title=title, artist=artist, album=album, url='')
+                found_plex_track = search_plex_track(plex, track_obj)
+                
+                if found_plex_track:
+                    confirmed_count += 1
+                    logging.debug(f"✅ Confermata: '{title}' - '{artist}'")
+                else:
+                    # Non trovata in Plex, resetta a missing
+                    reset_ids.append((track_id,))
+                    logging.warning(f"🔄 Reset a missing: '{title}' - '{artist}' (ID: {track_id})")
                     
-                    if found_plex_track:
-                        confirmed_count += 1
-                        logging.debug(f"✅ Confermata: '{title}' - '{artist}'")
-                    else:
-                        # Non trovata in Plex, resetta a missing
-                        cur.execute("UPDATE missing_tracks SET status = 'missing' WHERE id = ?", (track_id,))
-                        reset_count += 1
-                        logging.warning(f"🔄 Reset a missing: '{title}' - '{artist}' (ID: {track_id})")
-                        
-                except Exception as e:
-                    logging.error(f"Errore nella verifica di '{title}' - '{artist}': {e}")
-                    continue
-            
-            con.commit()
-            
-            logging.info(f"📊 Verifica completata: {confirmed_count} confermate, {reset_count} resettate a missing")
-            return confirmed_count, reset_count
+            except Exception as e:
+                logging.error(f"Errore nella verifica di '{title}' - '{artist}': {e}")
+                continue
+        
+        if reset_ids:
+            with writer_connection(None) as con:
+                con.executemany("UPDATE missing_tracks SET status = 'missing' WHERE id = ?", reset_ids)
+        
+        logging.info(f"📊 Verifica completata: {confirmed_count} confermate, {len(reset_ids)} resettate a missing")
+        return confirmed_count, len(reset_ids)
             
     except Exception as e:
         logging.error(f"Errore durante la verifica delle tracce downloaded: {e}")
@@ -805,18 +1336,190 @@ def _clean_string(text: str) -> str:
     if len(text.strip()) < 2:
         text = original_text
     
-    # Rimuovi caratteri speciali ma mantieni lettere accentate
-    text = re.sub(r'[^\w\s\-\'\&]', ' ', text)
+    # Rimuovi caratteri speciali ma mantieni lettere accentate
+    text = re.sub(r'[^\w\s\-\'\&]', ' ', text)
+    
+    # Normalizza spazi multipli
+    text = re.sub(r'\s+', ' ', text).strip()
+    
+    return text
+
+# ================================
+# INDICE FULL-TEXT (FTS5) DELLA LIBRERIA
+# ================================
+
+LIBRARY_FTS_TABLE = "plex_library_fts"
+_library_fts_available: Optional[bool] = None
+
+_LIBRARY_FTS_SCHEMA = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS {table} USING fts5(
+        title_clean, artist_clean, album_clean,
+        content='plex_library_index', content_rowid='id',
+        tokenize='unicode61'
+    )
+"""
+
+def _create_library_fts(cur) -> bool:
+    """
+    Crea la tabella FTS5 (external content) sopra plex_library_index e i trigger
+    che la mantengono allineata a ogni INSERT/UPDATE/DELETE, anche dagli script esterni.
+    Alla prima creazione la popola con 'rebuild'. Ritorna False se FTS5 non è disponibile.
+    """
+    global _library_fts_available
+    try:
+        exists = cur.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (LIBRARY_FTS_TABLE,)
+        ).fetchone() is not None
+        
+        cur.execute(_LIBRARY_FTS_SCHEMA.format(table=LIBRARY_FTS_TABLE))
+        _create_library_fts_triggers(cur)
+        
+        if not exists:
+            logging.info("🔎 Creazione indice full-text FTS5 della libreria...")
+            cur.execute(f"INSERT INTO {LIBRARY_FTS_TABLE}({LIBRARY_FTS_TABLE}) VALUES ('rebuild')")
+        _library_fts_available = True
+        return True
+    except sqlite3.OperationalError as e:
+        logging.warning(f"⚠️ FTS5 non disponibile, ricerca candidati con fallback: {e}")
+        _library_fts_available = False
+        return False
+
+def _create_library_fts_triggers(cur):
+    """Trigger che riportano ogni modifica di plex_library_index nella tabella FTS5."""
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS plex_library_fts_ai AFTER INSERT ON plex_library_index BEGIN
+            INSERT INTO {LIBRARY_FTS_TABLE}(rowid, title_clean, artist_clean, album_clean)
+            VALUES (new.id, new.title_clean, new.artist_clean, new.album_clean);
+        END
+    """)
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS plex_library_fts_ad AFTER DELETE ON plex_library_index BEGIN
+            INSERT INTO {LIBRARY_FTS_TABLE}({LIBRARY_FTS_TABLE}, rowid, title_clean, artist_clean, album_clean)
+            VALUES ('delete', old.id, old.title_clean, old.artist_clean, old.album_clean);
+        END
+    """)
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS plex_library_fts_au AFTER UPDATE ON plex_library_index BEGIN
+            INSERT INTO {LIBRARY_FTS_TABLE}({LIBRARY_FTS_TABLE}, rowid, title_clean, artist_clean, album_clean)
+            VALUES ('delete', old.id, old.title_clean, old.artist_clean, old.album_clean);
+            INSERT INTO {LIBRARY_FTS_TABLE}(rowid, title_clean, artist_clean, album_clean)
+            VALUES (new.id, new.title_clean, new.artist_clean, new.album_clean);
+        END
+    """)
+
+def _create_library_index_indexes(cur):
+    """Indici secondari di plex_library_index (usato anche dopo lo swap della tabella di staging)."""
+    # Indici principali per ricerca tracce (query più frequenti)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_library_artist_title ON plex_library_index (artist_clean, title_clean)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_library_title_clean ON plex_library_index (title_clean)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_library_artist_clean ON plex_library_index (artist_clean)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_library_album_clean ON plex_library_index (album_clean)")
+    
+    # Indice composito per fuzzy matching ottimizzato
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_library_composite ON plex_library_index (artist_clean, album_clean, title_clean)")
     
-    # Normalizza spazi multipli
-    text = re.sub(r'\s+', ' ', text).strip()
+    # Indici per filtering e sorting
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_library_year ON plex_library_index (year)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_library_added_at ON plex_library_index (added_at)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_library_rating_key ON plex_library_index (rating_key)")
+
+def _has_library_fts(cur) -> bool:
+    """Verifica (una volta per processo) se la tabella FTS5 della libreria esiste."""
+    global _library_fts_available
+    if _library_fts_available is None:
+        _library_fts_available = cur.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (LIBRARY_FTS_TABLE,)
+        ).fetchone() is not None
+    return _library_fts_available
+
+def _fts_terms(text: str) -> List[str]:
+    """Token di una stringa già pulita, divisi come fa il tokenizer unicode61."""
+    return [t for t in re.split(r'[\W_]+', text or '') if t]
+
+def _fts_like_phrase(text: str) -> Optional[str]:
+    """
+    Frase FTS5 soddisfatta da ogni riga che contiene `text` (come LIKE '%text%').
+    Dentro un LIKE solo i token dopo il primo iniziano a un confine di parola (il primo può
+    essere la coda di una parola più lunga) e l'ultimo può essere l'inizio di una parola:
+    la frase usa quindi i token dal secondo in poi, con l'ultimo come prefisso.
+    Un solo token diventa un prefisso di parola ("term"*): restano escluse le righe in cui compare
+    solo a metà di una parola, ma si evita la scansione completa per le ricerche di una parola.
+    None se il testo è vuoto o contiene caratteri jolly di LIKE (nessun prefiltro).
+    """
+    if not text or '%' in text or '_' in text:
+        return None
+    terms = _fts_terms(text)
+    if not terms:
+        return None
+    if len(terms) == 1:
+        return f'"{terms[0]}"*'
+    return '"' + ' '.join(terms[1:]) + '" *'
+
+def _fts_any_terms(text: str) -> Optional[str]:
+    """OR dei token; quelli lunghi anche come prefisso per tollerare suffissi (remaster, plurali)."""
+    terms = _fts_terms(text)
+    significant = [t for t in terms if len(t) > 2] or terms
+    if not significant:
+        return None
+    return ' OR '.join(f'"{t}"*' if len(t) > 3 else f'"{t}"' for t in significant)
+
+def _fts_prefilter(cur, **columns) -> tuple:
+    """
+    Restituisce (clausola SQL, parametri) che restringe plex_library_index a un sovrainsieme
+    delle righe che soddisfano LIKE '%testo%' per ogni colonna (vedi _fts_like_phrase; con un solo
+    token, delle righe in cui il token inizia una parola). Le condizioni LIKE originali restano come filtro esatto sulle sole righe candidate.
+    Senza FTS5 (o senza testo utile) ritorna una clausola neutra: scansione come prima.
+    """
+    parts = []
+    for column, text in columns.items():
+        phrase = _fts_like_phrase(text)
+        if phrase:
+            parts.append(f"{column} : {phrase}")
+    if not parts or not _has_library_fts(cur):
+        return "1", ()
+    return (f"id IN (SELECT rowid FROM {LIBRARY_FTS_TABLE} WHERE {LIBRARY_FTS_TABLE} MATCH ?)",
+            (" AND ".join(parts),))
+
+def _fts_candidates(cur, title_clean: str, artist_clean: str, limit: int = CANDIDATE_LIMIT,
+                    title_weight: float = 0.7) -> List[tuple]:
+    """Candidati (title_clean, artist_clean) ordinati per rilevanza BM25 pesata titolo/artista."""
+    clauses = []
+    title_terms = _fts_any_terms(title_clean)
+    artist_terms = _fts_any_terms(artist_clean)
+    if title_terms:
+        clauses.append(f"title_clean : ({title_terms})")
+    if artist_terms:
+        clauses.append(f"artist_clean : ({artist_terms})")
+    if not clauses:
+        return []
     
-    return text
+    res = cur.execute(f"""
+        SELECT title_clean, artist_clean FROM {LIBRARY_FTS_TABLE}
+        WHERE {LIBRARY_FTS_TABLE} MATCH ?
+        ORDER BY bm25({LIBRARY_FTS_TABLE}, ?, ?, 0.0)
+        LIMIT ?
+    """, (" OR ".join(clauses), title_weight * 10, (1 - title_weight) * 10, limit))
+    return [(row[0], row[1]) for row in res.fetchall()]
+
+def _library_candidates(cur, title_clean: str, artist_clean: str, title_weight: float = 0.7) -> List[tuple]:
+    """
+    Candidati per il fuzzy matching. Se l'indice n-gram in memoria è già costruito
+    (sync in corso) si usa quello; altrimenti FTS5, senza costruire l'intero indice
+    per una singola verifica (es. ricerca dalla web UI). Senza FTS5 si ricade sull'indice in memoria.
+    """
+    candidate_index = get_candidate_index()
+    if candidate_index.is_built() or not _has_library_fts(cur):
+        return candidate_index.candidates(title_clean, artist_clean, title_weight=title_weight)
+    try:
+        return _fts_candidates(cur, title_clean, artist_clean, title_weight=title_weight)
+    except sqlite3.OperationalError as e:
+        logging.debug(f"Ricerca FTS5 fallita, uso indice in memoria: {e}")
+        return candidate_index.candidates(title_clean, artist_clean, title_weight=title_weight)
 
 def get_library_index_stats() -> Dict[str, int]:
     """Restituisce statistiche sull'indice della libreria."""
     try:
-        with sqlite3.connect(DB_PATH) as con:
+        with get_db_read_connection() as con:
             cur = con.cursor()
             res = cur.execute("SELECT COUNT(*) FROM plex_library_index")
             result = res.fetchone()
@@ -853,6 +1556,30 @@ def check_track_in_index(title: str, artist: str) -> bool:
         logging.error(f"Errore nel controllare la traccia nell'indice: {e}")
         return False
 
+def _best_fuzzy_candidate(title_clean: str, artist_clean: str, candidates, title_weight: float = 0.7):
+    """
+    Calcola una sola volta il punteggio pesato titolo/artista per ogni candidato.
+    Restituisce (score, db_title, db_artist) del candidato migliore.
+    """
+    from thefuzz import fuzz
+    
+    best = (0, None, None)
+    for db_title, db_artist in candidates:
+        title_score = fuzz.token_set_ratio(title_clean, db_title)
+        
+        # Peso maggiore al titolo se l'artista è problematico
+        if not db_artist or not artist_clean:
+            combined_score = title_score
+        else:
+            artist_score = fuzz.token_set_ratio(artist_clean, db_artist)
+            combined_score = (title_score * title_weight) + (artist_score * (1 - title_weight))
+        
+        if combined_score > best[0]:
+            best = (combined_score, db_title, db_artist)
+            if combined_score >= 100:
+                break
+    return best
+
 def check_track_in_index_smart(title: str, artist: str, debug: bool = False) -> bool:
     """
     Sistema di matching intelligente multi-livello per tracce.
@@ -889,46 +1616,19 @@ def check_track_in_index_smart(title: str, artist: str, debug: bool = False) ->
                     if debug: logging.info("✅ Title match trovato (artista flessibile)")
                     return True
             
-            # LIVELLO 3: Fuzzy matching con soglie multiple
-            # Cerca candidati usando substring più ampi
-            search_patterns = []
-            if len(title_clean) > 3:
-                search_patterns.append(f"%{title_clean[:4]}%")
-            if len(artist_clean) > 3:
-                search_patterns.append(f"%{artist_clean[:4]}%")
-            
-            if search_patterns:
-                query = "SELECT title_clean, artist_clean FROM plex_library_index WHERE "
-                conditions = []
-                params = []
-                
-                for pattern in search_patterns:
-                    conditions.append("title_clean LIKE ? OR artist_clean LIKE ?")
-                    params.extend([pattern, pattern])
-                
-                query += " OR ".join(conditions)
-                res = cur.execute(query, params)
-                candidates = res.fetchall()
-                
+            # LIVELLO 3: Fuzzy matching sui candidati (indice n-gram in memoria o FTS5)
+            # (sostituisce le scansioni LIKE '%xxxx%' sull'intera tabella)
+            if len(title_clean) > 3 or len(artist_clean) > 3:
+                candidates = _library_candidates(cur, title_clean, artist_clean, title_weight=0.7)
                 if debug and candidates:
                     logging.info(f"🎯 Trovati {len(candidates)} candidati per fuzzy matching")
                 
-                # Prova diverse soglie
-                for threshold in [90, 80, 70, 60]:
-                    for db_title, db_artist in candidates:
-                        title_score = fuzz.token_set_ratio(title_clean, db_title)
-                        artist_score = fuzz.token_set_ratio(artist_clean, db_artist) if artist_clean and db_artist else 100
-                        
-                        # Peso maggiore al titolo se l'artista è problematico
-                        if not db_artist or not artist_clean:
-                            combined_score = title_score
-                        else:
-                            combined_score = (title_score * 0.7) + (artist_score * 0.3)
-                        
-                        if combined_score >= threshold:
-                            if debug:
-                                logging.info(f"✅ Fuzzy match (soglia {threshold}): '{title}' - '{artist}' ≈ '{db_title}' - '{db_artist}' (score: {combined_score:.1f})")
-                            return True
+                # Basta il punteggio migliore: le soglie 90/80/70/60 equivalgono alla minima (60)
+                best_score, db_title, db_artist = _best_fuzzy_candidate(title_clean, artist_clean, candidates, title_weight=0.7)
+                if best_score >= 60:
+                    if debug:
+                        logging.info(f"✅ Fuzzy match: '{title}' - '{artist}' ≈ '{db_title}' - '{db_artist}' (score: {best_score:.1f})")
+                    return True
             
             if debug: logging.info("❌ Nessun match trovato")
             return False
@@ -981,54 +1681,18 @@ def check_track_in_index_balanced(title: str, artist: str, debug: bool = False)
                 if res.fetchone():
                     return True
             
-            # LIVELLO 4: Fuzzy matching con soglie moderate
-            # Cerca candidati usando substring più ampi e multipli
-            search_patterns = []
-            if len(title_clean) > 3:
-                search_patterns.append(f"%{title_clean[:4]}%")
-                if len(title_clean) > 6:
-                    search_patterns.append(f"%{title_clean[:6]}%")
-            if len(artist_clean) > 2:  # Reduced from > 3
-                search_patterns.append(f"%{artist_clean[:4]}%")
-                if len(artist_clean) > 5:
-                    search_patterns.append(f"%{artist_clean[:5]}%")
-            
-            if search_patterns:
-                query = "SELECT title_clean, artist_clean FROM plex_library_index WHERE "
-                conditions = []
-                params = []
-                
-                for pattern in search_patterns:
-                    conditions.append("title_clean LIKE ? OR artist_clean LIKE ?")
-                    params.extend([pattern, pattern])
+            # LIVELLO 4: Fuzzy matching con soglie moderate sui candidati (n-gram o FTS5)
+            if len(title_clean) > 3 or len(artist_clean) > 2:
+                candidates = _library_candidates(cur, title_clean, artist_clean, title_weight=0.75)
                 
-                query += " OR ".join(conditions)
-                res = cur.execute(query, params)
-                candidates = res.fetchall()
-                
-                # Soglie più flessibili: 85, 80, 75, 70 (migliore recall)
-                for threshold in [85, 80, 75, 70]:
-                    for db_title, db_artist in candidates:
-                        title_score = fuzz.token_set_ratio(title_clean, db_title)
-                        artist_score = fuzz.token_set_ratio(artist_clean, db_artist) if artist_clean and db_artist else 100
-                        
-                        # Weighted scoring: titolo ancora più importante dell'artista
-                        if not db_artist or not artist_clean:
-                            combined_score = title_score
-                        else:
-                            combined_score = (title_score * 0.75) + (artist_score * 0.25)  # Increased title weight
-                        
-                        if combined_score >= threshold:
-                            return True
+                # Soglie 85/80/75/70: il match avviene se il punteggio migliore raggiunge la minima (70)
+                best_score, _, _ = _best_fuzzy_candidate(title_clean, artist_clean, candidates, title_weight=0.75)
+                if best_score >= 70:
+                    return True
             
             # LIVELLO 5: Title-only fuzzy matching as last resort
             if len(title_clean) > 3:
-                # More efficient: use substring match to get candidates first
-                title_substring = f"%{title_clean[:3]}%"
-                res = cur.execute("SELECT title_clean FROM plex_library_index WHERE title_clean LIKE ?", (title_substring,))
-                title_candidates = [row[0] for row in res.fetchall()]
-                
-                for db_title in title_candidates:
+                for db_title, _ in _library_candidates(cur, title_clean, '', title_weight=1.0):
                     title_score = fuzz.token_set_ratio(title_clean, db_title)
                     if title_score >= 75:  # Lower threshold for title-only
                         return True
@@ -1039,6 +1703,121 @@ def check_track_in_index_balanced(title: str, artist: str, debug: bool = False)
         logging.error(f"Errore nel matching bilanciato: {e}")
         return check_track_in_index(title, artist)  # Fallback
 
+# Sopra questo numero di tracce da risolvere con fuzzy, conviene costruire l'indice n-gram in memoria
+BATCH_CANDIDATE_POOL_MIN = int(os.getenv("BATCH_CANDIDATE_POOL_MIN", "200"))
+
+def match_tracks_batch(pairs, mode: str = 'smart') -> List[Dict[str, Any]]:
+    """
+    Matching di un'intera lista di tracce (playlist, missing tracks) contro l'indice.
+    Pulisce ogni coppia una sola volta, risolve i match esatti con un'unica JOIN su una
+    tabella temporanea e manda al fuzzy matching solo le tracce rimaste, sullo stesso pool di candidati.
+
+    pairs: iterabile di (title, artist)
+    mode: 'exact', 'smart' (stesse soglie di check_track_in_index_smart) o
+          'balanced' (stesse soglie di check_track_in_index_balanced)
+    Restituisce una lista nello stesso ordine dell'input con dict:
+    {'matched', 'method', 'score', 'match_title', 'match_artist'}
+    Un errore del database viene rilanciato: le tracce non verificate non risultano mancanti.
+    """
+    from thefuzz import fuzz
+
+    start_time = time.time()
+    exact_count = 0
+    pairs = list(pairs)
+    results = [{'matched': False, 'method': 'none', 'score': 0, 'match_title': None, 'match_artist': None}
+               for _ in pairs]
+    if not pairs:
+        return results
+
+    # Pulizia una sola volta, deduplicando le coppie uguali
+    positions = {}
+    for i, (title, artist) in enumerate(pairs):
+        key = (_clean_string(title), _clean_string(artist))
+        positions.setdefault(key, []).append(i)
+    keys = list(positions)
+    resolved = {}
+
+    def _resolve(key, method, score, match_title=None, match_artist=None):
+        resolved[key] = {'matched': True, 'method': method, 'score': score,
+                         'match_title': match_title if match_title is not None else key[0],
+                         'match_artist': match_artist if match_artist is not None else key[1]}
+
+    try:
+        with sqlite3.connect(DB_PATH, timeout=30) as con:
+            cur = con.cursor()
+            cur.execute("CREATE TEMP TABLE batch_match (pos INTEGER PRIMARY KEY, title_clean TEXT, artist_clean TEXT)")
+            cur.executemany("INSERT INTO batch_match (pos, title_clean, artist_clean) VALUES (?, ?, ?)",
+                            ((pos, title, artist) for pos, (title, artist) in enumerate(keys)))
+
+            # LIVELLO 1: Exact match, set-based
+            sql_levels = [('exact', """
+                SELECT b.pos FROM batch_match b WHERE EXISTS (
+                    SELECT 1 FROM plex_library_index i
+                    WHERE i.title_clean = b.title_clean AND i.artist_clean = b.artist_clean)
+            """)]
+            if mode in ('smart', 'balanced'):
+                # LIVELLO 2: Titolo esatto con artista vuoto nell'indice
+                min_artist_len = 2 if mode == 'smart' else 1
+                sql_levels.append(('title', f"""
+                    SELECT b.pos FROM batch_match b WHERE length(b.artist_clean) > {min_artist_len} AND EXISTS (
+                        SELECT 1 FROM plex_library_index i
+                        WHERE i.title_clean = b.title_clean AND i.artist_clean = '')
+                """))
+            if mode == 'balanced':
+                # LIVELLO 3: Titolo esatto con artista parziale (primi 4 caratteri)
+                sql_levels.append(('partial_artist', """
+                    SELECT b.pos FROM batch_match b WHERE length(b.artist_clean) > 2 AND EXISTS (
+                        SELECT 1 FROM plex_library_index i
+                        WHERE i.title_clean = b.title_clean AND instr(i.artist_clean, substr(b.artist_clean, 1, 4)) > 0)
+                """))
+
+            for method, query in sql_levels:
+                found = cur.execute(query).fetchall()
+                for (pos,) in found:
+                    _resolve(keys[pos], method, 100)
+                # I livelli successivi lavorano solo sulle tracce non ancora risolte
+                cur.executemany("DELETE FROM batch_match WHERE pos = ?", found)
+
+            exact_count = len(resolved)
+
+            # Fuzzy matching solo sulle tracce rimaste, con un pool di candidati condiviso
+            if mode in ('smart', 'balanced'):
+                title_weight, threshold = (0.7, 60) if mode == 'smart' else (0.75, 70)
+                leftovers = [key for key in keys if key not in resolved]
+                if len(leftovers) >= BATCH_CANDIDATE_POOL_MIN:
+                    get_candidate_index().build()  # Pool in memoria condiviso da tutte le tracce rimaste
+
+                min_artist_len = 3 if mode == 'smart' else 2
+                for key in leftovers:
+                    title_clean, artist_clean = key
+                    if len(title_clean) > 3 or len(artist_clean) > min_artist_len:
+                        candidates = _library_candidates(cur, title_clean, artist_clean, title_weight=title_weight)
+                        best_score, db_title, db_artist = _best_fuzzy_candidate(title_clean, artist_clean, candidates, title_weight=title_weight)
+                        if best_score >= threshold:
+                            _resolve(key, 'fuzzy', round(best_score, 1), db_title, db_artist)
+                            continue
+
+                    # Balanced LIVELLO 5: solo titolo come ultima risorsa
+                    if mode == 'balanced' and len(title_clean) > 3:
+                        for db_title, db_artist in _library_candidates(cur, title_clean, '', title_weight=1.0):
+                            title_score = fuzz.token_set_ratio(title_clean, db_title)
+                            if title_score >= 75:
+                                _resolve(key, 'title_fuzzy', title_score, db_title, db_artist)
+                                break
+    except Exception as e:
+        # Un esito parziale farebbe risultare mancanti tracce presenti: meglio far fallire il chiamante
+        logging.error(f"Errore nel matching batch: {e}")
+        raise
+
+    for key, match in resolved.items():
+        for i in positions[key]:
+            results[i] = dict(match)
+
+    logging.info(f"🎯 Matching batch ({mode}): {len(pairs)} tracce ({len(keys)} uniche), "
+                 f"{exact_count} via SQL, {len(resolved) - exact_count} via fuzzy, "
+                 f"{len(keys) - len(resolved)} non trovate in {time.time() - start_time:.2f}s")
+    return results
+
 def check_track_in_index_fuzzy(title: str, artist: str, threshold: int = 85) -> bool:
     """Versione semplificata per compatibilità - usa il nuovo sistema smart."""
     return check_track_in_index_smart(title, artist)
@@ -1143,62 +1922,131 @@ def comprehensive_track_verification(title: str, artist: str, debug: bool = Fals
         logging.error(f"Errore nella verifica completa: {e}")
         return results
 
-def add_track_to_index(track):
-    """Aggiunge una singola traccia all'indice della libreria Plex con campi puliti (thread-safe)."""
+# Upsert sulla terna pulita: alla prima scrittura salva ratingKey/updatedAt, poi li mantiene
+# (il primo ratingKey vince in caso di duplicati, es. edizioni deluxe con lo stesso titolo pulito)
+_INDEX_UPSERT_SQL = """
+    INSERT INTO {table} (title_clean, artist_clean, album_clean, year, added_at, rating_key, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(artist_clean, album_clean, title_clean) DO UPDATE SET
+        rating_key = COALESCE({table}.rating_key, excluded.rating_key),
+        updated_at = COALESCE(excluded.updated_at, {table}.updated_at),
+        year = COALESCE(excluded.year, {table}.year)
+"""
+
+# Rimuove la riga precedente di un ratingKey i cui metadati (titolo/artista/album) sono cambiati
+_INDEX_DELETE_STALE_SQL = """
+    DELETE FROM {table}
+    WHERE rating_key = ? AND NOT (title_clean = ? AND artist_clean = ? AND album_clean = ?)
+"""
+
+def _to_epoch(value) -> Optional[int]:
+    """Converte un datetime plexapi in epoch (secondi), None se assente."""
+    if value is None:
+        return None
+    try:
+        return int(value.timestamp())
+    except (AttributeError, OverflowError, OSError, ValueError):
+        return None
+
+def track_to_index_row(track) -> Optional[tuple]:
+    """
+    Riga per plex_library_index da un oggetto Track plexapi:
+    (title_clean, artist_clean, album_clean, year, added_at, rating_key, updated_at).
+    None se la traccia non ha né titolo né artista.
+    """
+    title = getattr(track, 'title', '') or ''
+    artist = getattr(track, 'grandparentTitle', '') or ''
+    if not title and not artist:
+        return None
+    rating_key = getattr(track, 'ratingKey', None)
+    return (
+        _clean_string(title),
+        _clean_string(artist),
+        _clean_string(getattr(track, 'parentTitle', '') or ''),
+        getattr(track, 'year', None),
+        getattr(track, 'addedAt', None),
+        int(rating_key) if rating_key else None,
+        _to_epoch(getattr(track, 'updatedAt', None)),
+    )
+
+def _write_index_rows(cur, rows, table: str = LIBRARY_INDEX_TABLE) -> Tuple[int, int]:
+    """
+    Scrive le righe (stale delete + upsert). Restituisce (righe inserite o aggiornate, righe obsolete rimosse).
+    Se l'indice attivo perde righe la generazione viene incrementata: il chiamante, dopo il commit,
+    deve invalidare l'indice candidati in memoria (che supporta solo aggiunte).
+    """
+    cur.executemany(_INDEX_DELETE_STALE_SQL.format(table=table),
+                    [(row[5], row[0], row[1], row[2]) for row in rows if row[5] is not None])
+    stale_removed = max(cur.rowcount, 0)
+    if stale_removed and table == LIBRARY_INDEX_TABLE:
+        _bump_library_index_generation(cur)
+    cur.executemany(_INDEX_UPSERT_SQL.format(table=table), rows)
+    return cur.rowcount, stale_removed
+
+def _write_live_index_rows(cur, rows) -> Tuple[int, int]:
+    """
+    Scrive nell'indice attivo e, se è in corso una ricostruzione completa, anche nella tabella
+    di staging: altrimenti lo swap eliminerebbe le tracce aggiunte nel frattempo (file watcher,
+    rescan dopo i download) fino alla successiva indicizzazione delta.
+    """
+    written = _write_index_rows(cur, rows)
+    staging = cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?",
+                          (LIBRARY_INDEX_STAGING_TABLE,)).fetchone()
+    if staging:
+        _write_index_rows(cur, rows, table=LIBRARY_INDEX_STAGING_TABLE)
+    return written
+
+def add_track_to_index(track) -> Optional[concurrent.futures.Future]:
+    """
+    Aggiunge una singola traccia all'indice della libreria Plex con campi puliti (thread-safe).
+    La riga viene accodata allo scrittore unico: restituisce il Future della scrittura (risolto dopo
+    il commit, con l'eventuale errore) oppure None se la traccia è stata scartata.
+    Chi deve confermare la scrittura chiama .result(); chi legge l'indice usa flush_db_writes().
+    """
     if not isinstance(track, Track):
         logging.debug(f"Tentativo di aggiungere un oggetto non-Track all'indice: {type(track)}. Saltato.")
-        return False
+        return None
         
+    title = getattr(track, 'title', '') or ''
+    artist = getattr(track, 'grandparentTitle', '') or ''
     try:
         # Estrazione sicura dei campi
-        title = getattr(track, 'title', '') or ''
-        artist = getattr(track, 'grandparentTitle', '') or ''
-        album = getattr(track, 'parentTitle', '') or ''
-        year = getattr(track, 'year', None)
-        added_at = getattr(track, 'addedAt', None)
+        row = track_to_index_row(track)
         
         # Validazione base - accetta tracce con almeno un campo valido
-        if not title and not artist:
+        if row is None:
             logging.debug(f"Traccia con entrambi i campi vuoti saltata: title='{title}', artist='{artist}'")
-            return False
+            return None
         
-        # Inserimento thread-safe con retry
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                with sqlite3.connect(DB_PATH, timeout=10) as con:
-                    cur = con.cursor()
-                    cur.execute(
-                        """INSERT OR IGNORE INTO plex_library_index (title_clean, artist_clean, album_clean, year, added_at)
-                           VALUES (?, ?, ?, ?, ?)""",
-                        (
-                            _clean_string(title),
-                            _clean_string(artist), 
-                            _clean_string(album),
-                            year,
-                            added_at
-                        ),
-                    )
-                    con.commit()
-                    return True
-            except sqlite3.OperationalError as db_error:
-                if "database is locked" in str(db_error) and attempt < max_retries - 1:
-                    import time
-                    time.sleep(0.1 * (attempt + 1))  # Backoff progressivo
-                    continue
+        stale = {}
+
+        def _write(cur):
+            written, stale['removed'] = _write_live_index_rows(cur, [row])
+            return written
+
+        def _patch_candidates(done: concurrent.futures.Future):
+            # Patch dell'indice candidati in memoria dopo il commit (no-op se non ancora costruito);
+            # se la traccia ha sostituito una riga con metadati vecchi l'indice va ricostruito
+            if done.exception() is None:
+                if stale.get('removed'):
+                    get_candidate_index().invalidate()
                 else:
-                    raise
-                    
+                    get_candidate_index().add_rows([(row[0], row[1])])
+
+        future = submit_db_write(_write, description=f"indice traccia '{title}' - '{artist}'")
+        future.add_done_callback(_patch_candidates)
+        return future
+
     except Exception as e:
         logging.error(f"Errore nell'aggiungere la traccia '{title}' - '{artist}' all'indice: {e}")
-        return False
-    
-    return False
+        return None
 
-def bulk_add_tracks_to_index(tracks, chunk_size=1000):
+def bulk_add_tracks_to_index(tracks, chunk_size=1000, table: str = LIBRARY_INDEX_TABLE):
     """
     Aggiunge un batch di tracce all'indice usando chunks ottimizzati (PERFORMANCE 70% MIGLIORATA).
     Ridotto chunk_size da 5000 a 1000 per prevenire timeout e migliorare responsività.
+    tracks: oggetti Track plexapi oppure tuple già prodotte da track_to_index_row.
+    table: LIBRARY_INDEX_STAGING_TABLE durante una ricostruzione completa.
     """
     if not tracks:
         return 0
@@ -1209,28 +2057,19 @@ def bulk_add_tracks_to_index(tracks, chunk_size=1000):
     
     logging.info(f"🚀 Preparando {len(tracks)} tracce per inserimento bulk ottimizzato")
     
-    # Prepara i dati per inserimento batch
+    # Prepara i dati per inserimento batch (accetta anche righe già compatte da track_to_index_row)
     for i, track in enumerate(tracks):
-        if not isinstance(track, Track):
+        if isinstance(track, tuple):
+            row = track
+        elif isinstance(track, Track):
+            # Accetta tracce con almeno un campo valido (titolo o artista)
+            row = track_to_index_row(track)
+        else:
             continue
-            
-        title = getattr(track, 'title', '') or ''
-        artist = getattr(track, 'grandparentTitle', '') or ''
-        album = getattr(track, 'parentTitle', '') or ''
-        year = getattr(track, 'year', None)
-        added_at = getattr(track, 'addedAt', None)
-        
-        # Accetta tracce con almeno un campo valido (titolo o artista)
-        if not title and not artist:
+        if row is None:
             continue  # Salta solo se entrambi sono vuoti
             
-        track_data.append((
-            _clean_string(title),
-            _clean_string(artist),
-            _clean_string(album),
-            year,
-            added_at
-        ))
+        track_data.append(row)
         
         # Progress ogni 5000 tracce (ridotto per responsività)
         if (i + 1) % 5000 == 0:
@@ -1258,14 +2097,17 @@ def bulk_add_tracks_to_index(tracks, chunk_size=1000):
             with get_db_connection() as con:
                 cur = con.cursor()
                 
-                # Inserimento bulk senza PRAGMA problematici
-                cur.executemany(
-                    """INSERT OR IGNORE INTO plex_library_index (title_clean, artist_clean, album_clean, year, added_at)
-                       VALUES (?, ?, ?, ?, ?)""",
-                    chunk
-                )
-                chunk_inserts = cur.rowcount
+                # Inserimento bulk senza PRAGMA problematici (upsert per ratingKey/updatedAt)
+                chunk_inserts, stale_removed = _write_index_rows(cur, chunk, table)
                 total_successful += chunk_inserts
+            
+            # Patch dell'indice candidati in memoria (no-op se non ancora costruito);
+            # righe obsolete rimosse (metadati cambiati): l'indice supporta solo aggiunte, va ricostruito
+            if table == LIBRARY_INDEX_TABLE:
+                if stale_removed:
+                    get_candidate_index().invalidate()
+                else:
+                    get_candidate_index().add_rows((row[0], row[1]) for row in chunk)
                 
             elapsed_chunk = time.time() - insert_start
             avg_time_per_chunk = elapsed_chunk / chunk_num
@@ -1281,6 +2123,347 @@ def bulk_add_tracks_to_index(tracks, chunk_size=1000):
     logging.info(f"🏁 Inserimento completato: {total_successful}/{len(track_data)} tracce inserite")
     return total_successful
 
+def get_indexed_rating_keys() -> set:
+    """Restituisce l'insieme dei ratingKey Plex presenti nell'indice (righe legacy senza ratingKey escluse)."""
+    try:
+        with sqlite3.connect(DB_PATH) as con:
+            return {row[0] for row in con.execute(
+                "SELECT rating_key FROM plex_library_index WHERE rating_key IS NOT NULL")}
+    except Exception as e:
+        logging.error(f"Errore lettura ratingKey dall'indice: {e}")
+        return set()
+
+def lookup_index_rating_keys(entries) -> Dict[int, int]:
+    """
+    Risolve dall'indice locale il ratingKey delle tracce con titolo e artista esatti.
+    entries: sequenza di (title, artist, album); a parità di titolo/artista si preferisce lo stesso album.
+    Restituisce {posizione in entries: ratingKey}, senza alcuna richiesta a Plex.
+    """
+    rows = [(pos, *_resolution_key(title, artist, album)) for pos, (title, artist, album) in enumerate(entries)]
+    if not rows:
+        return {}
+    try:
+        with sqlite3.connect(DB_PATH, timeout=30) as con:
+            cur = con.cursor()
+            cur.execute("""
+                CREATE TEMP TABLE IF NOT EXISTS rating_key_lookup (
+                    pos INTEGER PRIMARY KEY, title_clean TEXT, artist_clean TEXT, album_clean TEXT
+                )
+            """)
+            cur.execute("DELETE FROM rating_key_lookup")
+            cur.executemany("INSERT INTO rating_key_lookup VALUES (?, ?, ?, ?)", rows)
+            found = {}
+            for pos, rating_key, same_album in cur.execute("""
+                SELECT l.pos, i.rating_key, i.album_clean = l.album_clean
+                FROM rating_key_lookup l
+                JOIN plex_library_index i ON i.title_clean = l.title_clean AND i.artist_clean = l.artist_clean
+                WHERE i.rating_key IS NOT NULL
+                ORDER BY l.pos, 3 DESC
+            """):
+                found.setdefault(pos, rating_key)
+            cur.execute("DROP TABLE rating_key_lookup")
+            return found
+    except Exception as e:
+        logging.error(f"Errore risoluzione ratingKey dall'indice: {e}")
+        return {}
+
+def delete_tracks_by_rating_keys(rating_keys) -> int:
+    """Rimuove dall'indice le righe dei ratingKey non più presenti in Plex."""
+    rating_keys = list(rating_keys)
+    if not rating_keys:
+        return 0
+    try:
+        with writer_connection(None) as con:
+            cur = con.cursor()
+            cur.executemany("DELETE FROM plex_library_index WHERE rating_key = ?", [(k,) for k in rating_keys])
+            deleted = cur.rowcount
+            # Le risoluzioni verso quei ratingKey non sono più valide
+            cur.executemany("DELETE FROM plex_resolution_cache WHERE rating_key = ?", [(k,) for k in rating_keys])
+            _bump_library_index_generation(cur)
+            con.commit()
+        # L'indice in memoria supporta solo aggiunte: va ricostruito
+        get_candidate_index().invalidate()
+        logging.info(f"🗑️ Rimosse {deleted} tracce non più presenti in Plex dall'indice")
+        return deleted
+    except Exception as e:
+        logging.error(f"Errore rimozione tracce per ratingKey: {e}")
+        return 0
+
+def get_library_index_state(key: str, default: Optional[str] = None) -> Optional[str]:
+    """Legge un valore persistente dello stato di indicizzazione (es. high-water mark)."""
+    try:
+        with sqlite3.connect(DB_PATH) as con:
+            row = con.execute("SELECT value FROM library_index_state WHERE key = ?", (key,)).fetchone()
+            return row[0] if row else default
+    except sqlite3.Error:
+        return default
+
+def set_library_index_state(key: str, value) -> None:
+    """Salva un valore persistente dello stato di indicizzazione."""
+    try:
+        with writer_connection(None) as con:
+            con.execute("""
+                INSERT INTO library_index_state (key, value, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = CURRENT_TIMESTAMP
+            """, (key, str(value)))
+            con.commit()
+    except Exception as e:
+        logging.error(f"Errore salvataggio stato indicizzazione '{key}': {e}")
+
+def _bump_library_index_generation(cur):
+    """Segnala agli altri processi che l'indice è stato sostituito (l'indice candidati in memoria va ricaricato)."""
+    cur.execute("""
+        INSERT INTO library_index_state (key, value, updated_at) VALUES ('index_generation', '1', CURRENT_TIMESTAMP)
+        ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1, updated_at = CURRENT_TIMESTAMP
+    """)
+
+def begin_library_index_staging():
+    """
+    Prepara una tabella di staging vuota per la ricostruzione completa.
+    L'indice attivo resta intatto e interrogabile fino a swap_library_index_staging().
+    """
+    with writer_connection(None) as con:
+        cur = con.cursor()
+        cur.execute(f"DROP TABLE IF EXISTS {LIBRARY_INDEX_STAGING_TABLE}")
+        cur.execute(f"""
+            CREATE TABLE {LIBRARY_INDEX_STAGING_TABLE} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                title_clean TEXT NOT NULL,
+                artist_clean TEXT NOT NULL,
+                album_clean TEXT,
+                year INTEGER,
+                added_at TIMESTAMP,
+                rating_key INTEGER,
+                updated_at INTEGER,
+                UNIQUE(artist_clean, album_clean, title_clean)
+            )
+        """)
+        # Serve all'upsert per ratingKey durante il caricamento; sostituito dagli indici definitivi allo swap
+        cur.execute(f"CREATE INDEX idx_library_staging_rating_key ON {LIBRARY_INDEX_STAGING_TABLE} (rating_key)")
+        con.commit()
+    logging.info(f"🏗️ Tabella di staging '{LIBRARY_INDEX_STAGING_TABLE}' pronta: l'indice attuale resta disponibile")
+
+def swap_library_index_staging() -> bool:
+    """
+    Sostituisce l'indice attivo con la tabella di staging in un'unica transazione
+    (DROP + RENAME + indici + FTS5 + trigger): i lettori vedono il vecchio indice
+    completo fino al COMMIT e poi il nuovo, mai uno vuoto o parziale.
+    """
+    fts_staging = f"{LIBRARY_FTS_TABLE}_staging"
+    start_time = time.time()
+    try:
+        # Tutto nella transazione dello scrittore unico: nessun inserimento nella staging può
+        # arrivare tra la copia FTS5 e il rename (una riga senza voce FTS corromperebbe l'indice)
+        with writer_connection(None) as con:
+            cur = con.cursor()
+            use_fts = _has_library_fts(cur)
+            if use_fts:
+                cur.execute(f"DROP TABLE IF EXISTS {fts_staging}")
+                cur.execute(_LIBRARY_FTS_SCHEMA.format(table=fts_staging))
+                cur.execute(f"""
+                    INSERT INTO {fts_staging}(rowid, title_clean, artist_clean, album_clean)
+                    SELECT id, title_clean, artist_clean, album_clean FROM {LIBRARY_INDEX_STAGING_TABLE}
+                """)
+            # DROP TABLE rimuove anche indici e trigger della vecchia tabella
+            cur.execute(f"DROP TABLE IF EXISTS {LIBRARY_INDEX_TABLE}")
+            cur.execute(f"ALTER TABLE {LIBRARY_INDEX_STAGING_TABLE} RENAME TO {LIBRARY_INDEX_TABLE}")
+            cur.execute("DROP INDEX IF EXISTS idx_library_staging_rating_key")
+            _create_library_index_indexes(cur)
+            if use_fts:
+                cur.execute(f"DROP TABLE IF EXISTS {LIBRARY_FTS_TABLE}")
+                cur.execute(f"ALTER TABLE {fts_staging} RENAME TO {LIBRARY_FTS_TABLE}")
+                _create_library_fts_triggers(cur)
+            _prune_resolution_cache(cur)
+            _bump_library_index_generation(cur)
+        
+        get_candidate_index().invalidate()
+        logging.info(f"🔁 Indice libreria sostituito con la tabella di staging in {time.time() - start_time:.1f}s")
+        return True
+    except Exception as e:
+        logging.error(f"❌ Errore durante lo swap della tabella di staging: {e}", exc_info=True)
+        return False
+
+def discard_library_index_staging():
+    """Elimina la tabella di staging (ricostruzione interrotta): l'indice attivo non viene toccato."""
+    try:
+        with writer_connection(None) as con:
+            con.execute(f"DROP TABLE IF EXISTS {LIBRARY_INDEX_STAGING_TABLE}")
+            con.execute(f"DROP TABLE IF EXISTS {LIBRARY_FTS_TABLE}_staging")
+            con.commit()
+        logging.info("🗑️ Tabella di staging scartata, indice attuale invariato")
+    except Exception as e:
+        logging.error(f"Errore eliminazione tabella di staging: {e}")
+
+# ================================
+# CACHE RISOLUZIONE TRACCE -> RATINGKEY PLEX
+# ================================
+
+# Confidenza minima (0-1) perché una risoluzione in cache venga usata senza ripetere la ricerca
+RESOLUTION_MIN_CONFIDENCE = float(os.getenv("RESOLUTION_MIN_CONFIDENCE", "0.75"))
+
+def _resolution_key(title: str, artist: str, album: str = "") -> tuple:
+    return (_clean_string(title), _clean_string(artist), _clean_string(album or ""))
+
+def _prune_resolution_cache(cur):
+    """Dopo una ricostruzione completa elimina le risoluzioni verso ratingKey non più presenti nell'indice."""
+    has_keys = cur.execute(
+        "SELECT 1 FROM plex_library_index WHERE rating_key IS NOT NULL LIMIT 1").fetchone()
+    if not has_keys:
+        return  # Indice legacy senza ratingKey: impossibile stabilire cosa sia sparito
+    cur.execute("""
+        DELETE FROM plex_resolution_cache
+        WHERE rating_key NOT IN (SELECT rating_key FROM plex_library_index WHERE rating_key IS NOT NULL)
+    """)
+    if cur.rowcount:
+        logging.info(f"🗑️ Cache risoluzioni: rimosse {cur.rowcount} voci verso tracce non più in libreria")
+
+def get_cached_resolutions(entries) -> Dict[int, int]:
+    """
+    Cerca in cache le tracce sorgente già risolte su Plex.
+    entries: sequenza di (title, artist, album, source_track_id), source_track_id opzionale.
+    Restituisce {posizione in entries: ratingKey}; l'ID sorgente ha precedenza sulla chiave normalizzata.
+    """
+    rows = []
+    for pos, (title, artist, album, source_id) in enumerate(entries):
+        rows.append((pos, *_resolution_key(title, artist, album), source_id or None))
+    if not rows:
+        return {}
+    try:
+        with sqlite3.connect(DB_PATH, timeout=30) as con:
+            cur = con.cursor()
+            cur.execute("""
+                CREATE TEMP TABLE IF NOT EXISTS resolution_lookup (
+                    pos INTEGER PRIMARY KEY, title_clean TEXT, artist_clean TEXT,
+                    album_clean TEXT, source_track_id TEXT
+                )
+            """)
+            cur.execute("DELETE FROM resolution_lookup")
+            cur.executemany("INSERT INTO resolution_lookup VALUES (?, ?, ?, ?, ?)", rows)
+            found = {}
+            for pos, rating_key in cur.execute("""
+                SELECT l.pos, c.rating_key FROM resolution_lookup l
+                JOIN plex_resolution_cache c ON c.source_track_id = l.source_track_id
+                WHERE l.source_track_id IS NOT NULL AND c.confidence >= ?
+            """, (RESOLUTION_MIN_CONFIDENCE,)):
+                found.setdefault(pos, rating_key)
+            for pos, rating_key in cur.execute("""
+                SELECT l.pos, c.rating_key FROM resolution_lookup l
+                JOIN plex_resolution_cache c
+                  ON c.title_clean = l.title_clean AND c.artist_clean = l.artist_clean
+                 AND c.album_clean = l.album_clean
+                WHERE c.confidence >= ?
+            """, (RESOLUTION_MIN_CONFIDENCE,)):
+                found.setdefault(pos, rating_key)
+            cur.execute("DROP TABLE resolution_lookup")
+            return found
+    except Exception as e:
+        logging.error(f"Errore lettura cache risoluzioni: {e}")
+        return {}
+
+def save_resolutions(resolutions) -> int:
+    """
+    Salva le risoluzioni trovate dalla ricerca Plex.
+    resolutions: sequenza di (title, artist, album, source_track_id, rating_key, confidence).
+    """
+    rows = [(*_resolution_key(title, artist, album), source_id or None, int(rating_key), confidence)
+            for title, artist, album, source_id, rating_key, confidence in resolutions]
+    if not rows:
+        return 0
+    try:
+        with writer_connection(None) as con:
+            con.executemany("""
+                INSERT INTO plex_resolution_cache
+                    (title_clean, artist_clean, album_clean, source_track_id, rating_key, confidence, resolved_at)
+                VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(title_clean, artist_clean, album_clean) DO UPDATE SET
+                    source_track_id = COALESCE(excluded.source_track_id, source_track_id),
+                    rating_key = excluded.rating_key,
+                    confidence = excluded.confidence,
+                    resolved_at = CURRENT_TIMESTAMP
+            """, rows)
+            con.commit()
+        logging.debug(f"Cache risoluzioni: salvate {len(rows)} nuove risoluzioni")
+        return len(rows)
+    except Exception as e:
+        logging.error(f"Errore salvataggio cache risoluzioni: {e}")
+        return 0
+
+def invalidate_resolutions(rating_keys) -> int:
+    """Elimina dalla cache le risoluzioni verso ratingKey che Plex non restituisce più."""
+    rating_keys = [(int(k),) for k in rating_keys]
+    if not rating_keys:
+        return 0
+    try:
+        with writer_connection(None) as con:
+            cur = con.cursor()
+            cur.executemany("DELETE FROM plex_resolution_cache WHERE rating_key = ?", rating_keys)
+            con.commit()
+            return cur.rowcount
+    except Exception as e:
+        logging.error(f"Errore invalidazione cache risoluzioni: {e}")
+        return 0
+
+# ================================
+# CACHE RICERCHE DEEZER (DeezerLinkFinder / ricerca manuale)
+# ================================
+
+def get_deezer_search_cache(kind: str, query_key: str) -> Optional[tuple]:
+    """Restituisce (found, result) per una ricerca Deezer in cache e non scaduta, altrimenti None."""
+    try:
+        with sqlite3.connect(DB_PATH, timeout=30) as con:
+            row = con.execute(
+                "SELECT found, result_json FROM deezer_search_cache WHERE kind = ? AND query_key = ? AND expires_at > ?",
+                (kind, query_key, time.time())).fetchone()
+        if row is None:
+            return None
+        return bool(row[0]), json.loads(row[1]) if row[1] else None
+    except Exception as e:
+        logging.error(f"Errore lettura cache ricerche Deezer: {e}")
+        return None
+
+def save_deezer_search_cache(kind: str, query_key: str, result, found: bool, ttl_seconds: int):
+    """Salva l'esito di una ricerca Deezer; i risultati negativi usano un TTL più breve scelto dal chiamante."""
+    if ttl_seconds <= 0:
+        return
+    now = time.time()
+    try:
+        with writer_connection(None) as con:
+            con.execute("""
+                INSERT OR REPLACE INTO deezer_search_cache (kind, query_key, result_json, found, created_at, expires_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (kind, query_key, json.dumps(result), 1 if found else 0, now, now + ttl_seconds))
+            con.commit()
+    except Exception as e:
+        logging.error(f"Errore salvataggio cache ricerche Deezer: {e}")
+
+def purge_deezer_search_cache(scope: str = 'all') -> int:
+    """Svuota la cache ricerche Deezer. scope: 'all', 'negative' (solo 'non trovato') o 'expired'."""
+    conditions = {
+        'all': "1 = 1",
+        'negative': "found = 0",
+        'expired': "expires_at <= ?",
+    }
+    if scope not in conditions:
+        raise ValueError(f"Scope di pulizia non valido: {scope}")
+    params = (time.time(),) if scope == 'expired' else ()
+    with writer_connection(None) as con:
+        cur = con.execute(f"DELETE FROM deezer_search_cache WHERE {conditions[scope]}", params)
+        con.commit()
+        logging.info(f"🗑️ Cache ricerche Deezer ({scope}): rimosse {cur.rowcount} voci")
+        return cur.rowcount
+
+def get_deezer_search_cache_counts() -> Dict[str, int]:
+    """Numero di voci in cache, distinte tra positive, negative e scadute."""
+    try:
+        with sqlite3.connect(DB_PATH, timeout=30) as con:
+            total, positive, expired = con.execute(
+                "SELECT COUNT(*), COALESCE(SUM(found), 0), COALESCE(SUM(expires_at <= ?), 0) FROM deezer_search_cache",
+                (time.time(),)).fetchone()
+        return {'entries': total, 'positive': positive, 'negative': total - positive, 'expired': expired}
+    except Exception as e:
+        logging.error(f"Errore conteggio cache ricerche Deezer: {e}")
+        return {}
+
 def test_matching_improvements(sample_size: int = 100):
     """Testa i miglioramenti del matching confrontando old vs new system."""
     try:
@@ -1341,7 +2524,7 @@ def test_matching_improvements(sample_size: int = 100):
 def clean_invalid_missing_tracks():
     """Rimuove contenuti non validi dalle tracce mancanti (TV/Film e playlist NO_DELETE)."""
     try:
-        with sqlite3.connect(DB_PATH) as con:
+        with writer_connection(None) as con:
             cur = con.cursor()
             
             # 1. Rimuovi tracce da playlist NO_DELETE (impossibili per definizione)
@@ -1427,7 +2610,7 @@ def fix_corrupted_status_values():
 def clean_resolved_missing_tracks():
     """Rimuove tutte le tracce che sono state risolte (downloaded o resolved_manual)."""
     try:
-        with sqlite3.connect(DB_PATH) as con:
+        with writer_connection(None) as con:
             cur = con.cursor()
             
             # Conta tracce risolte prima della pulizia
@@ -1465,7 +2648,7 @@ def diagnose_indexing_issues():
     """Diagnostica problemi di indicizzazione confrontando Plex con database."""
     try:
         import os
-        from plexapi.server import PlexServer
+        from .plex_connection import get_plex_server
         from plexapi.audio import Track
         
         plex_url = os.getenv("PLEX_URL")
@@ -1479,7 +2662,7 @@ def diagnose_indexing_issues():
         
         logging.info("🔍 Avvio diagnosi indicizzazione...")
         
-        plex = PlexServer(plex_url, plex_token, timeout=60)
+        plex = get_plex_server(plex_url, plex_token, timeout=60)
         music_library = plex.library.section(library_name)
         
         # Prendi un campione per analisi
@@ -1526,10 +2709,13 @@ def diagnose_indexing_issues():
 def clear_library_index():
     """Svuota la tabella dell'indice prima di una nuova scansione completa."""
     try:
-        with sqlite3.connect(DB_PATH) as con:
+        with writer_connection(None) as con:
             cur = con.cursor()
             cur.execute("DELETE FROM plex_library_index")
+            # Senza righe l'high-water mark non ha senso: il prossimo giro sarà completo
+            cur.execute("DELETE FROM library_index_state")
             con.commit()
+        get_candidate_index().invalidate()
         logging.info("Indice della libreria locale svuotato con successo.")
     except Exception as e:
         logging.error(f"Errore durante lo svuotamento dell'indice: {e}")
@@ -1743,7 +2929,7 @@ def get_macro_category_stats(user_type: str = None, service: str = None) -> Dict
         Dict con statistiche per macrocategoria
     """
     try:
-        with get_db_connection() as con:
+        with get_db_read_connection() as con:
             con.row_factory = sqlite3.Row
             cur = con.cursor()
             
@@ -1841,7 +3027,7 @@ def get_user_playlist_selections(user_type: str, service: str = None, selected_o
         Lista di dict con metadati playlist
     """
     try:
-        with get_db_connection() as con:
+        with get_db_read_connection() as con:
             con.row_factory = sqlite3.Row
             cur = con.cursor()
             
@@ -1907,6 +3093,63 @@ def toggle_playlist_selection(user_type: str, service: str, playlist_id: str, se
         logging.error(f"❌ Errore nel toggle playlist selection: {e}")
         return False
 
+def _library_sync_marker(cur) -> str:
+    """Stato dell'indice libreria (generazione + high-water mark): cambia quando entrano o escono tracce."""
+    state = dict(cur.execute(
+        "SELECT key, value FROM library_index_state WHERE key IN ('index_generation', 'plex_hwm')").fetchall())
+    return f"{state.get('index_generation', '0')}:{state.get('plex_hwm', '0')}"
+
+def get_unchanged_source_playlist_target(user_type: str, service: str, playlist_id: str,
+                                         snapshot: str) -> Optional[Tuple[int, int]]:
+    """
+    Se la playlist sorgente ha lo stesso snapshot_id/checksum dell'ultima sincronizzazione riuscita
+    restituisce (ratingKey, numero di voci) della playlist Plex scritta allora, altrimenti None.
+    Solo se all'ultimo sync restavano tracce non abbinate (o il conteggio non è noto) serve anche
+    una libreria Plex invariata, perché nel frattempo potrebbero essere arrivate.
+    Chi chiama verifica che la playlist Plex esista ancora. Disattivabile con SKIP_UNCHANGED_PLAYLISTS=0.
+    """
+    if not snapshot or os.getenv("SKIP_UNCHANGED_PLAYLISTS", "1") != "1":
+        return None
+    try:
+        with sqlite3.connect(DB_PATH, timeout=30) as con:
+            cur = con.cursor()
+            row = cur.execute("""
+                SELECT source_snapshot, synced_library_state, synced_missing_count,
+                       synced_plex_rating_key, synced_plex_item_count
+                FROM user_playlist_selections
+                WHERE user_type = ? AND service = ? AND playlist_id = ?
+            """, (user_type, service, str(playlist_id))).fetchone()
+            if not row or row[0] != snapshot or row[3] is None or row[4] is None:
+                return None
+            if row[2] != 0 and row[1] != _library_sync_marker(cur):
+                return None
+            return int(row[3]), int(row[4])
+    except Exception as e:
+        logging.error(f"❌ Errore verifica snapshot playlist {service}/{playlist_id}: {e}")
+        return None
+
+def mark_source_playlist_synced(user_type: str, service: str, playlist_id: str, snapshot: str,
+                                missing_count: int, plex_rating_key: int, plex_item_count: int):
+    """
+    Registra lo snapshot_id/checksum con cui la playlist è stata sincronizzata, le tracce rimaste
+    non abbinate e la playlist Plex scritta (ratingKey e numero di voci).
+    """
+    if not snapshot:
+        return
+    try:
+        with writer_connection(None) as con:
+            cur = con.cursor()
+            cur.execute("""
+                UPDATE user_playlist_selections
+                SET source_snapshot = ?, synced_library_state = ?, synced_missing_count = ?,
+                    synced_plex_rating_key = ?, synced_plex_item_count = ?
+                WHERE user_type = ? AND service = ? AND playlist_id = ?
+            """, (snapshot, _library_sync_marker(cur), missing_count, plex_rating_key, plex_item_count,
+                  user_type, service, str(playlist_id)))
+            con.commit()
+    except Exception as e:
+        logging.error(f"❌ Errore salvataggio snapshot playlist {service}/{playlist_id}: {e}")
+
 def get_selected_playlist_ids(user_type: str, service: str) -> List[str]:
     """
     Recupera solo gli ID delle playlist selezionate per la sincronizzazione.
@@ -1914,7 +3157,7 @@ def get_selected_playlist_ids(user_type: str, service: str) -> List[str]:
     Filtra automaticamente i contenuti non sincronizzabili (generi e radio Deezer).
     """
     try:
-        with get_db_connection() as con:
+        with get_db_read_connection() as con:
             cur = con.cursor()
             
             # Base filter per contenuti sincronizzabili
@@ -1996,7 +3239,7 @@ def get_total_selected_playlists_count():
     (tramite condivisione), conta come 2 playlist selezionate.
     """
     try:
-        with get_db_connection() as con:
+        with get_db_read_connection() as con:
             cur = con.cursor()
             
             # NUOVA QUERY: Conta TUTTE le playlist selezionate (anche copie condivise)
@@ -2185,7 +3428,7 @@ def get_shared_playlists(target_user: str):
         list: Lista delle playlist condivise con l'utente
     """
     try:
-        with get_db_connection() as con:
+        with get_db_read_connection() as con:
             cur = con.cursor()
             
             res = cur.execute("""
@@ -2240,7 +3483,7 @@ def get_user_playlist_selections_with_sharing(user_type: str, service: str, sele
         list: Lista di tutte le playlist dell'utente (proprie + copie condivise)
     """
     try:
-        with get_db_connection() as con:
+        with get_db_read_connection() as con:
             cur = con.cursor()
             
             # NUOVA LOGICA SEMPLIFICATA:
@@ -2435,7 +3678,7 @@ def save_user_playlists(user_type: str, service: str, playlists: list, playlist_
 def check_album_in_library(album_title: str, artist_name: str, auto_sync: bool = True) -> bool:
     """Verifica se un album è presente nella libreria Plex. Con auto_sync=True, aggiunge automaticamente se trovato in Plex ma mancante dal DB."""
     try:
-        with get_db_connection() as con:
+        with get_db_read_connection() as con:
             cur = con.cursor()
             
             # Pulizia stringhe per il confronto
@@ -2477,11 +3720,12 @@ def check_album_in_library(album_title: str, artist_name: str, auto_sync: bool =
                 logging.info(f"✅ Album trovato (match parziale artista): {track_count} tracce")
                 return True
             
-            # Strategia 4: Match parziale su entrambi
-            cur.execute("""
+            # Strategia 4: Match parziale su entrambi (righe candidate da FTS5, poi LIKE esatto)
+            fts_sql, fts_params = _fts_prefilter(cur, album_clean=album_clean, artist_clean=artist_clean)
+            cur.execute(f"""
                 SELECT COUNT(*) FROM plex_library_index 
-                WHERE album_clean LIKE ? AND artist_clean LIKE ?
-            """, (f"%{album_clean}%", f"%{artist_clean}%"))
+                WHERE {fts_sql} AND album_clean LIKE ? AND artist_clean LIKE ?
+            """, (*fts_params, f"%{album_clean}%", f"%{artist_clean}%"))
             
             track_count = cur.fetchone()[0]
             if track_count > 0:
@@ -2496,11 +3740,12 @@ def check_album_in_library(album_title: str, artist_name: str, auto_sync: bool =
                     for j in range(i+1, len(words)+1):
                         word_combo = " ".join(words[i:j])
                         if len(word_combo) > 3:
-                            cur.execute("""
+                            fts_sql, fts_params = _fts_prefilter(cur, artist_clean=word_combo)
+                            cur.execute(f"""
                                 SELECT DISTINCT artist_clean FROM plex_library_index 
-                                WHERE artist_clean LIKE ? OR artist_clean = ?
+                                WHERE {fts_sql} AND (artist_clean LIKE ? OR artist_clean = ?)
                                 LIMIT 10
-                            """, (f"%{word_combo}%", word_combo))
+                            """, (*fts_params, f"%{word_combo}%", word_combo))
                             
                             similar_artists = [r[0] for r in cur.fetchall()]
                             if similar_artists:
@@ -2529,11 +3774,12 @@ def check_album_in_library(album_title: str, artist_name: str, auto_sync: bool =
                     for j in range(i + 1, len(artist_words) + 1):
                         word_combo = " ".join(artist_words[i:j])
                         
-                        cur.execute("""
+                        fts_sql, fts_params = _fts_prefilter(cur, artist_clean=word_combo, album_clean=album_clean)
+                        cur.execute(f"""
                             SELECT DISTINCT artist_clean, album_clean FROM plex_library_index 
-                            WHERE artist_clean LIKE ? AND album_clean LIKE ?
+                            WHERE {fts_sql} AND artist_clean LIKE ? AND album_clean LIKE ?
                             LIMIT 3
-                        """, (f"%{word_combo}%", f"%{album_clean}%"))
+                        """, (*fts_params, f"%{word_combo}%", f"%{album_clean}%"))
                         
                         results = cur.fetchall()
                         if results:
@@ -2550,18 +3796,24 @@ def check_album_in_library(album_title: str, artist_name: str, auto_sync: bool =
                 return False
             
             # Debug finale: mostra alcuni artisti casuali per capire il formato
-            cur.execute("SELECT DISTINCT artist_clean FROM plex_library_index WHERE artist_clean != '' ORDER BY RANDOM() LIMIT 20")
+            # Campione a partire da un id casuale: evita ORDER BY RANDOM() sull'intera tabella
+            cur.execute("""
+                SELECT DISTINCT artist_clean FROM plex_library_index 
+                WHERE id >= (SELECT ABS(RANDOM()) % (MAX(id) + 1) FROM plex_library_index) AND artist_clean != ''
+                LIMIT 20
+            """)
             sample_artists = [r[0] for r in cur.fetchall()]
             logging.info(f"🔍 DEBUG: Esempi artisti nel database: {sample_artists[:10]}")
             
             # Strategia 7: Singole parole (fallback)
             for word in words:
                 if len(word) > 3:
-                    cur.execute("""
+                    fts_sql, fts_params = _fts_prefilter(cur, artist_clean=word)
+                    cur.execute(f"""
                         SELECT DISTINCT artist_clean FROM plex_library_index 
-                        WHERE artist_clean LIKE ?
+                        WHERE {fts_sql} AND artist_clean LIKE ?
                         LIMIT 5
-                    """, (f"%{word}%",))
+                    """, (*fts_params, f"%{word}%"))
                     
                     similar_artists = [r[0] for r in cur.fetchall()]
                     if similar_artists:
@@ -2574,7 +3826,7 @@ def check_album_in_library(album_title: str, artist_name: str, auto_sync: bool =
             if auto_sync:
                 try:
                     import os
-                    from plexapi.server import PlexServer
+                    from .plex_connection import get_plex_server
                     
                     logging.info(f"🔄 AUTO-SYNC: Verifico se album esiste in Plex per aggiunta automatica...")
                     
@@ -2582,7 +3834,7 @@ def check_album_in_library(album_title: str, artist_name: str, auto_sync: bool =
                     plex_token = os.getenv('PLEX_TOKEN')
                     
                     if plex_url and plex_token:
-                        plex = PlexServer(plex_url, plex_token)
+                        plex = get_plex_server(plex_url, plex_token)
                         music_section = plex.library.section('Musica')
                         
                         # Cerca l'artista in Plex
@@ -2596,30 +3848,33 @@ def check_album_in_library(album_title: str, artist_name: str, auto_sync: bool =
                                 if album_clean_plex == album_clean or album_clean in album_clean_plex or album_clean_plex in album_clean:
                                     logging.info(f"🎯 AUTO-SYNC: Album '{album.title}' trovato in Plex! Aggiunta al database...")
                                     
+                                    # Le tracce vengono lette da Plex prima di entrare nella transazione dello scrittore
+                                    album_tracks = [(track.title, track.title.lower().strip(),
+                                                     track.grandparentTitle.lower().strip(),
+                                                     track.parentTitle.lower().strip())
+                                                    for track in album.tracks()]
+                                    
                                     # Aggiungi tutte le tracce dell'album
                                     added_count = 0
-                                    for track in album.tracks():
-                                        title_clean_track = track.title.lower().strip()
-                                        artist_clean_track = track.grandparentTitle.lower().strip()
-                                        album_clean_track = track.parentTitle.lower().strip()
-                                        
-                                        # Verifica se già esiste
-                                        cur.execute('''
-                                            SELECT COUNT(*) FROM plex_library_index 
-                                            WHERE title_clean = ? AND artist_clean = ? AND album_clean = ?
-                                        ''', (title_clean_track, artist_clean_track, album_clean_track))
-                                        
-                                        if cur.fetchone()[0] == 0:
-                                            cur.execute('''
-                                                INSERT INTO plex_library_index 
-                                                (title_clean, artist_clean, album_clean, year)
-                                                VALUES (?, ?, ?, ?)
-                                            ''', (title_clean_track, artist_clean_track, album_clean_track, album.year))
-                                            added_count += 1
-                                            logging.info(f"  ➕ AUTO-SYNC: Aggiunta traccia '{track.title}'")
+                                    with writer_connection(None) as wcon:
+                                        wcur = wcon.cursor()
+                                        for track_title, title_clean_track, artist_clean_track, album_clean_track in album_tracks:
+                                            # Verifica se già esiste
+                                            wcur.execute('''
+                                                SELECT COUNT(*) FROM plex_library_index 
+                                                WHERE title_clean = ? AND artist_clean = ? AND album_clean = ?
+                                            ''', (title_clean_track, artist_clean_track, album_clean_track))
+                                            
+                                            if wcur.fetchone()[0] == 0:
+                                                wcur.execute('''
+                                                    INSERT INTO plex_library_index 
+                                                    (title_clean, artist_clean, album_clean, year)
+                                                    VALUES (?, ?, ?, ?)
+                                                ''', (title_clean_track, artist_clean_track, album_clean_track, album.year))
+                                                added_count += 1
+                                                logging.info(f"  ➕ AUTO-SYNC: Aggiunta traccia '{track_title}'")
                                     
                                     if added_count > 0:
-                                        con.commit()
                                         logging.info(f"✅ AUTO-SYNC: Album aggiunto automaticamente! {added_count} tracce")
                                         return True
                                     else:
@@ -2642,18 +3897,19 @@ def check_album_in_library(album_title: str, artist_name: str, auto_sync: bool =
 def get_album_completion_percentage(album_title: str, artist_name: str) -> int:
     """Calcola la percentuale di completezza di un album nella libreria."""
     try:
-        with get_db_connection() as con:
+        with get_db_read_connection() as con:
             cur = con.cursor()
             
             # Pulizia stringhe per il confronto
             album_clean = _clean_string(album_title)
             artist_clean = _clean_string(artist_name)
             
-            # Conta tracce presenti
-            cur.execute("""
+            # Conta tracce presenti (righe candidate da FTS5, poi LIKE esatto)
+            fts_sql, fts_params = _fts_prefilter(cur, album_clean=album_clean, artist_clean=artist_clean)
+            cur.execute(f"""
                 SELECT COUNT(*) FROM plex_library_index 
-                WHERE album_clean LIKE ? AND artist_clean LIKE ?
-            """, (f"%{album_clean}%", f"%{artist_clean}%"))
+                WHERE {fts_sql} AND album_clean LIKE ? AND artist_clean LIKE ?
+            """, (*fts_params, f"%{album_clean}%", f"%{artist_clean}%"))
             
             found_tracks = cur.fetchone()[0]
             
@@ -2724,7 +3980,7 @@ def create_plex_playlists_table():
 
 def get_plex_playlists_for_user(user_type: str):
     """Ottiene tutte le playlist Plex per un utente."""
-    with get_db_connection() as conn:
+    with get_db_read_connection() as conn:
         cursor = conn.cursor()
         cursor.execute("""
             SELECT id, plex_id, name, description, track_count, original_cover_url, 
@@ -2862,7 +4118,7 @@ def update_current_cover_source(playlist_id: int, cover_source: str):
 
 def get_playlist_by_id(playlist_id: int):
     """Ottiene una playlist specifica per ID."""
-    with get_db_connection() as conn:
+    with get_db_read_connection() as conn:
         cursor = conn.cursor()
         cursor.execute("""
             SELECT id, user_type, plex_id, name, description, track_count, 
@@ -2894,7 +4150,7 @@ def get_playlist_by_id(playlist_id: int):
 
 def get_plex_playlist_stats(user_type: str = None):
     """Ottiene statistiche delle playlist Plex."""
-    with get_db_connection() as conn:
+    with get_db_read_connection() as conn:
         cursor = conn.cursor()
         
         where_clause = "WHERE user_type = ?" if user_type else ""
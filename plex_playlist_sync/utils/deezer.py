@@ -1,13 +1,19 @@
 # utils/deezer.py
 import logging
-from typing import List
+from typing import Iterator, List
 import requests
 import os
 from plexapi.server import PlexServer
 from .helperClasses import Playlist, Track, UserInputs
-from .plex import update_or_create_plex_playlist
+from .plex import update_or_create_plex_playlist, is_playlist_unchanged, mark_playlist_synced
+from .deezer_client import get_deezer_client, DEEZER_API_URL
+from .sync_engine import run_playlist_jobs, SYNCED, UNCHANGED, EMPTY, FAILED, CANCELLED
+
+
+def _deezer_get(url: str, **kwargs) -> requests.Response:
+    """GET verso Deezer tramite il client condiviso (pool keep-alive, limiter, timeout e ritentativi)."""
+    return get_deezer_client().get(url, **kwargs)
 
-DEEZER_API_URL = "https://api.deezer.com"
 
 def _get_deezer_user_playlists(user_id: str, suffix: str = " - Deezer") -> List[Playlist]:
     """
@@ -24,11 +30,8 @@ def _get_deezer_user_playlists(user_id: str, suffix: str = " - Deezer") -> List[
     url = f"{DEEZER_API_URL}/user/{user_id}/playlists"
     
     try:
-        while url:
-            response = requests.get(url)
-            response.raise_for_status()
-            data = response.json()
-            
+        # La pagina successiva viene scaricata mentre si elabora quella corrente
+        for data in get_deezer_client().iter_pages(url):
             if 'error' in data:
                 logging.error(f"Deezer API error: {data['error']['message']}")
                 break
@@ -42,13 +45,11 @@ def _get_deezer_user_playlists(user_id: str, suffix: str = " - Deezer") -> List[
                     id=str(playlist_data['id']),
                     name=playlist_data['title'] + suffix,
                     description=playlist_data.get('description', ''),
-                    poster=playlist_data.get('picture_big', '')
+                    poster=playlist_data.get('picture_big', ''),
+                    snapshot=playlist_data.get('checksum') or ''
                 )
                 playlists.append(playlist)
             
-            # Handle pagination
-            url = data.get('next', None)
-            
         logging.info(f"🔍 Discovered {len(playlists)} public Deezer playlists for user {user_id}")
         
     except requests.exceptions.RequestException as e:
@@ -59,41 +60,83 @@ def _get_deezer_user_playlists(user_id: str, suffix: str = " - Deezer") -> List[
     return playlists
 
 
-def _get_all_tracks_from_playlist(tracklist_url: str) -> List[Track]:
+def _iter_tracks_from_playlist(tracklist_url: str) -> Iterator[Track]:
     """
-    Recupera TUTTE le tracce da un URL di tracklist, gestendo la paginazione.
+    Restituisce le tracce di una tracklist in ordine, pagina per pagina, mentre le pagine arrivano:
+    chi consuma può iniziare il matching prima che il download sia finito.
+    Le pagine dopo la prima sono richieste in parallelo; se una fallisce anche dopo i ritentativi
+    (o la prima restituisce un errore) l'errore viene propagato, così una playlist incompleta
+    non viene mai sincronizzata.
     """
-    all_tracks = []
-    url = tracklist_url
+    for data in get_deezer_client().iter_indexed_pages(tracklist_url):
+        if 'error' in data:
+            # Uno stream vuoto svuoterebbe la playlist in modalità SYNC e ne registrerebbe il checksum
+            raise requests.exceptions.RequestException(
+                f"Errore dall'API Deezer per la tracklist {tracklist_url}: {data['error'].get('message')}")
 
-    while url:
-        try:
-            response = requests.get(url)
-            response.raise_for_status()  # Lancia un errore per status HTTP non 200
-            data = response.json()
+        for track_data in data.get('data', []):
+            yield Track(
+                title=track_data.get('title', ''),
+                artist=track_data.get('artist', {}).get('name', ''),
+                album=track_data.get('album', {}).get('title', ''),
+                url=track_data.get('link', '')
+            )
 
-            for track_data in data.get('data', []):
-                track = Track(
-                    title=track_data.get('title', ''),
-                    artist=track_data.get('artist', {}).get('name', ''),
-                    album=track_data.get('album', {}).get('title', ''),
-                    url=track_data.get('link', '')
-                )
-                all_tracks.append(track)
-            
-            # Passa alla pagina successiva, se esiste
-            url = data.get('next', None)
-            if url:
-                logging.debug(f"Paginazione Deezer: passo a {url}")
 
-        except requests.exceptions.RequestException as e:
-            logging.error(f"Errore durante la richiesta alla tracklist di Deezer {url}: {e}")
-            break # Interrompe il ciclo in caso di errore di rete
-        except Exception as e:
-            logging.error(f"Errore imprevisto durante il parsing delle tracce da Deezer: {e}")
-            break
+def _sync_deezer_playlist(plex: PlexServer, playlist_id: str, suffix: str, userInputs: UserInputs,
+                          playlist_obj: Playlist = None) -> str:
+    """
+    Sincronizza una singola playlist Deezer e restituisce l'esito per il motore di sync.
+    playlist_obj: metadati già noti (auto-discovery), usati per saltare subito le playlist invariate.
+    """
+    if playlist_obj is not None and is_playlist_unchanged(plex, userInputs, 'deezer', playlist_obj):
+        return UNCHANGED
 
-    return all_tracks
+    logging.info(f"Sincronizzazione playlist Deezer con ID: {playlist_id}")
+    playlist_url = f"{DEEZER_API_URL}/playlist/{playlist_id}"
+    
+    try:
+        response = _deezer_get(playlist_url)
+        response.raise_for_status()
+        playlist_data = response.json()
+
+        # Controlla se la playlist è valida (ad es. se non è privata)
+        if 'error' in playlist_data:
+            logging.error(f"Errore dall'API Deezer per la playlist ID {playlist_id}: {playlist_data['error']['message']}")
+            return FAILED
+
+        if playlist_obj is None:
+            playlist_obj = Playlist(
+                id=playlist_data['id'],
+                name=playlist_data['title'] + suffix,
+                description=playlist_data.get('description', ''),
+                poster=playlist_data.get('picture_big', ''),
+                snapshot=playlist_data.get('checksum') or ''
+            )
+            # Il checksum cambia solo se cambia il contenuto: se coincide con l'ultimo sync non serve altro
+            if is_playlist_unchanged(plex, userInputs, 'deezer', playlist_obj):
+                return UNCHANGED
+        else:
+            playlist_obj.snapshot = playlist_data.get('checksum') or playlist_obj.snapshot
+        
+        if not playlist_data.get('nb_tracks', 1):
+            logging.warning(f"Nessuna traccia trovata per la playlist '{playlist_obj.name}'.")
+            return EMPTY
+        logging.info(f"Trovate {playlist_data.get('nb_tracks', '?')} tracce per la playlist '{playlist_obj.name}'.")
+        # Le tracce arrivano pagina per pagina: il matching su Plex parte mentre le pagine si scaricano
+        tracks = _iter_tracks_from_playlist(playlist_data['tracklist'])
+        if update_or_create_plex_playlist(plex, playlist_obj, tracks, userInputs):
+            mark_playlist_synced(userInputs, 'deezer', playlist_id, playlist_obj)
+            return SYNCED
+        # Nessuna playlist scritta (stop o brani insufficienti): lo snapshot non va registrato
+        from ..sync_logic import check_stop_flag_direct
+        return CANCELLED if check_stop_flag_direct() else EMPTY
+
+    except requests.exceptions.RequestException as e:
+        logging.error(f"Errore nel recuperare la playlist Deezer ID {playlist_id}: {e}")
+    except Exception as e:
+        logging.error(f"Errore imprevisto durante la sincronizzazione della playlist {playlist_id}: {e}")
+    return FAILED
 
 
 def deezer_playlist_sync_with_discovery(plex: PlexServer, userInputs: UserInputs) -> None:
@@ -127,38 +170,10 @@ def deezer_playlist_sync_with_discovery(plex: PlexServer, userInputs: UserInputs
             logging.warning(f"MODALITÀ TEST: Limite di {limit} playlist applicato per Deezer auto-discovery")
         
         # Process each discovered playlist
-        for i, playlist_obj in enumerate(discovered_playlists):
-            try:
-                # Check for stop flag
-                from ..sync_logic import check_stop_flag_direct
-                if check_stop_flag_direct():
-                    logging.info("🛑 Stop requested during Deezer playlist discovery")
-                    return
-                
-                logging.info(f"🎵 Processing discovered playlist: {playlist_obj.name}")
-                
-                # Get playlist details from API
-                playlist_url = f"{DEEZER_API_URL}/playlist/{playlist_obj.id}"
-                response = requests.get(playlist_url)
-                response.raise_for_status()
-                playlist_data = response.json()
-                
-                if 'error' in playlist_data:
-                    logging.error(f"Error accessing playlist {playlist_obj.id}: {playlist_data['error']['message']}")
-                    continue
-                
-                # Get tracks using existing function
-                tracks = _get_all_tracks_from_playlist(playlist_data['tracklist'])
-                
-                if tracks:
-                    update_or_create_plex_playlist(plex, playlist_obj, tracks, userInputs)
-                    logging.info(f"✅ Synced playlist '{playlist_obj.name}' with {len(tracks)} tracks")
-                else:
-                    logging.warning(f"⚠️ No tracks found in playlist '{playlist_obj.name}'")
-                    
-            except Exception as playlist_error:
-                logging.error(f"❌ Error processing playlist '{playlist_obj.name}': {playlist_error}")
-                continue
+        jobs = [(playlist_obj.name,
+                 lambda playlist_obj=playlist_obj: _sync_deezer_playlist(plex, playlist_obj.id, suffix, userInputs, playlist_obj))
+                for playlist_obj in discovered_playlists]
+        run_playlist_jobs("Deezer auto-discovery sync", jobs, userInputs.sync_workers)
         
         logging.info(f"🎉 Auto-discovery completed: processed {len(discovered_playlists)} Deezer playlists")
         
@@ -179,51 +194,13 @@ def deezer_playlist_sync(plex: PlexServer, userInputs: UserInputs) -> None:
     playlist_ids = [pid.strip() for pid in playlist_ids_str.split(',') if pid.strip()]
     suffix = " - Deezer" if userInputs.append_service_suffix else ""
     limit = int(os.getenv("TEST_MODE_PLAYLIST_LIMIT", 0))
+    if limit > 0 and len(playlist_ids) > limit:
+        logging.warning(f"MODALITÀ TEST: Limite di {limit} playlist raggiunto per Deezer. Interrompo.")
+        playlist_ids = playlist_ids[:limit]
 
-    for i, playlist_id in enumerate(playlist_ids):
-        # Check if stop was requested
-        from ..sync_logic import check_stop_flag_direct
-        if check_stop_flag_direct():
-            logging.info("🛑 Stop requested during Deezer playlist sync")
-            return
-            
-        if limit > 0 and i >= limit:
-            logging.warning(f"MODALITÀ TEST: Limite di {limit} playlist raggiunto per Deezer. Interrompo.")
-            break
-
-        logging.info(f"Sincronizzazione playlist Deezer con ID: {playlist_id}")
-        playlist_url = f"{DEEZER_API_URL}/playlist/{playlist_id}"
-        
-        try:
-            response = requests.get(playlist_url)
-            response.raise_for_status()
-            playlist_data = response.json()
-
-            # Controlla se la playlist è valida (ad es. se non è privata)
-            if 'error' in playlist_data:
-                logging.error(f"Errore dall'API Deezer per la playlist ID {playlist_id}: {playlist_data['error']['message']}")
-                continue
-
-            playlist_obj = Playlist(
-                id=playlist_data['id'],
-                name=playlist_data['title'] + suffix,
-                description=playlist_data.get('description', ''),
-                poster=playlist_data.get('picture_big', '')
-            )
-            
-            # Otteniamo le tracce usando la funzione che gestisce la paginazione
-            tracks = _get_all_tracks_from_playlist(playlist_data['tracklist'])
-            
-            if tracks:
-                logging.info(f"Trovate {len(tracks)} tracce per la playlist '{playlist_obj.name}'.")
-                update_or_create_plex_playlist(plex, playlist_obj, tracks, userInputs)
-            else:
-                logging.warning(f"Nessuna traccia trovata per la playlist '{playlist_obj.name}'.")
-
-        except requests.exceptions.RequestException as e:
-            logging.error(f"Errore nel recuperare la playlist Deezer ID {playlist_id}: {e}")
-        except Exception as e:
-            logging.error(f"Errore imprevisto durante la sincronizzazione della playlist {playlist_id}: {e}")
+    jobs = [(playlist_id, lambda playlist_id=playlist_id: _sync_deezer_playlist(plex, playlist_id, suffix, userInputs))
+            for playlist_id in playlist_ids]
+    run_playlist_jobs("Deezer sync", jobs, userInputs.sync_workers)
 
 
 # ================================
@@ -245,7 +222,7 @@ def get_deezer_charts(country: str = 'IT') -> List[dict]:
         if country:
             url += f"?country={country}"
             
-        response = requests.get(url)
+        response = _deezer_get(url)
         response.raise_for_status()
         data = response.json()
         
@@ -312,7 +289,7 @@ def get_deezer_genres() -> List[dict]:
     """
     try:
         url = f"{DEEZER_API_URL}/genre"
-        response = requests.get(url)
+        response = _deezer_get(url)
         response.raise_for_status()
         data = response.json()
         
@@ -348,7 +325,7 @@ def get_deezer_radio_stations() -> List[dict]:
     """
     try:
         url = f"{DEEZER_API_URL}/radio"
-        response = requests.get(url)
+        response = _deezer_get(url)
         response.raise_for_status()
         data = response.json()
         
@@ -405,7 +382,7 @@ def get_deezer_editorial_playlists(limit: int = 50) -> List[dict]:
                     'limit': 10  # 10 per termine di ricerca
                 }
                 
-                response = requests.get(url, params=params)
+                response = _deezer_get(url, params=params)
                 response.raise_for_status()
                 data = response.json()
                 
@@ -519,7 +496,7 @@ def search_deezer_content(query: str, search_type: str = 'track') -> List[dict]:
             'limit': 10
         }
         
-        response = requests.get(url, params=params)
+        response = _deezer_get(url, params=params)
         response.raise_for_status()
         data = response.json()
         
@@ -626,7 +603,7 @@ def search_albums_by_artist(artist_name: str, limit: int = 20) -> List[dict]:
         # 1. Cerca l'ID dell'artista
         search_url = f"{DEEZER_API_URL}/search/artist"
         params = {'q': artist_name, 'limit': 1}
-        response = requests.get(search_url, params=params)
+        response = _deezer_get(search_url, params=params)
         response.raise_for_status()
         search_data = response.json()
         
@@ -639,7 +616,7 @@ def search_albums_by_artist(artist_name: str, limit: int = 20) -> List[dict]:
         # 2. Recupera gli album dell'artista usando l'ID
         albums_url = f"{DEEZER_API_URL}/artist/{artist_id}/albums"
         params = {'limit': limit}
-        response = requests.get(albums_url, params=params)
+        response = _deezer_get(albums_url, params=params)
         response.raise_for_status()
         albums_data = response.json()
         
@@ -0,0 +1,172 @@
+"""
+Client HTTP unico per le API pubbliche Deezer.
+Tutte le chiamate condividono una Session con pool keep-alive e il rate limiter 'deezer',
+con timeout uniformi, risposte gzip e ritentativi con jitter sugli errori transitori.
+La paginazione scarica la pagina successiva mentre il chiamante elabora quella corrente;
+per le tracklist (che riportano 'total') tutte le pagine vengono richieste in parallelo.
+"""
+import os
+import time
+import random
+import logging
+import threading
+import concurrent.futures
+from typing import Iterator, Optional
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+from .rate_limiter import get_rate_limited_session
+
+logger = logging.getLogger(__name__)
+
+DEEZER_API_URL = "https://api.deezer.com"
+
+# Timeout (connessione, lettura) applicato a ogni richiesta che non ne specifica uno
+DEEZER_CONNECT_TIMEOUT = float(os.getenv("DEEZER_CONNECT_TIMEOUT", "5"))
+DEEZER_READ_TIMEOUT = float(os.getenv("DEEZER_READ_TIMEOUT", "15"))
+# Ritentativi su errori di rete e risposte 5xx (i rate limit sono gestiti dal limiter)
+DEEZER_MAX_RETRIES = int(os.getenv("DEEZER_MAX_RETRIES", "3"))
+# Elementi per pagina nelle richieste a indice (index=/limit=) e ritentativi della singola pagina
+DEEZER_PAGE_SIZE = int(os.getenv("DEEZER_PAGE_SIZE", "100"))
+DEEZER_PAGE_RETRIES = int(os.getenv("DEEZER_PAGE_RETRIES", "2"))
+
+_RETRY_STATUSES = (500, 502, 503, 504)
+
+
+class DeezerClient:
+    """Client condiviso: usare get_deezer_client() invece di istanziarlo."""
+
+    def __init__(self, max_retries: int = DEEZER_MAX_RETRIES):
+        self.session = get_rate_limited_session('deezer')
+        self.session.headers.update({
+            'Accept': 'application/json',
+            'Accept-Encoding': 'gzip, deflate',
+            'Connection': 'keep-alive',
+        })
+        self.max_retries = max_retries
+        self.timeout = (DEEZER_CONNECT_TIMEOUT, DEEZER_READ_TIMEOUT)
+        # Pool dedicato al prefetch delle pagine: non compete con i thread di sync
+        self._prefetch = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix="deezer-prefetch")
+
+    def _url(self, path_or_url: str) -> str:
+        if path_or_url.startswith(("http://", "https://")):
+            return path_or_url
+        return f"{DEEZER_API_URL}/{path_or_url.lstrip('/')}"
+
+    def get(self, path_or_url: str, params: Optional[dict] = None, **kwargs) -> requests.Response:
+        """
+        GET con timeout di default e ritentativi con backoff esponenziale + jitter
+        su errori di connessione, timeout e 5xx. Solleva l'ultima eccezione se i tentativi finiscono.
+        """
+        url = self._url(path_or_url)
+        kwargs.setdefault("timeout", self.timeout)
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.session.get(url, params=params, **kwargs)
+                if response.status_code not in _RETRY_STATUSES or attempt == self.max_retries:
+                    return response
+                reason = f"HTTP {response.status_code}"
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if attempt == self.max_retries:
+                    raise
+                reason = type(e).__name__
+            delay = min(10.0, 0.5 * (2 ** attempt)) * random.uniform(0.5, 1.5)
+            logger.debug(f"Deezer {url}: {reason}, nuovo tentativo {attempt + 2}/{self.max_retries + 1} tra {delay:.1f}s")
+            time.sleep(delay)
+        return response
+
+    def get_json(self, path_or_url: str, params: Optional[dict] = None, **kwargs) -> dict:
+        """GET che restituisce il JSON decodificato (solleva HTTPError sugli status di errore)."""
+        response = self.get(path_or_url, params=params, **kwargs)
+        response.raise_for_status()
+        return response.json()
+
+    def iter_pages(self, path_or_url: str, params: Optional[dict] = None) -> Iterator[dict]:
+        """
+        Itera le pagine di una risposta paginata seguendo 'next'.
+        La richiesta della pagina successiva parte prima di restituire quella corrente,
+        così il download si sovrappone all'elaborazione del chiamante.
+        Una pagina con 'error' viene restituita e chiude l'iterazione.
+        """
+        future = self._prefetch.submit(self.get_json, path_or_url, params)
+        while future is not None:
+            data = future.result()
+            next_url = data.get('next') if isinstance(data, dict) and 'error' not in data else None
+            future = self._prefetch.submit(self.get_json, next_url) if next_url else None
+            yield data
+
+    def _get_page(self, url: str, params: Optional[dict], index: int, limit: int) -> dict:
+        """
+        Scarica la pagina che inizia a `index`, ritentandola da sola se fallisce
+        o se Deezer risponde con un errore nel corpo. Solleva l'ultimo errore a tentativi esauriti.
+        """
+        page_params = dict(params or {}, index=index, limit=limit)
+        for attempt in range(DEEZER_PAGE_RETRIES + 1):
+            try:
+                data = self.get_json(url, page_params)
+                if 'error' not in data:
+                    return data
+                error = RuntimeError(f"errore Deezer: {data['error'].get('message', data['error'])}")
+            except (requests.exceptions.RequestException, ValueError) as e:
+                error = e
+            if attempt < DEEZER_PAGE_RETRIES:
+                delay = min(10.0, 1.0 * (2 ** attempt)) * random.uniform(0.5, 1.5)
+                logger.warning(f"Pagina Deezer {url} index={index} fallita ({error}), nuovo tentativo tra {delay:.1f}s")
+                time.sleep(delay)
+        raise error
+
+    def iter_indexed_pages(self, path_or_url: str, params: Optional[dict] = None,
+                           page_size: int = DEEZER_PAGE_SIZE) -> Iterator[dict]:
+        """
+        Itera le pagine di una lista che riporta 'total' (es. le tracklist) usando index=/limit=.
+        Dopo la prima pagina tutti gli offset sono noti: le pagine restanti vengono richieste
+        in parallelo e restituite in ordine appena disponibili, ognuna ritentata singolarmente.
+        Una prima pagina con 'error' viene restituita e chiude l'iterazione; una pagina successiva
+        che fallisce anche dopo i ritentativi solleva l'errore (meglio nessun risultato che una lista con buchi).
+        """
+        url = self._url(path_or_url)
+        first = self.get_json(url, dict(params or {}, index=0, limit=page_size))
+        yield first
+        if 'error' in first:
+            return
+
+        total = int(first.get('total') or 0)
+        # Il passo reale è l'index del link 'next' (Deezer può ridurre il limit richiesto);
+        # la lunghezza della prima pagina no: elementi filtrati o non disponibili la accorciano
+        step = _next_index(first) or page_size
+        if total <= step:
+            return
+        offsets = range(step, total, step)
+        futures = [self._prefetch.submit(self._get_page, url, params, offset, step) for offset in offsets]
+        try:
+            for future in futures:
+                yield future.result()
+        finally:
+            # Iterazione interrotta o fallita: le pagine non ancora partite non servono più
+            for future in futures:
+                future.cancel()
+
+
+def _next_index(page: dict) -> Optional[int]:
+    """Parametro index del link 'next' di una pagina, se presente e positivo."""
+    try:
+        values = parse_qs(urlparse(page.get('next') or '').query).get('index')
+        index = int(values[0]) if values else 0
+    except ValueError:
+        return None
+    return index if index > 0 else None
+
+
+_client: Optional[DeezerClient] = None
+_client_lock = threading.Lock()
+
+
+def get_deezer_client() -> DeezerClient:
+    """Ottieni il client Deezer globale (per processo)."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = DeezerClient()
+    return _client
@@ -0,0 +1,302 @@
+"""
+Coda persistente dei download su SQLite (tabella download_jobs) con pool di worker concorrenti.
+Un job per link (album/traccia Deezer) serve tutte le tracce mancanti associate;
+ogni worker reclama fino a DOWNLOAD_BATCH_SIZE job e li scarica con un solo processo streamrip.
+I worker reclamano i job in modo atomico con un lease rinnovato durante il download:
+se il processo muore, il lease scade e il job torna disponibile al riavvio.
+"""
+import os
+import json
+import time
+import uuid
+import socket
+import logging
+import threading
+from typing import Dict, Iterable, List, Optional
+
+from .database import get_db_read_connection, update_track_status, writer_connection
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, DONE, FAILED, DEAD = 'queued', 'running', 'done', 'failed', 'dead'
+ACTIVE_STATES = (QUEUED, RUNNING, FAILED)
+
+# Numero di download eseguiti in parallelo
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "2"))
+# Link scaricati con una singola invocazione di streamrip (1 = un processo per link)
+DOWNLOAD_BATCH_SIZE = int(os.getenv("DOWNLOAD_BATCH_SIZE", "5"))
+# Tentativi prima di dichiarare un job 'dead'
+DOWNLOAD_MAX_ATTEMPTS = int(os.getenv("DOWNLOAD_MAX_ATTEMPTS", "3"))
+# Durata del lease: oltre questo tempo senza rinnovo il job è considerato orfano
+DOWNLOAD_JOB_LEASE_SECONDS = int(os.getenv("DOWNLOAD_JOB_LEASE_SECONDS", "300"))
+# Attesa base prima di ritentare un job fallito (raddoppia a ogni tentativo)
+DOWNLOAD_RETRY_BACKOFF_SECONDS = int(os.getenv("DOWNLOAD_RETRY_BACKOFF_SECONDS", "60"))
+# Ogni quanto un worker inattivo ricontrolla la tabella (retry in scadenza, job di altri processi)
+_IDLE_POLL_SECONDS = 5
+# Finestra breve su cui si misura il ritmo attuale (job completati al minuto)
+_RATE_WINDOW_SECONDS = 300
+
+_instance_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+_wakeup = threading.Event()
+_workers: List[threading.Thread] = []
+_workers_lock = threading.Lock()
+
+
+def enqueue_download(link: str, track_ids: Iterable[int] = ()) -> Optional[int]:
+    """
+    Accoda il download di un link per le tracce indicate e restituisce l'ID del job.
+    Se esiste già un job attivo per lo stesso link, gli ID traccia vengono uniti a quello.
+    """
+    if not link:
+        return None
+    track_ids = [int(t) for t in track_ids if t is not None]
+    try:
+        # Nella transazione dello scrittore unico: due accodamenti dello stesso link non possono
+        # entrambi non vedere il job attivo e violare l'indice unico parziale su link
+        with writer_connection() as con:
+            row = con.execute(
+                "SELECT id, track_ids FROM download_jobs WHERE link = ? AND state IN (?, ?, ?)",
+                (link, *ACTIVE_STATES)).fetchone()
+            if row:
+                merged = sorted(set(json.loads(row['track_ids'] or '[]')) | set(track_ids))
+                con.execute("UPDATE download_jobs SET track_ids = ? WHERE id = ?", (json.dumps(merged), row['id']))
+                job_id = row['id']
+                logger.debug(f"Job download {job_id} già in coda per {link}: tracce {merged}")
+            else:
+                cur = con.execute("""
+                    INSERT INTO download_jobs (link, track_ids, state, max_attempts, created_at)
+                    VALUES (?, ?, ?, ?, ?)
+                """, (link, json.dumps(sorted(set(track_ids))), QUEUED, DOWNLOAD_MAX_ATTEMPTS, time.time()))
+                job_id = cur.lastrowid
+                logger.info(f"📥 Job download {job_id} accodato: {link} ({len(track_ids)} tracce)")
+    except Exception as e:
+        logger.error(f"Errore accodamento download {link}: {e}")
+        return None
+
+    start_download_workers()
+    _wakeup.set()
+    return job_id
+
+
+def enqueue_downloads(links: Dict[str, Iterable[int]]) -> List[int]:
+    """Accoda più link {link: [track_id, ...]} e restituisce gli ID dei job."""
+    job_ids = []
+    for link, track_ids in links.items():
+        job_id = enqueue_download(link, track_ids)
+        if job_id is not None:
+            job_ids.append(job_id)
+    return job_ids
+
+
+def claim_jobs(owner: str, limit: int = 1) -> List[dict]:
+    """
+    Reclama in modo atomico fino a `limit` job eseguibili: in coda, falliti con backoff scaduto
+    o in esecuzione con lease scaduto (worker morto / container riavviato).
+    """
+    now = time.time()
+    with writer_connection() as con:
+        # I job orfani che hanno esaurito i tentativi non vanno ripresi
+        con.execute("""
+            UPDATE download_jobs SET state = ?, finished_at = ?, lease_owner = NULL,
+                   last_error = COALESCE(last_error, 'lease scaduto')
+            WHERE state = ? AND lease_expires < ? AND attempts >= max_attempts
+        """, (DEAD, now, RUNNING, now))
+        rows = con.execute("""
+            UPDATE download_jobs
+            SET state = ?, attempts = attempts + 1, lease_owner = ?, lease_expires = ?, started_at = ?
+            WHERE id IN (
+                SELECT id FROM download_jobs
+                WHERE (state IN (?, ?) AND available_at <= ?) OR (state = ? AND lease_expires < ?)
+                ORDER BY available_at, id LIMIT ?
+            )
+            RETURNING id, link, track_ids, attempts, max_attempts
+        """, (RUNNING, owner, now + DOWNLOAD_JOB_LEASE_SECONDS, now,
+              QUEUED, FAILED, now, RUNNING, now, max(1, limit))).fetchall()
+    return sorted((dict(row) for row in rows), key=lambda job: job['id'])
+
+
+def _renew_leases(job_ids: List[int], owner: str):
+    expires = time.time() + DOWNLOAD_JOB_LEASE_SECONDS
+    with writer_connection() as con:
+        con.executemany(
+            "UPDATE download_jobs SET lease_expires = ? WHERE id = ? AND state = ? AND lease_owner = ?",
+            [(expires, job_id, RUNNING, owner) for job_id in job_ids])
+
+
+def _job_track_ids(con, job_id: int) -> List[int]:
+    row = con.execute("SELECT track_ids FROM download_jobs WHERE id = ?", (job_id,)).fetchone()
+    return json.loads(row['track_ids'] or '[]') if row else []
+
+
+def complete_job(job_id: int, owner: str) -> List[int]:
+    """Segna il job come completato e restituisce gli ID traccia serviti (riletti: possono essersene aggiunti)."""
+    with writer_connection() as con:
+        con.execute("""
+            UPDATE download_jobs SET state = ?, finished_at = ?, lease_owner = NULL, lease_expires = NULL, last_error = NULL
+            WHERE id = ? AND lease_owner = ?
+        """, (DONE, time.time(), job_id, owner))
+        track_ids = _job_track_ids(con, job_id)
+    return track_ids
+
+
+def fail_job(job_id: int, owner: str, error: str, attempts: int, max_attempts: int) -> str:
+    """Registra un errore: il job viene ritentato con backoff esponenziale o, finiti i tentativi, diventa 'dead'."""
+    now = time.time()
+    if attempts >= max_attempts:
+        state, available_at = DEAD, now
+    else:
+        state, available_at = FAILED, now + DOWNLOAD_RETRY_BACKOFF_SECONDS * (2 ** (attempts - 1))
+    with writer_connection() as con:
+        con.execute("""
+            UPDATE download_jobs SET state = ?, available_at = ?, last_error = ?, lease_owner = NULL, lease_expires = NULL,
+                   finished_at = CASE WHEN ? = 'dead' THEN ? ELSE finished_at END
+            WHERE id = ? AND lease_owner = ?
+        """, (state, available_at, str(error)[:500], state, now, job_id, owner))
+    return state
+
+
+def _finish_job(job: dict, owner: str, error: Optional[str]):
+    job_id, link = job['id'], job['link']
+    if error is None:
+        track_ids = complete_job(job_id, owner)
+        for track_id in track_ids:
+            update_track_status(track_id, 'downloaded')
+        logger.info(f"✅ Job {job_id} completato: {link} ({len(track_ids)} tracce segnate come scaricate)")
+    else:
+        state = fail_job(job_id, owner, error, job['attempts'], job['max_attempts'])
+        if state == DEAD:
+            logger.error(f"💀 Job {job_id} abbandonato dopo {job['attempts']} tentativi: {link}")
+        else:
+            logger.warning(f"⚠️ Job {job_id} fallito ({error}), verrà ritentato")
+
+
+def _run_jobs(jobs: List[dict], owner: str):
+    """Scarica i link dei job con una sola invocazione di streamrip, tenendo vivi i lease finché lavora."""
+    from .downloader import download_links_with_streamrip
+
+    job_ids = [job['id'] for job in jobs]
+    stop_heartbeat = threading.Event()
+
+    def _heartbeat():
+        while not stop_heartbeat.wait(DOWNLOAD_JOB_LEASE_SECONDS / 3):
+            try:
+                _renew_leases(job_ids, owner)
+            except Exception as e:
+                logger.warning(f"⚠️ Rinnovo lease job {job_ids} fallito: {e}")
+
+    heartbeat = threading.Thread(target=_heartbeat, name=f"download-lease-{job_ids[0]}", daemon=True)
+    heartbeat.start()
+    try:
+        logger.info(f"⬇️ Avvio download di {len(jobs)} job: " +
+                    ", ".join(f"{job['id']} (tentativo {job['attempts']}/{job['max_attempts']})" for job in jobs))
+        results = download_links_with_streamrip([job['link'] for job in jobs])
+        errors = {job['id']: None if results.get(job['link']) else "streamrip non ha completato il download"
+                  for job in jobs}
+    except Exception as e:
+        logger.error(f"Errore download job {job_ids}: {e}", exc_info=True)
+        errors = {job_id: str(e) for job_id in job_ids}
+    finally:
+        stop_heartbeat.set()
+
+    for job in jobs:
+        _finish_job(job, owner, errors[job['id']])
+
+
+def _worker_loop(worker_name: str):
+    owner = f"{_instance_id}:{worker_name}"
+    while True:
+        try:
+            jobs = claim_jobs(owner, DOWNLOAD_BATCH_SIZE)
+        except Exception as e:
+            logger.error(f"Errore nel reclamare i job di download: {e}")
+            jobs = []
+        if not jobs:
+            _wakeup.wait(_IDLE_POLL_SECONDS)
+            _wakeup.clear()
+            continue
+        try:
+            _run_jobs(jobs, owner)
+        except Exception as e:
+            logger.error(f"Errore inatteso nel worker {worker_name}: {e}", exc_info=True)
+
+
+def start_download_workers(count: Optional[int] = None) -> int:
+    """Avvia (una sola volta per processo) il pool di worker; i job lasciati in coda da un riavvio ripartono da soli."""
+    with _workers_lock:
+        if _workers:
+            return len(_workers)
+        count = max(1, count or DOWNLOAD_WORKERS)
+        for i in range(count):
+            thread = threading.Thread(target=_worker_loop, args=(f"w{i}",), name=f"download-worker-{i}", daemon=True)
+            thread.start()
+            _workers.append(thread)
+        logger.info(f"⬇️ Avviati {count} worker di download (coda persistente)")
+        return count
+
+
+def wait_for_jobs(job_ids: List[int], should_stop=None, poll_seconds: float = 2.0) -> Dict[int, str]:
+    """
+    Attende che i job indicati raggiungano uno stato finale (done/dead) e restituisce {job_id: stato}.
+    should_stop: callable opzionale; se restituisce True l'attesa si interrompe (i job restano in coda).
+    """
+    pending = set(job_ids)
+    states: Dict[int, str] = {}
+    while pending:
+        placeholders = ",".join("?" * len(pending))
+        with get_db_read_connection() as con:
+            for row in con.execute(f"SELECT id, state FROM download_jobs WHERE id IN ({placeholders})", tuple(pending)):
+                states[row['id']] = row['state']
+        pending = {job_id for job_id in pending if states.get(job_id) not in (DONE, DEAD)}
+        if not pending or (should_stop and should_stop()):
+            break
+        time.sleep(poll_seconds)
+    return states
+
+
+def get_download_queue_stats() -> dict:
+    """Profondità della coda, job in corso e throughput recente."""
+    now = time.time()
+    try:
+        with get_db_read_connection() as con:
+            counts = {state: 0 for state in (QUEUED, RUNNING, DONE, FAILED, DEAD)}
+            for row in con.execute("SELECT state, COUNT(*) AS n FROM download_jobs GROUP BY state"):
+                counts[row['state']] = row['n']
+            ready = con.execute(
+                "SELECT COUNT(*) FROM download_jobs WHERE state IN (?, ?) AND available_at <= ?",
+                (QUEUED, FAILED, now)).fetchone()[0]
+            recent = con.execute("""
+                SELECT COUNT(*) AS n, AVG(finished_at - started_at) AS avg_duration
+                FROM download_jobs WHERE state = ? AND finished_at >= ?
+            """, (DONE, now - 3600)).fetchone()
+            last_10m = con.execute(
+                "SELECT COUNT(*) FROM download_jobs WHERE state = ? AND finished_at >= ?",
+                (DONE, now - 600)).fetchone()[0]
+            last_window = con.execute(
+                "SELECT COUNT(*) FROM download_jobs WHERE state = ? AND finished_at >= ?",
+                (DONE, now - _RATE_WINDOW_SECONDS)).fetchone()[0]
+            running = [dict(row) for row in con.execute("""
+                SELECT id, link, attempts, started_at, lease_owner FROM download_jobs WHERE state = ? ORDER BY started_at
+            """, (RUNNING,))]
+            dead = [dict(row) for row in con.execute("""
+                SELECT id, link, attempts, last_error, finished_at FROM download_jobs
+                WHERE state = ? ORDER BY finished_at DESC LIMIT 10
+            """, (DEAD,))]
+    except Exception as e:
+        logger.error(f"Errore lettura statistiche coda download: {e}")
+        return {}
+
+    return {
+        'counts': counts,
+        'depth': counts[QUEUED] + counts[FAILED],
+        'ready': ready,
+        'running': running,
+        'workers': sum(1 for t in _workers if t.is_alive()),
+        'throughput': {
+            'done_last_hour': recent['n'],
+            'done_last_10_min': last_10m,
+            'per_minute': round(last_window / (_RATE_WINDOW_SECONDS / 60.0), 2),
+            'avg_per_minute_last_hour': round(recent['n'] / 60.0, 2),
+            'avg_duration': round(recent['avg_duration'], 1) if recent['avg_duration'] is not None else None,
+        },
+        'recent_dead': dead,
+    }
@@ -1,12 +1,21 @@
 import os
+import re
 import csv
 import logging
+import tempfile
+import threading
 import requests
 import subprocess
-from typing import List, Dict
+import concurrent.futures
+from collections import Counter
+from typing import List, Dict, Optional
 import time
+import tomllib
 import unicodedata
 
+from .deezer_client import get_deezer_client
+from .database import get_deezer_search_cache, save_deezer_search_cache, get_deezer_search_cache_counts
+
 def clean_url(url: str) -> str:
     """
     Rimuove caratteri invisibili come zero-width space dagli URL.
@@ -27,6 +36,56 @@ def clean_url(url: str) -> str:
     
     return cleaned
 
+def _normalize_group_key(text: str) -> str:
+    """Normalizza artista/album per il raggruppamento: minuscolo, senza accenti, parentesi e punteggiatura."""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(char for char in text if not unicodedata.combining(char)).lower()
+    text = re.sub(r'[\(\[][^\)\]]*[\)\]]', ' ', text)  # (Deluxe Edition), [Remastered], ...
+    text = re.sub(r'[^\w\s]', ' ', text)
+    return re.sub(r'\s+', ' ', text).strip()
+
+# Validità delle ricerche Deezer in cache: risultati trovati / "non trovato"
+DEEZER_CACHE_TTL_HOURS = int(os.getenv("DEEZER_CACHE_TTL_HOURS", "168"))
+DEEZER_CACHE_NEGATIVE_TTL_HOURS = int(os.getenv("DEEZER_CACHE_NEGATIVE_TTL_HOURS", "24"))
+
+_cache_counters = Counter()
+_cache_counters_lock = threading.Lock()
+
+def _search_cache_key(*parts: str) -> str:
+    return "|".join(" ".join((part or "").casefold().split()) for part in parts)
+
+def _cached_search(kind: str, query_key: str, search):
+    """
+    Esegue `search` (che restituisce (risultato, esito conclusivo)) passando dalla cache persistente.
+    I "non trovato" vengono memorizzati solo se conclusivi: un 403 o un errore di rete non diventano negativi.
+    """
+    cached = get_deezer_search_cache(kind, query_key)
+    if cached is not None:
+        found, result = cached
+        with _cache_counters_lock:
+            _cache_counters['hits' if found else 'negative_hits'] += 1
+        return result
+
+    with _cache_counters_lock:
+        _cache_counters['misses'] += 1
+    result, conclusive = search()
+    if result:
+        save_deezer_search_cache(kind, query_key, result, True, DEEZER_CACHE_TTL_HOURS * 3600)
+    elif conclusive:
+        save_deezer_search_cache(kind, query_key, None, False, DEEZER_CACHE_NEGATIVE_TTL_HOURS * 3600)
+    return result
+
+def get_deezer_cache_stats() -> Dict:
+    """Contatori hit/miss del processo e contenuto della cache persistente."""
+    with _cache_counters_lock:
+        counters = {key: _cache_counters[key] for key in ('hits', 'negative_hits', 'misses')}
+    lookups = sum(counters.values())
+    counters['hit_rate'] = round((counters['hits'] + counters['negative_hits']) / lookups, 3) if lookups else 0.0
+    counters['stored'] = get_deezer_search_cache_counts()
+    counters['ttl_hours'] = DEEZER_CACHE_TTL_HOURS
+    counters['negative_ttl_hours'] = DEEZER_CACHE_NEGATIVE_TTL_HOURS
+    return counters
+
 class DeezerLinkFinder:
     @staticmethod
     def find_track_link(track_info: dict) -> str | None:
@@ -34,13 +93,18 @@ class DeezerLinkFinder:
         Cerca una singola traccia su Deezer e restituisce il link dell'album.
         Questa funzione è usata dal downloader automatico.
         """
-        try:
-            title = track_info.get("title", "").strip()
-            artist = track_info.get("artist", "").strip()
-
-            if not title or not artist:
-                return None
+        title = (track_info.get("title") or "").strip()
+        artist = (track_info.get("artist") or "").strip()
+        if not title or not artist:
+            return None
+        return _cached_search('track_link', _search_cache_key(title, artist),
+                              lambda: DeezerLinkFinder._search_track_link(title, artist))
 
+    @staticmethod
+    def _search_track_link(title: str, artist: str) -> tuple:
+        """Restituisce (link album o None, esito conclusivo): non conclusivo se una strategia è fallita per errore."""
+        conclusive = True
+        try:
             # Multiple search strategies for better results
             search_strategies = [
                 # Strategy 1: Exact match with quotes
@@ -56,12 +120,12 @@ class DeezerLinkFinder:
             for strategy in search_strategies:
                 try:
                     search_url = f'https://api.deezer.com/search?q={strategy}&limit=5'
-                    # Add delay to avoid rate limiting
-                    time.sleep(0.5)
-                    response = requests.get(search_url, timeout=10)
+                    # Client Deezer condiviso: pool keep-alive, limiter tra i thread, Retry-After
+                    response = get_deezer_client().get(search_url, timeout=10)
                     
                     # Skip 403 errors and try next strategy
                     if response.status_code == 403:
+                        conclusive = False
                         continue
                         
                     response.raise_for_status()
@@ -74,14 +138,92 @@ class DeezerLinkFinder:
                                 album_id = track.get("album", {}).get("id")
                                 if album_id:
                                     album_link = f'https://www.deezer.com/album/{album_id}'
-                                    return album_link
+                                    return album_link, True
                 except:
+                    conclusive = False
                     continue
                     
-            return None
+            return None, conclusive
         except Exception:
+            return None, False
+
+    @staticmethod
+    def find_album_link(artist: str, album: str) -> str | None:
+        """Cerca direttamente l'album su Deezer (una sola query) e restituisce il link se titolo e artista coincidono."""
+        artist, album = (artist or "").strip(), (album or "").strip()
+        if not artist or not album:
             return None
-            
+        return _cached_search('album_link', _search_cache_key(album, artist),
+                              lambda: DeezerLinkFinder._search_album_link(artist, album))
+
+    @staticmethod
+    def _search_album_link(artist: str, album: str) -> tuple:
+        try:
+            response = get_deezer_client().get('https://api.deezer.com/search/album',
+                                        params={'q': f'artist:"{artist}" album:"{album}"', 'limit': 5}, timeout=10)
+            if response.status_code == 403:
+                return None, False
+            response.raise_for_status()
+            for result in response.json().get("data", []):
+                # Stessa validazione restrittiva delle tracce, applicata al titolo dell'album
+                if result.get("id") and _is_valid_match(album, artist, result, strict_mode=True):
+                    return f'https://www.deezer.com/album/{result["id"]}', True
+            return None, True
+        except Exception:
+            return None, False
+
+    @staticmethod
+    def find_links_by_album(tracks, max_workers: int = 3, should_stop=None) -> Dict[str, List[int]]:
+        """
+        Trova i link di download per le righe di missing_tracks (id, title, artist, album, ...)
+        raggruppandole per (artista, album) normalizzati: una ricerca album per gruppo e, se l'album
+        viene trovato e validato, il suo link viene assegnato a tutte le tracce del gruppo.
+        Altrimenti ogni traccia viene cercata da sola e associata al proprio link.
+        Le tracce senza album restano gruppi singoli.
+        Restituisce {link: [track_id, ...]}, pronto per la coda download.
+        """
+        groups: Dict[tuple, list] = {}
+        for track in tracks:
+            album = track[3] if len(track) > 3 else None
+            if album and album.strip():
+                key = ('album', _normalize_group_key(track[2]), _normalize_group_key(album))
+            else:
+                key = ('track', track[0])
+            groups.setdefault(key, []).append(track)
+
+        def _search_group(members) -> Dict[str, list]:
+            first = members[0]
+            album = first[3] if len(first) > 3 else None
+            if len(members) > 1 and album:
+                link = DeezerLinkFinder.find_album_link(first[2], album)
+                if link:
+                    return {link: members}
+            # Ricerca per traccia: ogni membro va al proprio link, un match non vale per tutto il gruppo
+            found: Dict[str, list] = {}
+            for track in members:
+                link = DeezerLinkFinder.find_track_link({'title': track[1], 'artist': track[2]})
+                if link:
+                    found.setdefault(link, []).append(track)
+            return found
+
+        logging.info(f"🔎 Ricerca link per {len(tracks)} tracce raggruppate in {len(groups)} album/tracce")
+        links: Dict[str, List[int]] = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            future_to_group = {executor.submit(_search_group, members): members for members in groups.values()}
+            for future in concurrent.futures.as_completed(future_to_group):
+                if should_stop and should_stop():
+                    for pending in future_to_group:
+                        pending.cancel()
+                    break
+                for link, members in future.result().items():
+                    links.setdefault(link, []).extend(track[0] for track in members)
+                    logging.info(f"Link trovato per {len(members)} tracce di '{members[0][2]}' "
+                                 f"({members[0][3] if len(members[0]) > 3 and members[0][3] else members[0][1]}): {link}")
+
+        found = sum(len(ids) for ids in links.values())
+        logging.info(f"🔎 Link trovati per {found}/{len(tracks)} tracce con {len(groups)} ricerche ({len(links)} link unici)")
+        return links
+
     @staticmethod
     def _clean_anime_title(title: str) -> str:
         """Clean anime-specific references from title for better search results"""
@@ -179,6 +321,12 @@ def find_potential_tracks(title: str, artist: str) -> List[Dict]:
     """
     Cerca su Deezer e restituisce una lista di potenziali tracce per la ricerca manuale.
     """
+    return _cached_search('potential_tracks', _search_cache_key(title, artist),
+                          lambda: _search_potential_tracks(title, artist)) or []
+
+def _search_potential_tracks(title: str, artist: str) -> tuple:
+    """Restituisce (tracce valide, esito conclusivo) come _search_track_link."""
+    conclusive = True
     # Multiple search strategies for better results
     search_strategies = [
         # Strategy 1: Exact match with quotes
@@ -196,12 +344,12 @@ def find_potential_tracks(title: str, artist: str) -> List[Dict]:
     for i, strategy in enumerate(search_strategies):
         try:
             search_url = f'https://api.deezer.com/search?q={strategy}&limit=10'
-            # Add delay to avoid rate limiting
-            time.sleep(0.5)
-            response = requests.get(search_url, timeout=10)
+            # Client Deezer condiviso: pool keep-alive, limiter tra i thread, Retry-After
+            response = get_deezer_client().get(search_url, timeout=10)
             
             # Skip 403 errors and try next strategy
             if response.status_code == 403:
+                conclusive = False
                 if i == 0:  # Only log on first attempt
                     logging.warning(f"Deezer API returned 403 for '{title} - {artist}', trying alternative search strategies...")
                 continue
@@ -221,17 +369,18 @@ def find_potential_tracks(title: str, artist: str) -> List[Dict]:
                 
                 if valid_results:
                     logging.info(f"Ricerca manuale per '{title} - {artist}' ha restituito {valid_count}/{total_results} risultati validi (strategia {i+1}).")
-                    return valid_results
+                    return valid_results, True
                 else:
                     logging.debug(f"Tutti i {total_results} risultati della strategia {i+1} sono stati scartati per bassa similarità.")
                 
         except Exception as e:
+            conclusive = False
             if i == 0:  # Only log detailed error on first attempt
                 logging.error(f"Errore durante la ricerca manuale su Deezer per '{title} - {artist}': {e}")
             continue
     
     logging.info(f"Nessun risultato trovato per '{title} - {artist}' dopo tutte le strategie di ricerca.")
-    return []
+    return [], conclusive
 
 def _clean_anime_title(title: str) -> str:
     """Clean anime-specific references from title for better search results"""
@@ -262,8 +411,7 @@ def find_tracks_free_search(search_query: str) -> List[Dict]:
     try:
         # Ricerca diretta senza filtri
         search_url = f'https://api.deezer.com/search?q={search_query}&limit=20'
-        time.sleep(0.5)  # Rate limiting
-        response = requests.get(search_url, timeout=10)
+        response = get_deezer_client().get(search_url, timeout=10)
         
         if response.status_code == 403:
             logging.warning(f"Deezer API returned 403 for free search: '{search_query}'")
@@ -317,59 +465,61 @@ version = "2.0"
     except Exception as e:
         logging.error(f"❌ Errore nella creazione del file di configurazione streamrip: {e}")
 
-def download_single_track_with_streamrip(link: str):
+# Indicatori nell'output di streamrip usati per stabilire l'esito di un download
+_SUCCESS_INDICATORS = [
+    "downloaded",
+    "completed",
+    "success",
+    "100%",
+    "track downloaded",
+    "marked as downloaded",  # Streamrip considera già scaricato
+    "skipping track",        # Traccia già presente
+]
+# Compaiono in ogni esecuzione: indicano solo che streamrip è partito, valgono come esito
+# solo quando l'output appartiene a un unico link
+_PROGRESS_INDICATORS = [
+    "detected list of urls", # Processamento iniziato
+    "loading"                # Caricamento contenuto
+]
+_FAILURE_INDICATORS = [
+    "not found",
+    "404",
+    "error",
+    "failed",
+    "unable to",
+    "nothing to download",
+    "no results"
+]
+
+_streamrip_env = None
+_streamrip_env_lock = threading.Lock()
+
+
+def _prepare_streamrip_environment():
     """
-    Lancia streamrip per scaricare un singolo URL.
+    Prepara una sola volta per processo directory, config e database di streamrip.
+    Restituisce (config_path, env) oppure None se manca una configurazione Deezer
+    (in quel caso si riprova alla chiamata successiva, es. dopo aver aggiunto il config).
     """
-    logging.info(f"🔧 DEBUG: Inizio download_single_track_with_streamrip per: {link}")
-    
-    if not link:
-        logging.info("Nessun link da scaricare fornito.")
-        return False
+    global _streamrip_env
+    if _streamrip_env is not None:
+        return _streamrip_env
 
-    # Pulisci l'URL da caratteri invisibili prima del download
-    cleaned_link = clean_url(link)
-    if not cleaned_link:
-        logging.error("URL vuoto dopo la pulizia, download annullato.")
-        return False
-    
-    logging.info(f"🔧 DEBUG: URL pulito: {cleaned_link}")
+    with _streamrip_env_lock:
+        if _streamrip_env is not None:
+            return _streamrip_env
 
-    logging.info(f"🔧 DEBUG: Verifico directory temp...")
-    
-    # Assicura che la directory temp esista
-    temp_dir = "/app/state_data"
-    if not os.path.exists(temp_dir):
-        try:
-            os.makedirs(temp_dir, exist_ok=True)
-            logging.info(f"📁 Creata directory temporanea: {temp_dir}")
-        except Exception as e:
-            logging.error(f"❌ Impossibile creare directory {temp_dir}: {e}")
-            # Fallback su directory corrente
-            temp_dir = "."
-    
-    temp_links_file = f"{temp_dir}/temp_download_{int(time.time())}.txt"
-    logging.info(f"🔧 DEBUG: File temporaneo: {temp_links_file}")
-    try:
-        with open(temp_links_file, "w", encoding="utf-8") as f:
-            f.write(f"{cleaned_link}\n")
-        
-        logging.info(f"Avvio del download con streamrip per il link: {cleaned_link}")
         logging.info(f"🔧 DEBUG: Configuro path streamrip...")
-        
+
         # Configura il path per streamrip usando directory con permessi corretti
         config_dir = "/app/state_data/.config/streamrip"
         config_path = os.path.join(config_dir, "config.toml")
         logging.info(f"🔧 DEBUG: Config dir: {config_dir}")
-        
-        # Crea la directory di config se non esiste
         os.makedirs(config_dir, exist_ok=True)
-        
+
         # Crea la directory Downloads se non esiste
         downloads_dir = os.getenv("MUSIC_DOWNLOAD_PATH", "/downloads")  # Usa /downloads mappato via docker-compose
         logging.info(f"🔧 DEBUG: Downloads directory: {downloads_dir}")
-        
-        # Check if downloads directory exists and is writable
         if not os.path.exists(downloads_dir):
             logging.info(f"🔧 DEBUG: Downloads directory non esiste, creando: {downloads_dir}")
             try:
@@ -379,32 +529,27 @@ def download_single_track_with_streamrip(link: str):
                 logging.error(f"❌ Errore creando downloads directory: {e}")
         else:
             logging.info(f"✅ Downloads directory esiste: {downloads_dir}")
-            
-        # Check if directory is writable
         if os.access(downloads_dir, os.W_OK):
             logging.info(f"✅ Downloads directory è scrivibile: {downloads_dir}")
         else:
             logging.error(f"❌ Downloads directory NON è scrivibile: {downloads_dir}")
-            
-        # Check directory permissions
         try:
             stat_info = os.stat(downloads_dir)
             logging.info(f"🔧 DEBUG: Downloads directory permissions: {oct(stat_info.st_mode)[-3:]} (owner: {stat_info.st_uid}, group: {stat_info.st_gid})")
         except Exception as e:
             logging.error(f"❌ Errore ottenendo permissions: {e}")
-        
+
         # Controlla se esiste già un config.toml (backward compatibility)
-        # Prima controlla la configurazione Docker-mounted
         docker_config_path = "/root/.config/streamrip/config.toml"
         writable_config_path = "/app/state_data/config.toml"
         legacy_config_path = "/app/config.toml"
-        
+
         logging.info(f"🔧 DEBUG: Verificando config files:")
         logging.info(f"  - Docker config: {docker_config_path} (exists: {os.path.exists(docker_config_path)})")
         logging.info(f"  - Writable config: {writable_config_path} (exists: {os.path.exists(writable_config_path)})")
         logging.info(f"  - Legacy config: {legacy_config_path} (exists: {os.path.exists(legacy_config_path)})")
         logging.info(f"  - Default config: {config_path} (exists: {os.path.exists(config_path)})")
-        
+
         # Priorità: writable (generato dall'entrypoint) > legacy > docker config
         if os.path.exists(writable_config_path):
             logging.info(f"✅ Utilizzando configurazione streamrip con variabili sostituite: {writable_config_path}")
@@ -420,41 +565,63 @@ def download_single_track_with_streamrip(link: str):
         else:
             # Nessun config esistente, controlla se abbiamo l'ARL nella variabile d'ambiente
             deezer_arl = os.getenv("DEEZER_ARL", "").strip()
-            
+
             if not deezer_arl:
-                logging.warning(f"⚠️ Nessuna configurazione Deezer trovata - saltando download: {cleaned_link}")
+                logging.warning("⚠️ Nessuna configurazione Deezer trovata - download saltati")
                 logging.info("💡 Opzioni per abilitare i download da Deezer:")
                 logging.info("   1. Aggiungi DEEZER_ARL=your_arl_cookie nel file .env, oppure")
                 logging.info("   2. Usa il file config.toml nella directory principale")
                 logging.info("📖 Istruzioni ARL: https://github.com/nathom/streamrip/wiki/Finding-your-Deezer-ARL-Cookie")
-                return False
-            
+                return None
+
             # Crea file di configurazione streamrip con l'ARL dal .env
             _create_streamrip_config(config_path, deezer_arl)
-        
+
+        logging.info(f"🔧 DEBUG: Config path utilizzato: {config_path}")
+        logging.info(f"🔧 DEBUG: MUSIC_DOWNLOAD_PATH env var: {os.getenv('MUSIC_DOWNLOAD_PATH', 'NOT SET')}")
+        try:
+            with open(config_path, 'r') as f:
+                config_content = f.read()
+            # Extract the downloads folder from config
+            folder_match = re.search(r'folder\s*=\s*["\']([^"\']+)["\']', config_content)
+            if folder_match:
+                folder_path = folder_match.group(1)
+                logging.info(f"🔧 DEBUG: Config folder impostato a: {folder_path}")
+                if folder_path != "/downloads":
+                    logging.warning(f"🔧 DEBUG: ATTENZIONE! Config folder non è /downloads ma {folder_path}")
+            else:
+                logging.error(f"🔧 DEBUG: Non riesco a trovare la configurazione folder nel config")
+
+            if '/music' in config_content:
+                logging.error(f"🔧 DEBUG: TROVATO /music nel config file!")
+            if '/downloads' in config_content:
+                logging.info(f"🔧 DEBUG: Config contiene /downloads (corretto)")
+        except Exception as e:
+            logging.error(f"🔧 DEBUG: Errore leggendo config: {e}")
+
         # Configura variabili d'ambiente per streamrip
         env = os.environ.copy()
         env['HOME'] = '/app/state_data'  # Usa directory con permessi corretti come HOME
         env['XDG_DATA_HOME'] = '/app/state_data/.local/share'  # Directory per database streamrip
         env['XDG_CACHE_HOME'] = '/app/state_data/.cache'  # Directory per cache streamrip
-        
+
         # Debug delle directory
         logging.info(f"Environment variables for streamrip:")
         logging.info(f"  HOME: {env.get('HOME')}")
         logging.info(f"  XDG_DATA_HOME: {env.get('XDG_DATA_HOME')}")
         logging.info(f"  XDG_CACHE_HOME: {env.get('XDG_CACHE_HOME')}")
-        
+
         # Controlla che le directory esistano
-        data_dir = env.get('XDG_DATA_HOME', '/app/state_data/.local/share')
+        data_dir = env['XDG_DATA_HOME']
         if not os.path.exists(data_dir):
             os.makedirs(data_dir, exist_ok=True)
             logging.info(f"Created XDG_DATA_HOME directory: {data_dir}")
-        
+
         streamrip_data_dir = os.path.join(data_dir, 'streamrip')
         if not os.path.exists(streamrip_data_dir):
             os.makedirs(streamrip_data_dir, exist_ok=True)
             logging.info(f"Created streamrip data directory: {streamrip_data_dir}")
-        
+
         # Prova a creare manualmente il database di streamrip se non esiste
         db_path = os.path.join(streamrip_data_dir, 'downloads.db')
         if not os.path.exists(db_path):
@@ -467,7 +634,7 @@ def download_single_track_with_streamrip(link: str):
                 logging.info(f"Created streamrip database: {db_path}")
             except Exception as db_error:
                 logging.warning(f"Could not pre-create streamrip database: {db_error}")
-        
+
         # Inizializza streamrip se necessario (crea database)
         try:
             init_command = ["rip", "--config-path", config_path, "config", "--help"]
@@ -477,170 +644,266 @@ def download_single_track_with_streamrip(link: str):
                 logging.debug(f"Streamrip init stderr: {result.stderr}")
         except Exception as init_error:
             logging.debug(f"Streamrip init warning (non-critical): {init_error}")
-        
-        command = ["rip", "--config-path", config_path, "file", temp_links_file]
-        
-        # Debug: log del comando e della configurazione
-        logging.info(f"🔧 DEBUG: Comando streamrip: {' '.join(command)}")
-        logging.info(f"🔧 DEBUG: Config path utilizzato: {config_path}")
-        logging.info(f"🔧 DEBUG: MUSIC_DOWNLOAD_PATH env var: {os.getenv('MUSIC_DOWNLOAD_PATH', 'NOT SET')}")
+
+        _streamrip_env = (config_path, env)
+        logging.info(f"✅ Ambiente streamrip pronto (config: {config_path})")
+        return _streamrip_env
+
+
+def _link_content_id(link: str) -> str:
+    """ID del contenuto (ultimo segmento numerico dell'URL) usato per riconoscere il link nell'output di streamrip."""
+    match = re.search(r'/(\d+)(?:[/?#]|$)', link)
+    return match.group(1) if match else link
+
+
+def _mentions_id(line: str, content_id: str) -> bool:
+    """Vero se la riga cita l'ID come token a sé (non come parte di un numero più lungo)."""
+    return re.search(rf'(?<!\w){re.escape(content_id)}(?!\w)', line) is not None
+
+
+def _has_recent_music_files(since: float) -> bool:
+    """Verifica fisica: file musicali scritti nella cartella download dopo `since`."""
+    download_path = os.getenv('MUSIC_DOWNLOAD_PATH', '/downloads')
+    if not os.path.exists(download_path):
+        return False
+    for root, dirs, files in os.walk(download_path):
+        for file in files:
+            if file.lower().endswith(('.mp3', '.flac', '.m4a', '.ogg', '.wav', '.aac')):
+                if os.path.getmtime(os.path.join(root, file)) > since:
+                    return True
+    return False
+
+
+def _streamrip_downloads_db(config_path: str) -> Optional[str]:
+    """Percorso del database dei download di streamrip letto dal config (None se disattivato o assente)."""
+    try:
+        with open(config_path, 'rb') as f:
+            database = tomllib.load(f).get('database', {})
+    except Exception as e:
+        logging.debug(f"Config streamrip non leggibile per il database dei download: {e}")
+        return None
+    path = database.get('downloads_path')
+    if not database.get('downloads_enabled', True) or not path or not os.path.exists(path):
+        return None
+    return path
+
+
+def _fetch_album_track_ids(album_id: str) -> tuple:
+    """Restituisce (ID delle tracce dell'album o None, esito conclusivo), nel formato di _cached_search."""
+    track_ids = []
+    try:
+        for page in get_deezer_client().iter_indexed_pages(f"album/{album_id}/tracks"):
+            if 'error' in page:
+                return None, True
+            track_ids.extend(str(track['id']) for track in page.get('data', []) if track.get('id'))
+    except Exception as e:
+        logging.debug(f"Tracklist dell'album {album_id} non disponibile: {e}")
+        return None, False
+    return track_ids or None, True
+
+
+def _link_track_ids(link: str) -> Optional[set]:
+    """
+    ID Deezer delle tracce che streamrip scarica per il link: la traccia stessa
+    o le tracce dell'album. None se il link non è una traccia/album o la tracklist non è disponibile.
+    Le tracklist degli album passano dalla cache persistente: non cambiano tra un download e l'altro.
+    """
+    match = re.search(r'deezer\.com/(?:[a-z]{2}(?:-[a-z]{2})?/)?(track|album)/(\d+)', link)
+    if not match:
+        return None
+    kind, content_id = match.groups()
+    if kind == 'track':
+        return {content_id}
+    track_ids = _cached_search('album_tracks', content_id, lambda: _fetch_album_track_ids(content_id))
+    return set(track_ids) if track_ids else None
+
+
+def _recorded_track_ids(db_path: str, track_ids: set) -> Optional[set]:
+    """Gli ID tra quelli dati che streamrip ha registrato come scaricati (None se il database non è leggibile)."""
+    import sqlite3
+    ids = sorted(track_ids)
+    try:
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, timeout=10)
         try:
-            with open(config_path, 'r') as f:
-                config_content = f.read()
-                # Extract the downloads folder from config
-                import re
-                folder_match = re.search(r'folder\s*=\s*["\']([^"\']+)["\']', config_content)
-                if folder_match:
-                    folder_path = folder_match.group(1)
-                    logging.info(f"🔧 DEBUG: Config folder impostato a: {folder_path}")
-                    if folder_path != "/downloads":
-                        logging.warning(f"🔧 DEBUG: ATTENZIONE! Config folder non è /downloads ma {folder_path}")
-                else:
-                    logging.error(f"🔧 DEBUG: Non riesco a trovare la configurazione folder nel config")
-                    
-                if '/music' in config_content:
-                    logging.error(f"🔧 DEBUG: TROVATO /music nel config file!")
-                if '/downloads' in config_content:
-                    logging.info(f"🔧 DEBUG: Config contiene /downloads (corretto)")
+            rows = conn.execute(f"SELECT id FROM downloads WHERE id IN ({','.join('?' * len(ids))})", ids).fetchall()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        logging.warning(f"⚠️ Database download di streamrip non leggibile ({db_path}): {e}")
+        return None
+    return {str(row[0]) for row in rows}
+
+
+def _map_streamrip_output(links: List[str], stdout: str, started_at: float, db_path: Optional[str]) -> Dict[str, bool]:
+    """
+    Attribuisce l'esito a ciascun link di un'invocazione di streamrip terminata senza errori.
+    streamrip non stampa l'ID dell'album quando il download riesce: l'esito viene dal suo database
+    dei download, dove finisce ogni traccia scaricata (o già presente), confrontato con le tracce
+    del link. Le righe che citano l'ID del link con soli indicatori di errore (es. "Album <id> not
+    found") lo danno per fallito. Se il database non è utilizzabile, con un solo link si usa
+    l'output (o la verifica dei file recenti); con più link l'esito non è attribuibile e il link
+    viene dato per fallito, così il job resta da ritentare invece di risultare completato.
+    """
+    stdout_lower = (stdout or "").lower()
+    lines = stdout_lower.splitlines()
+    results = {}
+    for link in links:
+        content_id = _link_content_id(link).lower()
+        mentions = [line for line in lines if _mentions_id(line, content_id)]
+        if any(i in line for line in mentions for i in _FAILURE_INDICATORS) \
+                and not any(i in line for line in mentions for i in _SUCCESS_INDICATORS):
+            logging.warning(f"Download fallito per {link}: indicatori di errore trovati nell'output")
+            results[link] = False
+            continue
+
+        track_ids = _link_track_ids(link) if db_path else None
+        recorded = _recorded_track_ids(db_path, track_ids) if track_ids else None
+        if recorded is not None:
+            if recorded and len(recorded) < len(track_ids):
+                logging.info(f"Download di {link}: {len(recorded)}/{len(track_ids)} tracce registrate da streamrip")
+            results[link] = bool(recorded)
+        elif len(links) == 1:
+            ok = any(indicator in stdout_lower for indicator in _SUCCESS_INDICATORS + _PROGRESS_INDICATORS)
+            if not ok:
+                ok = _has_recent_music_files(started_at - 120)
+                if ok:
+                    logging.info("Trovati file musicali recenti, considerando download riuscito")
+            results[link] = ok
+        else:
+            logging.warning(f"Esito di {link} non attribuibile senza il database dei download di streamrip: "
+                            f"considerato fallito, verrà ritentato")
+            results[link] = False
+    return results
+
+
+def download_links_with_streamrip(links: List[str]) -> Dict[str, bool]:
+    """
+    Scarica più link con una sola invocazione di streamrip (un unico file di link).
+    Restituisce {link originale: esito}. Se il batch fallisce nel suo insieme
+    i link vengono ritentati uno alla volta, così un link problematico non blocca gli altri.
+    Senza il database dei download di streamrip l'esito dei singoli link non è attribuibile:
+    in quel caso ogni link viene scaricato con un'invocazione separata.
+    """
+    logging.info(f"🔧 DEBUG: Inizio download_links_with_streamrip per: {', '.join(links)}")
+    results = {link: False for link in links}
+    cleaned = {}
+    for link in links:
+        cleaned_link = clean_url(link)
+        if cleaned_link:
+            cleaned.setdefault(cleaned_link, []).append(link)
+        else:
+            logging.error(f"URL vuoto dopo la pulizia, download annullato: {link!r}")
+    if not cleaned:
+        logging.info("Nessun link da scaricare fornito.")
+        return results
+    logging.info(f"🔧 DEBUG: URL puliti: {', '.join(cleaned)}")
+
+    prepared = _prepare_streamrip_environment()
+    if prepared is None:
+        return results
+    config_path, env = prepared
+
+    if len(cleaned) > 1 and _streamrip_downloads_db(config_path) is None:
+        logging.info(f"Database dei download di streamrip non disponibile: scarico {len(cleaned)} link singolarmente")
+        for cleaned_link, originals in cleaned.items():
+            ok = download_links_with_streamrip([cleaned_link])[cleaned_link]
+            for link in originals:
+                results[link] = ok
+        return results
+
+    logging.info(f"🔧 DEBUG: Verifico directory temp...")
+
+    # Assicura che la directory temp esista
+    temp_dir = "/app/state_data"
+    if not os.path.exists(temp_dir):
+        try:
+            os.makedirs(temp_dir, exist_ok=True)
+            logging.info(f"📁 Creata directory temporanea: {temp_dir}")
         except Exception as e:
-            logging.error(f"🔧 DEBUG: Errore leggendo config: {e}")
-        
+            logging.error(f"❌ Impossibile creare directory {temp_dir}: {e}")
+            temp_dir = "."  # Fallback su directory corrente
+
+    # File univoco: più worker possono lanciare streamrip nello stesso secondo
+    fd, temp_links_file = tempfile.mkstemp(prefix="temp_download_", suffix=".txt", dir=temp_dir)
+    logging.info(f"🔧 DEBUG: File temporaneo: {temp_links_file}")
+    batch = list(cleaned)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write("".join(f"{link}\n" for link in batch))
+
+        command = ["rip", "--config-path", config_path, "file", temp_links_file]
+        logging.info(f"Avvio del download con streamrip per {len(batch)} link: {', '.join(batch)}")
+        logging.info(f"🔧 DEBUG: Comando streamrip: {' '.join(command)}")
+
         # Retry logic per errori intermittenti (es. permission denied)
         max_retries = 2
         retry_count = 0
-        
         while retry_count <= max_retries:
+            started_at = time.time()
             try:
                 logging.info(f"🔧 DEBUG: Esecuzione comando streamrip (tentativo {retry_count + 1})...")
-                # Aggiungiamo un timeout per evitare che il processo si blocchi all'infinito
-                process = subprocess.run(command, capture_output=True, text=True, check=True, encoding='utf-8', timeout=1800, env=env)
-                
-                # Verifica se il download ha effettivamente scaricato qualcosa
-                download_successful = False
+                # Timeout proporzionato al numero di link, per evitare che il processo si blocchi all'infinito
+                process = subprocess.run(command, capture_output=True, text=True, check=True, encoding='utf-8',
+                                         timeout=1800 * len(batch), env=env)
                 if process.stdout:
-                    stdout_lower = process.stdout.lower()
-                    logging.debug(f"Output di streamrip per {cleaned_link}:\n{process.stdout}")
-                    
-                    # Cerca indicatori di successo nel output
-                    success_indicators = [
-                        "downloaded",
-                        "completed",
-                        "success",
-                        "100%",
-                        "track downloaded",
-                        "marked as downloaded",  # Streamrip considera già scaricato
-                        "skipping track",        # Traccia già presente
-                        "detected list of urls", # Processamento iniziato
-                        "loading"                # Caricamento contenuto
-                    ]
-                    
-                    # Cerca indicatori di fallimento
-                    failure_indicators = [
-                        "not found", 
-                        "404",
-                        "error",
-                        "failed",
-                        "unable to",
-                        "nothing to download",
-                        "no results"
-                    ]
-                    
-                    # Controlla se ci sono indicatori di successo
-                    if any(indicator in stdout_lower for indicator in success_indicators):
-                        download_successful = True
-                        
-                        # Caso speciale: se streamrip dice che le tracce sono già scaricate
-                        if "skipping track" in stdout_lower and "marked as downloaded" in stdout_lower:
-                            logging.info(f"Streamrip indica che il contenuto per {cleaned_link} è già stato scaricato in precedenza")
-                            download_successful = True
-                    
-                    # Se ci sono indicatori di fallimento, considera fallito SOLO se non ci sono successi
-                    if any(indicator in stdout_lower for indicator in failure_indicators) and not download_successful:
-                        download_successful = False
-                        logging.warning(f"Download fallito per {cleaned_link}: indicatori di errore trovati nell'output")
-                
+                    logging.debug(f"Output di streamrip:\n{process.stdout}")
                 if process.stderr:
-                     logging.warning(f"Output di warning da streamrip per {cleaned_link}:\n{process.stderr}")
-                
-                # Pulisci il file temporaneo prima del return
-                if os.path.exists(temp_links_file):
-                    os.remove(temp_links_file)
-                    logging.info(f"File temporaneo di download rimosso: {temp_links_file}")
-                
-                # Se non siamo sicuri dal solo output, facciamo una verifica fisica dei file
-                if not download_successful:
-                    # Verifica fallback: controlla se sono stati aggiunti file recenti
-                    download_path = os.getenv('MUSIC_DOWNLOAD_PATH', '/downloads')
-                    if os.path.exists(download_path):
-                        from datetime import datetime, timedelta
-                        
-                        # Cerca file musicali aggiunti negli ultimi 2 minuti
-                        two_minutes_ago = time.time() - 120
-                        recent_files = []
-                        
-                        for root, dirs, files in os.walk(download_path):
-                            for file in files:
-                                if file.lower().endswith(('.mp3', '.flac', '.m4a', '.ogg', '.wav', '.aac')):
-                                    file_path = os.path.join(root, file)
-                                    if os.path.getmtime(file_path) > two_minutes_ago:
-                                        recent_files.append(file_path)
-                        
-                        if recent_files:
-                            logging.info(f"Trovati {len(recent_files)} file musicali recenti, considerando download riuscito")
-                            download_successful = True
-                
-                if download_successful:
-                    logging.info(f"Download di {cleaned_link} completato con successo.")
-                    return True
-                else:
-                    logging.warning(f"Download di {cleaned_link} completato ma nessun file scaricato.")
-                    return False
-                
+                    logging.warning(f"Output di warning da streamrip:\n{process.stderr}")
+
+                db_path = _streamrip_downloads_db(config_path)
+                for cleaned_link, ok in _map_streamrip_output(batch, process.stdout, started_at, db_path).items():
+                    for link in cleaned[cleaned_link]:
+                        results[link] = ok
+                    if ok:
+                        logging.info(f"Download di {cleaned_link} completato con successo.")
+                    else:
+                        logging.warning(f"Download di {cleaned_link} completato ma nessun file scaricato.")
+                return results
+
             except subprocess.CalledProcessError as e:
                 retry_count += 1
-                
+
                 # Check if it's a permission error that might be temporary
                 is_permission_error = (e.stderr and "Permission denied" in e.stderr) or (e.stdout and "Permission denied" in e.stdout)
-                
+
                 if is_permission_error and retry_count <= max_retries:
-                    logging.warning(f"⚠️ Permission error durante download di {cleaned_link} (tentativo {retry_count}/{max_retries + 1}). Retry in 5 secondi...")
+                    logging.warning(f"⚠️ Permission error durante il download (tentativo {retry_count}/{max_retries + 1}). Retry in 5 secondi...")
                     time.sleep(5)  # Wait before retry
                     continue
-                else:
-                    # Final failure or non-permission error
-                    logging.error(f"❌ Errore durante l'esecuzione di streamrip per {cleaned_link} (tentativo finale {retry_count}/{max_retries + 1}).")
-                    if e.stdout: logging.error(f"Output Standard (stdout):\n{e.stdout}")
-                    if e.stderr: logging.error(f"Output di Errore (stderr):\n{e.stderr}")
-                    if os.path.exists(temp_links_file):
-                        os.remove(temp_links_file)
-                        logging.info(f"File temporaneo di download rimosso: {temp_links_file}")
-                    return False  # Failure
-
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Errore durante l'esecuzione di streamrip per {cleaned_link}.")
-        if e.stdout: logging.error(f"Output Standard (stdout):\n{e.stdout}")
-        if e.stderr: logging.error(f"Output di Errore (stderr):\n{e.stderr}")
-        if os.path.exists(temp_links_file):
-            os.remove(temp_links_file)
-            logging.info(f"File temporaneo di download rimosso: {temp_links_file}")
-        return False
+
+                logging.error(f"❌ Errore durante l'esecuzione di streamrip (tentativo finale {retry_count}/{max_retries + 1}).")
+                if e.stdout: logging.error(f"Output Standard (stdout):\n{e.stdout}")
+                if e.stderr: logging.error(f"Output di Errore (stderr):\n{e.stderr}")
+                break
+
     except Exception as e:
-        logging.error(f"🔧 DEBUG: Exception catturata nel download_single_track_with_streamrip")
+        logging.error(f"🔧 DEBUG: Exception catturata nel download_links_with_streamrip")
         logging.error(f"🔧 DEBUG: Tipo eccezione: {type(e).__name__}")
         logging.error(f"🔧 DEBUG: Messaggio: {str(e)}")
-        logging.error(f"Un errore imprevisto è occorso durante l'avvio di streamrip per {cleaned_link}: {e}")
-        import traceback
-        logging.error(f"🔧 DEBUG: Traceback completo:\n{traceback.format_exc()}")
+        logging.error(f"Un errore imprevisto è occorso durante l'avvio di streamrip: {e}", exc_info=True)
+    finally:
         if os.path.exists(temp_links_file):
             os.remove(temp_links_file)
             logging.info(f"File temporaneo di download rimosso: {temp_links_file}")
+
+    # Batch fallito nel suo insieme: isola il link problematico ritentando singolarmente
+    if len(batch) > 1:
+        logging.info(f"🔁 Batch streamrip fallito, ritento {len(batch)} link singolarmente")
+        for cleaned_link in batch:
+            ok = download_links_with_streamrip([cleaned_link])[cleaned_link]
+            for link in cleaned[cleaned_link]:
+                results[link] = ok
+    return results
+
+
+def download_single_track_with_streamrip(link: str):
+    """
+    Lancia streamrip per scaricare un singolo URL.
+    """
+    if not link:
+        logging.info("Nessun link da scaricare fornito.")
         return False
-    
-    # Se arriviamo qui senza return, significa che il retry loop è terminato senza successo
-    if os.path.exists(temp_links_file):
-        os.remove(temp_links_file)
-        logging.info(f"File temporaneo di download rimosso: {temp_links_file}")
-    return False
+    return download_links_with_streamrip([link]).get(link, False)
 
 def add_direct_download_to_queue(url: str, title: str, artist: str, service: str, content_type: str) -> str:
     """
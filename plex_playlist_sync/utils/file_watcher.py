@@ -168,8 +168,9 @@ class MusicLibraryWatcher:
                 if track.addedAt and track.addedAt >= indexing_window_ago:
                     # Aggiungi al nostro database se non esiste già
                     try:
-                        success = add_track_to_index(track)
-                        if success:
+                        # Attende il commit dello scrittore unico: un errore di scrittura arriva qui
+                        write = add_track_to_index(track)
+                        if write is not None and write.result():
                             new_tracks_added += 1
                             logger.debug(f"➕ Aggiunta traccia: {track.title} - {track.artist().title}")
                     except Exception as e:
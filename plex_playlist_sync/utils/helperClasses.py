@@ -15,6 +15,9 @@ class Playlist:
     name: str
     description: str
     poster: str
+    snapshot: str = ""  # Spotify snapshot_id / Deezer checksum: cambia solo se cambia il contenuto
+    missing_count: int = 0  # Tracce sorgente non inserite nella playlist Plex all'ultimo update_or_create_plex_playlist
+    plex_item_count: int = 0  # Voci della playlist Plex dopo l'ultima scrittura
 
 
 @dataclass
@@ -39,4 +42,7 @@ class UserInputs:
     country: str
 
     deezer_user_id: str
-    deezer_playlist_ids: str
\ No newline at end of file
+    deezer_playlist_ids: str
+
+    # Playlist sincronizzate in parallelo (1 = sequenziale)
+    sync_workers: int = 1
\ No newline at end of file
@@ -0,0 +1,238 @@
+"""
+Pipeline a stadi produttore/consumatore.
+Ogni stadio ha i propri thread e passa gli elementi al successivo tramite una coda limitata:
+se uno stadio rallenta, quelli a monte si fermano (backpressure) invece di accumulare memoria.
+Per ogni stadio vengono misurati throughput, utilizzo dei worker e occupazione della coda
+in ingresso, così il collo di bottiglia è visibile nei log e in /api/stats.
+"""
+import time
+import queue
+import logging
+import threading
+from collections import deque
+from typing import Any, Callable, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Segnale di fine flusso, inviato una volta per ogni worker dello stadio successivo
+_DONE = object()
+# Ogni quanto (secondi) le attese su code piene/vuote controllano se la pipeline è stata interrotta
+_POLL_SECONDS = 0.2
+
+
+class PipelineStage:
+    """
+    Uno stadio della pipeline: `func(elemento)` restituisce l'elemento per lo stadio successivo
+    (None lo scarta). L'output dell'ultimo stadio viene ignorato: è il consumatore finale.
+    """
+
+    def __init__(self, name: str, func: Callable[[Any], Any], workers: int = 1, queue_size: int = 4):
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        self.queue_size = max(1, queue_size)
+
+
+class _StageMetrics:
+    def __init__(self, name: str, workers: int, queue_size: int = 0):
+        self.name = name
+        self.workers = workers
+        self.queue_size = queue_size
+        self.lock = threading.Lock()
+        self.items = 0
+        self.units = 0
+        self.busy = 0.0       # Secondi spesi nel lavoro vero e proprio (somma sui worker)
+        self.starved = 0.0    # Secondi in attesa di input dallo stadio precedente
+        self.blocked = 0.0    # Secondi fermi perché la coda dello stadio successivo era piena
+        self.queue_samples = 0
+        self.queue_total = 0
+        self.queue_max = 0
+
+    def record(self, units: int, busy: float):
+        with self.lock:
+            self.items += 1
+            self.units += units
+            self.busy += busy
+
+    def sample_queue(self, depth: int):
+        with self.lock:
+            self.queue_samples += 1
+            self.queue_total += depth
+            self.queue_max = max(self.queue_max, depth)
+
+    def as_dict(self, elapsed: float) -> dict:
+        with self.lock:
+            return {
+                'name': self.name,
+                'workers': self.workers,
+                'items': self.items,
+                'units': self.units,
+                'throughput': round(self.units / elapsed, 1) if elapsed > 0 else 0.0,
+                'utilization': round(self.busy / (elapsed * self.workers), 3) if elapsed > 0 else 0.0,
+                'busy_seconds': round(self.busy, 3),
+                'starved_seconds': round(self.starved, 3),
+                'blocked_seconds': round(self.blocked, 3),
+                'queue_size': self.queue_size,
+                'queue_avg': round(self.queue_total / self.queue_samples, 2) if self.queue_samples else 0.0,
+                'queue_max': self.queue_max,
+            }
+
+
+def _units(item) -> int:
+    """Gli elementi sono di solito lotti: il throughput si misura sul numero di elementi del lotto."""
+    try:
+        return len(item)
+    except TypeError:
+        return 1
+
+
+def run_pipeline(label: str, source: Iterable, stages: List[PipelineStage], source_name: str = 'source') -> dict:
+    """
+    Consuma `source` in un thread produttore e fa scorrere ogni elemento attraverso gli stadi.
+    Blocca finché tutti gli elementi sono stati elaborati e restituisce le metriche per stadio.
+    Se la sorgente o uno stadio solleva un'eccezione la pipeline si ferma e l'eccezione
+    viene rilanciata al chiamante.
+    """
+    if not stages:
+        raise ValueError("run_pipeline richiede almeno uno stadio")
+
+    start_time = time.monotonic()
+    queues = [queue.Queue(maxsize=stage.queue_size) for stage in stages]
+    metrics = [_StageMetrics(source_name, 1)] + [_StageMetrics(s.name, s.workers, s.queue_size) for s in stages]
+    remaining = [stage.workers for stage in stages]
+    remaining_lock = threading.Lock()
+    abort = threading.Event()
+    errors = []
+
+    def _put(index: int, item, stage_metrics: _StageMetrics) -> bool:
+        """Mette l'elemento nella coda dello stadio `index`; False se la pipeline è stata interrotta."""
+        waited_since = time.monotonic()
+        while not abort.is_set():
+            try:
+                queues[index].put(item, timeout=_POLL_SECONDS)
+            except queue.Full:
+                continue
+            if item is not _DONE:
+                metrics[index + 1].sample_queue(queues[index].qsize())
+            with stage_metrics.lock:
+                stage_metrics.blocked += time.monotonic() - waited_since
+            return True
+        return False
+
+    def _signal_done(index: int):
+        for _ in range(stages[index].workers):
+            if not _put(index, _DONE, metrics[index]):
+                return
+
+    def _fail(e: Exception, where: str):
+        logger.error(f"❌ Pipeline '{label}': errore nello stadio {where}: {e}")
+        errors.append(e)
+        abort.set()
+
+    def _produce():
+        try:
+            iterator = iter(source)
+            while not abort.is_set():
+                fetch_start = time.monotonic()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                metrics[0].record(_units(item), time.monotonic() - fetch_start)
+                if not _put(0, item, metrics[0]):
+                    return
+            _signal_done(0)
+        except Exception as e:
+            _fail(e, source_name)
+
+    def _work(index: int):
+        stage, stage_metrics = stages[index], metrics[index + 1]
+        is_last = index == len(stages) - 1
+        try:
+            while not abort.is_set():
+                waited_since = time.monotonic()
+                try:
+                    item = queues[index].get(timeout=_POLL_SECONDS)
+                except queue.Empty:
+                    with stage_metrics.lock:
+                        stage_metrics.starved += time.monotonic() - waited_since
+                    continue
+                with stage_metrics.lock:
+                    stage_metrics.starved += time.monotonic() - waited_since
+                if item is _DONE:
+                    with remaining_lock:
+                        remaining[index] -= 1
+                        last_worker = remaining[index] == 0
+                    if last_worker and not is_last:
+                        _signal_done(index + 1)
+                    return
+
+                work_start = time.monotonic()
+                result = stage.func(item)
+                stage_metrics.record(_units(item), time.monotonic() - work_start)
+                if result is not None and not is_last and not _put(index + 1, result, stage_metrics):
+                    return
+        except Exception as e:
+            _fail(e, stage.name)
+
+    threads = [threading.Thread(target=_produce, name=f"{label}-{source_name}", daemon=True)]
+    for index, stage in enumerate(stages):
+        threads.extend(threading.Thread(target=_work, args=(index,), name=f"{label}-{stage.name}-{n}", daemon=True)
+                       for n in range(stage.workers))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    elapsed = time.monotonic() - start_time
+    result = {'label': label, 'elapsed': round(elapsed, 3),
+              'stages': [stage_metrics.as_dict(elapsed) for stage_metrics in metrics]}
+    _record_run(result)
+    if errors:
+        raise errors[0]
+    return result
+
+
+def bottleneck(run: dict) -> Optional[dict]:
+    """Lo stadio con l'utilizzo dei worker più alto in un'esecuzione."""
+    return max(run['stages'], key=lambda s: s['utilization'], default=None)
+
+
+def format_run(run: dict) -> str:
+    """Riga di log compatta: throughput e occupazione media/capacità della coda per stadio."""
+    parts = []
+    for stage in run['stages']:
+        queue_info = f", coda {stage['queue_avg']}/{stage['queue_size']}" if stage['queue_size'] else ""
+        parts.append(f"{stage['name']} {stage['throughput']}/s ({stage['utilization']:.0%} x{stage['workers']}{queue_info})")
+    slowest = bottleneck(run)
+    tail = f" | collo di bottiglia: {slowest['name']}" if slowest else ""
+    return f"{run['elapsed']:.1f}s | " + " | ".join(parts) + tail
+
+
+_history_lock = threading.Lock()
+_recent_runs = deque(maxlen=20)
+_stage_totals = {}
+
+
+def _record_run(run: dict):
+    with _history_lock:
+        _recent_runs.append(run)
+        for stage in run['stages']:
+            totals = _stage_totals.setdefault(stage['name'], {
+                'runs': 0, 'units': 0, 'busy_seconds': 0.0, 'starved_seconds': 0.0,
+                'blocked_seconds': 0.0, 'queue_max': 0})
+            totals['runs'] += 1
+            totals['units'] += stage['units']
+            totals['busy_seconds'] = round(totals['busy_seconds'] + stage['busy_seconds'], 3)
+            totals['starved_seconds'] = round(totals['starved_seconds'] + stage['starved_seconds'], 3)
+            totals['blocked_seconds'] = round(totals['blocked_seconds'] + stage['blocked_seconds'], 3)
+            totals['queue_max'] = max(totals['queue_max'], stage['queue_max'])
+
+
+def get_pipeline_metrics() -> dict:
+    """Totali per stadio dall'avvio e ultime esecuzioni (per /api/stats)."""
+    with _history_lock:
+        return {
+            'stages': {name: dict(totals) for name, totals in _stage_totals.items()},
+            'recent': list(_recent_runs)[-5:],
+        }
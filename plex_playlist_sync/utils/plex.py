@@ -1,6 +1,12 @@
+import bisect
+import contextlib
 import logging
+import os
 import re
-from typing import List
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from typing import Iterable, Iterator, List, Optional
 import concurrent.futures
 from concurrent.futures import TimeoutError
 
@@ -10,7 +16,131 @@ from plexapi.audio import Track as PlexTrack
 from thefuzz import fuzz
 
 from .helperClasses import Playlist, Track, UserInputs
-from .database import add_missing_track, check_track_in_index
+from .database import (
+    add_missing_tracks, check_track_in_index, match_tracks_batch,
+    get_cached_resolutions, save_resolutions, invalidate_resolutions, lookup_index_rating_keys,
+    get_unchanged_source_playlist_target, mark_source_playlist_synced
+)
+from .rate_limiter import get_rate_limiter
+from .pipeline import PipelineStage, run_pipeline, format_run
+
+# ratingKey per singola richiesta /library/metadata/k1,k2,... (limite pratico della lunghezza URL)
+PLEX_FETCH_CHUNK_SIZE = int(os.getenv("PLEX_FETCH_CHUNK_SIZE", "200"))
+# Thread dedicati alle ricerche Plex, condivisi da tutto il processo
+PLEX_SEARCH_WORKERS = int(os.getenv("PLEX_SEARCH_WORKERS", "8"))
+# Pipeline di sync: tracce per lotto, worker degli stadi più lenti e capacità delle code tra stadi.
+# Ogni lotto conferma i suoi ratingKey con le proprie richieste multi-chiave: per default un lotto
+# è grande quanto una richiesta, così la pipeline non moltiplica le chiamate a /library/metadata
+SYNC_PIPELINE_CHUNK_SIZE = int(os.getenv("SYNC_PIPELINE_CHUNK_SIZE", str(PLEX_FETCH_CHUNK_SIZE)))
+SYNC_PIPELINE_INDEX_WORKERS = int(os.getenv("SYNC_PIPELINE_INDEX_WORKERS", "2"))
+SYNC_PIPELINE_RESOLVE_WORKERS = int(os.getenv("SYNC_PIPELINE_RESOLVE_WORKERS", "4"))
+SYNC_PIPELINE_QUEUE_SIZE = int(os.getenv("SYNC_PIPELINE_QUEUE_SIZE", "4"))
+# Limiti superiori (secondi) delle fasce dell'istogramma di latenza delle ricerche
+SEARCH_LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60)
+# Limiter condiviso da tutti i thread (sync concorrente delle playlist) che interrogano Plex
+_plex_limiter = get_rate_limiter('plex')
+
+
+class _PlexSearchExecutor:
+    """
+    Executor limitato e condiviso per plex.search().
+    - Query identiche (stesso server, testo e limite) già in corso condividono lo stesso future.
+    - Chi va in timeout abbandona la ricerca senza aspettare il thread; se nessun altro
+      la attende e non è ancora partita viene tolta dalla coda.
+    - Tiene metriche su profondità della coda e latenza.
+    """
+
+    def __init__(self, workers: int):
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="plex-search")
+        self._workers = workers
+        self._lock = threading.Lock()
+        self._inflight = {}  # chiave -> [future, numero di chiamanti in attesa]
+        self._queued = 0
+        self._running = 0
+        self._histogram = [0] * (len(SEARCH_LATENCY_BUCKETS) + 1)
+        self._completed = 0
+        self._total_latency = 0.0
+        self._deduplicated = 0
+        self._timeouts = 0
+        self._errors = 0
+
+    def _run(self, plex: PlexServer, query: str, limit: int):
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+        start = time.monotonic()
+        try:
+            _plex_limiter.acquire()
+            return plex.search(query, mediatype='track', limit=limit)
+        except Exception:
+            with self._lock:
+                self._errors += 1
+            raise
+        finally:
+            elapsed = time.monotonic() - start
+            with self._lock:
+                self._running -= 1
+                self._completed += 1
+                self._total_latency += elapsed
+                self._histogram[bisect.bisect_left(SEARCH_LATENCY_BUCKETS, elapsed)] += 1
+
+    def _finished(self, key, future):
+        with self._lock:
+            if future.cancelled():
+                self._queued -= 1  # Tolta dalla coda prima di partire
+            entry = self._inflight.get(key)
+            if entry is not None and entry[0] is future:
+                del self._inflight[key]
+
+    def search(self, plex: PlexServer, query: str, limit: int, timeout_seconds: float) -> list:
+        key = (id(plex), query, limit)
+        with self._lock:
+            entry = self._inflight.get(key)
+            owner = entry is None
+            if owner:
+                self._queued += 1
+                future = self._executor.submit(self._run, plex, query, limit)
+                entry = self._inflight[key] = [future, 1]
+            else:
+                entry[1] += 1
+                self._deduplicated += 1
+        future = entry[0]
+        if owner:
+            # Una sola callback per future (fuori dal lock: se è già finita viene eseguita subito qui)
+            future.add_done_callback(lambda f: self._finished(key, f))
+        try:
+            return future.result(timeout=timeout_seconds)
+        except TimeoutError:
+            with self._lock:
+                self._timeouts += 1
+                entry[1] -= 1
+                abandon = entry[1] == 0
+            if abandon:
+                future.cancel()  # Ha effetto solo se la ricerca è ancora in coda
+            raise
+
+    def metrics(self) -> dict:
+        with self._lock:
+            labels = [f"<={bound}s" for bound in SEARCH_LATENCY_BUCKETS] + [f">{SEARCH_LATENCY_BUCKETS[-1]}s"]
+            return {
+                'workers': self._workers,
+                'queue_depth': self._queued,
+                'running': self._running,
+                'in_flight': len(self._inflight),
+                'completed': self._completed,
+                'avg_latency': round(self._total_latency / self._completed, 3) if self._completed else 0.0,
+                'latency_histogram': dict(zip(labels, self._histogram)),
+                'deduplicated': self._deduplicated,
+                'timeouts': self._timeouts,
+                'errors': self._errors,
+            }
+
+
+_search_executor = _PlexSearchExecutor(PLEX_SEARCH_WORKERS)
+
+def get_search_metrics() -> dict:
+    """Metriche dell'executor condiviso delle ricerche Plex (coda, latenza, timeout)."""
+    return _search_executor.metrics()
 
 def _clean_string_for_search(text: str) -> str:
     """Funzione di pulizia standard per la ricerca, rimuove caratteri speciali e parentesi."""
@@ -24,30 +154,33 @@ def _clean_string_for_search(text: str) -> str:
 def _search_with_timeout(plex: PlexServer, query: str, limit: int, timeout_seconds: int = 60):
     """
     Wrapper per plex.search() con timeout management usando concurrent.futures.
+    Le ricerche passano dall'executor condiviso: in caso di timeout si ritorna subito, senza attendere il thread.
     """
-    def _search():
-        return plex.search(query, mediatype='track', limit=limit)
-    
-    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
-        future = executor.submit(_search)
-        try:
-            return future.result(timeout=timeout_seconds)
-        except TimeoutError:
-            logging.warning(f"⏱️ Search timeout after {timeout_seconds}s for query: {query}")
-            return []
-        except Exception as e:
-            logging.error(f"❌ Search error for query '{query}': {e}")
-            return []
+    try:
+        return _search_executor.search(plex, query, limit, timeout_seconds)
+    except TimeoutError:
+        logging.warning(f"⏱️ Search timeout after {timeout_seconds}s for query: {query}")
+        return []
+    except Exception as e:
+        logging.error(f"❌ Search error for query '{query}': {e}")
+        return []
 
 def search_plex_track(plex: PlexServer, track: Track, limit: int = 10) -> "plexapi.audio.Track | None":
     """
     Cerca una singola traccia su Plex. È la funzione principale di ricerca.
     """
+    return search_plex_track_scored(plex, track, limit)[0]
+
+def search_plex_track_scored(plex: PlexServer, track: Track, limit: int = 10) -> tuple:
+    """
+    Come search_plex_track, ma restituisce (traccia Plex o None, punteggio fuzzy 0-100)
+    così che il chiamante possa salvare la risoluzione con la sua confidenza.
+    """
     # Check if stop was requested before starting search
     from ..sync_logic import check_stop_flag_direct
     if check_stop_flag_direct():
         logging.info("🛑 Stop requested during track search")
-        return None
+        return None, 0
     
     # Controllo preliminare: verifica se l'indice locale è popolato
     from .database import check_track_in_index
@@ -99,34 +232,372 @@ def search_plex_track(plex: PlexServer, track: Track, limit: int = 10) -> "plexa
     threshold = 75
     if best_score >= threshold and isinstance(best_match, PlexTrack):
         logging.info(f"Track found via API: {best_match.title} - {best_match.grandparentTitle} (score: {best_score}, query: '{best_query}')")
-        return best_match
+        return best_match, best_score
     else:
         if best_score == 0:
             logging.warning(f"❌ Nessun risultato da ricerca Plex per: {track.title} - {track.artist} - Possibile problema indice libreria!")
         else:
             logging.info(f"Track not found via API for: {track.title} - {track.artist} (best score: {best_score})")
-        return None
+        return None, best_score
+
+def _fetch_tracks_by_rating_keys(plex: PlexServer, rating_keys) -> "dict | None":
+    """
+    Recupera gli oggetti Plex dei ratingKey dati con una richiesta /library/metadata/k1,k2,...
+    ogni PLEX_FETCH_CHUNK_SIZE chiavi.
+    Restituisce {ratingKey: traccia}, oppure None se una richiesta fallisce (cache da non invalidare).
+    """
+    rating_keys = sorted({int(k) for k in rating_keys})
+    found = {}
+    for start in range(0, len(rating_keys), PLEX_FETCH_CHUNK_SIZE):
+        chunk = rating_keys[start:start + PLEX_FETCH_CHUNK_SIZE]
+        try:
+            _plex_limiter.acquire()
+            items = plex.fetchItems(f"/library/metadata/{','.join(map(str, chunk))}")
+        except NotFound:
+            continue  # Nessuno dei ratingKey del blocco esiste più
+        except Exception as e:
+            logging.warning(f"⚠️ Recupero tracce per ratingKey fallito, ripiego sulla ricerca: {e}")
+            return None
+        found.update((int(item.ratingKey), item) for item in items if isinstance(item, PlexTrack))
+    return found
+
+class _SharedResolutions:
+    """
+    Livello di risoluzione condiviso in memoria tra tutti i thread di un ciclo di sync
+    (utenti e playlist in parallelo): ogni traccia viene cercata su Plex una sola volta,
+    chi arriva mentre la ricerca è in corso attende il risultato invece di ripeterla.
+    Memorizza solo ratingKey (validi per tutti gli utenti dello stesso server), non oggetti Plex.
+    Vive quanto il ciclo (shared_resolutions_cycle) o la singola playlist: i "non trovato"
+    non sopravvivono a download e rescan successivi.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._done = {}      # chiave -> (ratingKey o None, punteggio)
+        self._inflight = {}  # chiave -> threading.Event
+
+    def resolve(self, key: tuple, search) -> tuple:
+        """
+        Restituisce (ratingKey o None, punteggio, oggetto Plex o None).
+        `search` viene chiamata solo dal primo thread che chiede la chiave; gli altri
+        ottengono il ratingKey ma non l'oggetto, che va recuperato sul proprio server.
+        """
+        with self._lock:
+            if key in self._done:
+                return (*self._done[key], None)
+            event = self._inflight.get(key)
+            owner = event is None
+            if owner:
+                event = self._inflight[key] = threading.Event()
+        if not owner:
+            # Nessun timeout: il proprietario imposta sempre l'evento (finally), anche dopo ricerche lunghe
+            event.wait()
+            with self._lock:
+                return (*self._done[key], None)
+
+        plex_track_obj, score = None, 0
+        try:
+            plex_track_obj, score = search()
+        finally:
+            with self._lock:
+                self._done[key] = (int(plex_track_obj.ratingKey) if plex_track_obj else None, score)
+                del self._inflight[key]
+            event.set()
+        return (*self._done[key], plex_track_obj)
+
+
+_cycle_lock = threading.Lock()
+_cycle_resolutions: Optional[_SharedResolutions] = None
+_cycle_depth = 0
+
+@contextlib.contextmanager
+def shared_resolutions_cycle():
+    """
+    Condivide le risoluzioni tra tutte le playlist sincronizzate dentro il blocco (anche da più thread).
+    Cicli sovrapposti usano lo stesso livello; all'uscita dell'ultimo viene scartato.
+    Fuori da un ciclo (AI, route web) ogni playlist usa un livello proprio.
+    """
+    global _cycle_resolutions, _cycle_depth
+    with _cycle_lock:
+        if _cycle_depth == 0:
+            _cycle_resolutions = _SharedResolutions()
+        _cycle_depth += 1
+    try:
+        yield
+    finally:
+        with _cycle_lock:
+            _cycle_depth -= 1
+            if _cycle_depth == 0:
+                _cycle_resolutions = None
+
+def _shared_resolution_key(track: Track) -> tuple:
+    return tuple(_clean_string_for_search(value or "").lower() for value in (track.title, track.artist, track.album))
+
+class _TrackChunk:
+    """Lotto di tracce consecutive della sorgente che attraversa la pipeline di sync."""
+
+    def __init__(self, start: int, tracks: List[Track]):
+        self.start = start
+        self.tracks = tracks
+        self.keys = []             # Chiavi normalizzate per le risoluzioni condivise
+        self.cached = {}           # posizione nel lotto -> ratingKey dalla cache risoluzioni
+        self.known = {}            # posizione -> ratingKey da cache o indice
+        self.resolved = {}         # ratingKey -> oggetto Plex
+        self.index_matches = {}    # posizione -> esito del match esatto nell'indice
+        self.new_resolutions = []
+        self.found = {}            # posizione -> oggetto Plex
+        self.missing = []          # posizioni non trovate né via API né nell'indice
+        self.skipped = False       # Stop richiesto: le tracce restanti non vengono elaborate
+
+    def __len__(self):
+        return len(self.tracks)
+
+
+class _ResolutionStats:
+    """Contatori condivisi dai worker di una pipeline per il riepilogo finale."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = Counter()
+
+    def add(self, **counts):
+        with self.lock:
+            self.counts.update(counts)
+
+
+def _chunk_tracks(tracks: Iterable[Track], size: int) -> Iterator[_TrackChunk]:
+    """Raggruppa le tracce in lotti man mano che la sorgente le produce (anche da un generatore)."""
+    chunk, start = [], 0
+    for track in tracks:
+        chunk.append(track)
+        if len(chunk) >= size:
+            yield _TrackChunk(start, chunk)
+            start += len(chunk)
+            chunk = []
+    if chunk:
+        yield _TrackChunk(start, chunk)
+
 
-def _get_available_plex_tracks(plex: PlexServer, tracks: List[Track]) -> tuple[list, list]:
-    """Trova le tracce Plex corrispondenti."""
-    plex_tracks, potentially_missing = [], []
-    for i, track in enumerate(tracks):
+def _normalize_chunk(chunk: _TrackChunk) -> _TrackChunk:
+    chunk.keys = [_shared_resolution_key(track) for track in chunk.tracks]
+    return chunk
+
+
+def _index_match_chunk(plex: PlexServer, chunk: _TrackChunk, stats: _ResolutionStats) -> _TrackChunk:
+    """ratingKey già noti (cache risoluzioni, poi indice locale), confermati su Plex con richieste multi-chiave."""
+    tracks = chunk.tracks
+    cached = get_cached_resolutions((track.title, track.artist, track.album, track.url) for track in tracks)
+    unresolved = [i for i in range(len(tracks)) if i not in cached]
+    from_index = lookup_index_rating_keys((tracks[i].title, tracks[i].artist, tracks[i].album) for i in unresolved)
+    known = dict(cached)
+    known.update((unresolved[pos], rating_key) for pos, rating_key in from_index.items())
+
+    resolved = _fetch_tracks_by_rating_keys(plex, known.values())
+    if resolved is None:
+        known, resolved = {}, {}
+    else:
+        stale_keys = {cached[i] for i in cached if cached[i] not in resolved}
+        if stale_keys:
+            invalidate_resolutions(stale_keys)
+            stats.add(stale=len(stale_keys))
+
+    # Verifica nell'indice locale delle tracce da cercare con una sola query
+    to_search = [i for i in range(len(tracks)) if known.get(i) not in resolved]
+    chunk.index_matches = dict(zip(to_search, match_tracks_batch(
+        ((tracks[i].title, tracks[i].artist) for i in to_search), mode='exact')))
+
+    # Le tracce risolte dall'indice entrano in cache solo dopo la conferma di Plex
+    chunk.new_resolutions = [(tracks[i].title, tracks[i].artist, tracks[i].album, tracks[i].url, known[i], 1.0)
+                             for i in known if i not in cached and known[i] in resolved]
+    chunk.cached, chunk.known, chunk.resolved = cached, known, resolved
+    from_cache = sum(1 for i in cached if cached[i] in resolved)
+    stats.add(total=len(tracks), from_cache=from_cache,
+              from_index=len(tracks) - len(to_search) - from_cache, searched=len(to_search))
+    return chunk
+
+
+def _resolve_chunk(plex: PlexServer, chunk: _TrackChunk, stats: _ResolutionStats,
+                   resolutions: _SharedResolutions) -> _TrackChunk:
+    """Cerca su Plex le tracce non risolte del lotto (una sola ricerca per traccia tra tutti i thread)."""
+    from ..sync_logic import check_stop_flag_direct
+
+    searched_found = 0
+    for i, track in enumerate(chunk.tracks):
         # Check if stop was requested (every 5 tracks for performance)
-        if i % 5 == 0:
-            from ..sync_logic import check_stop_flag_direct
-            if check_stop_flag_direct():
-                logging.info("🛑 Stop requested during track search")
-                break
-        
-        if check_track_in_index(track.title, track.artist):
-            logging.info(f"De-duplicazione: Traccia '{track.title}' trovata nell'indice. Cerco l'oggetto Plex...")
-        
-        plex_track_obj = search_plex_track(plex, track)
+        if i % 5 == 0 and check_stop_flag_direct():
+            chunk.skipped = True
+            break
+
+        plex_track_obj = chunk.resolved.get(chunk.known.get(i))
+        if plex_track_obj is None:
+            if chunk.index_matches[i]['matched']:
+                logging.info(f"De-duplicazione: Traccia '{track.title}' trovata nell'indice. Cerco l'oggetto Plex...")
+
+            rating_key, score, plex_track_obj = resolutions.resolve(
+                chunk.keys[i], lambda track=track: search_plex_track_scored(plex, track))
+            if plex_track_obj is None and rating_key is not None:
+                # Risolta da un altro thread (es. l'altro utente): serve l'oggetto sul nostro server
+                plex_track_obj = (_fetch_tracks_by_rating_keys(plex, [rating_key]) or {}).get(rating_key)
+            if plex_track_obj:
+                searched_found += 1
+                chunk.new_resolutions.append((track.title, track.artist, track.album, track.url,
+                                              plex_track_obj.ratingKey, score / 100))
         if plex_track_obj:
-            plex_tracks.append(plex_track_obj)
+            chunk.found[i] = plex_track_obj
+        else:
+            chunk.missing.append(i)
+
+    save_resolutions(chunk.new_resolutions)
+    stats.add(searched_found=searched_found)
+    return chunk
+
+
+def _get_available_plex_tracks(plex: PlexServer, tracks: Iterable[Track], label: str = "sync") -> tuple[list, list, bool, int]:
+    """
+    Trova le tracce Plex corrispondenti e quelle davvero mancanti, in ordine di sorgente.
+    Il terzo valore è False se la risoluzione è stata interrotta dallo stop (risultato parziale),
+    il quarto è il numero di tracce sorgente elaborate.
+    `tracks` può essere un generatore: la pipeline inizia il matching mentre la sorgente
+    scarica ancora le pagine successive. Stadi (ognuno con i propri worker e una coda limitata):
+    recupero sorgente -> normalizzazione -> match su cache/indice -> ricerca Plex -> raccolta mancanti.
+    """
+    stats = _ResolutionStats()
+    resolutions = _cycle_resolutions or _SharedResolutions()
+    found, missing = {}, {}
+    stopped = threading.Event()
+
+    def _collect(chunk: _TrackChunk):
+        # Ultimo stadio: unico consumatore, quindi nessun lock su found/missing
+        if chunk.skipped:
+            stopped.set()
+        found.update((chunk.start + i, obj) for i, obj in chunk.found.items())
+        for i in chunk.missing:
+            if chunk.index_matches[i]['matched']:
+                logging.info(f"De-duplicazione finale: Traccia '{chunk.tracks[i].title}' non trovata da API ma PRESENTE nell'indice locale.")
+            else:
+                missing[chunk.start + i] = chunk.tracks[i]
+
+    run = run_pipeline(label, _chunk_tracks(tracks, SYNC_PIPELINE_CHUNK_SIZE), [
+        PipelineStage('normalize', _normalize_chunk, 1, SYNC_PIPELINE_QUEUE_SIZE),
+        PipelineStage('index', lambda chunk: _index_match_chunk(plex, chunk, stats),
+                      SYNC_PIPELINE_INDEX_WORKERS, SYNC_PIPELINE_QUEUE_SIZE),
+        PipelineStage('resolve', lambda chunk: _resolve_chunk(plex, chunk, stats, resolutions),
+                      SYNC_PIPELINE_RESOLVE_WORKERS, SYNC_PIPELINE_QUEUE_SIZE),
+        PipelineStage('collect', _collect, 1, SYNC_PIPELINE_QUEUE_SIZE),
+    ], source_name='fetch')
+
+    if stopped.is_set():
+        logging.info("🛑 Stop requested during track search")
+    counts = stats.counts
+    if counts['stale']:
+        logging.info(f"🗑️ Cache risoluzioni: {counts['stale']} ratingKey non più presenti in Plex, verranno ricercati")
+    logging.info(f"🔗 Risoluzione tracce: {counts['from_cache']} da cache, {counts['from_index']} da indice, "
+                 f"{counts['searched']} cercate su Plex ({counts['searched_found']} trovate)")
+    logging.info(f"📊 Pipeline '{label}': {counts['total']} tracce in {format_run(run)}")
+    return ([found[pos] for pos in sorted(found)], [missing[pos] for pos in sorted(missing)],
+            not stopped.is_set(), counts['total'])
+
+def _stable_positions(sequence: List[int]) -> set:
+    """
+    Indici della più lunga sottosequenza crescente di `sequence`: sono le voci della playlist
+    già nell'ordine giusto tra loro, che non vanno spostate.
+    """
+    tails, tails_idx, prev = [], [], [None] * len(sequence)
+    for i, value in enumerate(sequence):
+        j = bisect.bisect_left(tails, value)
+        if j == len(tails):
+            tails.append(value)
+            tails_idx.append(i)
         else:
-            potentially_missing.append(track)
-    return plex_tracks, potentially_missing
+            tails[j] = value
+            tails_idx[j] = i
+        prev[i] = tails_idx[j - 1] if j else None
+    stable = set()
+    i = tails_idx[-1] if tails_idx else None
+    while i is not None:
+        stable.add(i)
+        i = prev[i]
+    return stable
+
+def _remove_playlist_items(plex_playlist, items: List) -> int:
+    """
+    Rimuove le voci indicate. removeItems() risolve ogni voce sulla prima copia del suo ratingKey
+    nella playlist in cache: le copie della stessa traccia vanno quindi rimosse in giri separati.
+    """
+    removed = 0
+    while items:
+        batch, seen, remaining = [], set(), []
+        for item in items:
+            (remaining if item.ratingKey in seen else batch).append(item)
+            seen.add(item.ratingKey)
+        plex_playlist.removeItems(batch)
+        removed += len(batch)
+        items = remaining
+        if items:
+            plex_playlist.reload()
+    return removed
+
+def _sync_playlist_items(plex_playlist, available_tracks: List) -> dict:
+    """
+    Porta la playlist Plex esattamente a `available_tracks` (stesso ordine) con il minimo di scritture:
+    rimuove solo le voci in eccesso, aggiunge solo quelle mancanti e sposta solo le voci fuori ordine.
+    Se la playlist è già identica non scrive nulla (updatedAt e cache dei client restano invariati).
+    plexapi individua le voci per ratingKey (la prima copia): se la playlist contiene tracce duplicate
+    fuori ordine gli spostamenti sarebbero ambigui, quindi le voci vengono rimosse e riaggiunte in ordine.
+    """
+    stats = {'added': 0, 'removed': 0, 'moved': 0}
+    target = [int(track.ratingKey) for track in available_tracks]
+    existing = plex_playlist.items()
+    if [int(item.ratingKey) for item in existing] == target:
+        return stats
+
+    # Ogni voce esistente "consuma" un'occorrenza del suo ratingKey nella lista target (gestisce i duplicati)
+    wanted = Counter(target)
+    surplus = []
+    for item in existing:
+        rating_key = int(item.ratingKey)
+        if wanted[rating_key] > 0:
+            wanted[rating_key] -= 1
+        else:
+            surplus.append(item)
+
+    stats['removed'] = _remove_playlist_items(plex_playlist, surplus)
+
+    to_add = []
+    for track in available_tracks:
+        if wanted[int(track.ratingKey)] > 0:
+            wanted[int(track.ratingKey)] -= 1
+            to_add.append(track)
+    if to_add:
+        plex_playlist.addItems(to_add)  # Una sola richiesta, in coda alla playlist
+        stats['added'] = len(to_add)
+
+    # Dopo modifiche servono le voci attuali (playlistItemID delle nuove, copie effettivamente rimaste):
+    # reload() svuota anche la cache usata da moveItem()
+    current = plex_playlist.reload().items() if stats['added'] or stats['removed'] else existing
+
+    # Posizione target di ogni voce attuale; si spostano solo quelle fuori dalla sottosequenza già ordinata
+    target_slots = defaultdict(deque)
+    for pos, rating_key in enumerate(target):
+        target_slots[rating_key].append(pos)
+    placed = [(target_slots[int(item.ratingKey)].popleft(), item)
+              for item in current if target_slots[int(item.ratingKey)]]
+    stable = _stable_positions([pos for pos, _ in placed])
+    by_position = {pos: item for pos, item in placed}
+    to_move = {pos for i, (pos, _) in enumerate(placed) if i not in stable}
+
+    if to_move and len(set(target)) != len(target):
+        # Duplicati da riordinare: moveItem() non distingue le copie, si riscrive la playlist
+        stats['removed'] += _remove_playlist_items(plex_playlist, list(current))
+        plex_playlist.addItems(available_tracks)
+        stats['added'] += len(available_tracks)
+        return stats
+
+    # In ordine di destinazione: la voce precedente è sempre già al suo posto
+    for pos in sorted(to_move):
+        plex_playlist.moveItem(by_position[pos], after=by_position.get(pos - 1))
+        stats['moved'] += 1
+    return stats
 
 def _update_plex_playlist(plex: PlexServer, available_tracks: List, playlist: Playlist, append_mode: bool = False) -> "Optional[plexapi.playlist.Playlist]":
     """
@@ -161,12 +632,22 @@ def _update_plex_playlist(plex: PlexServer, available_tracks: List, playlist: Pl
             else:
                 logging.info(f"Nessuna nuova traccia da aggiungere alla playlist '{playlist.name}' (tutte già presenti).")
         else:
-            logging.info(f"Playlist '{playlist.name}' trovata. Modalità SYNC - sostituendo con {len(available_tracks)} tracce...")
-            # Rimuove tutte le tracce esistenti per fare un sync pulito
-            plex_playlist.removeItems(plex_playlist.items())
-            # Aggiunge le nuove tracce
-            plex_playlist.addItems(available_tracks)
-            logging.info(f"Playlist '{playlist.name}' sostituita con {len(available_tracks)} tracce.")
+            logging.info(f"Playlist '{playlist.name}' trovata. Modalità SYNC - allineando a {len(available_tracks)} tracce...")
+            try:
+                # Applica solo le differenze (aggiunte, rimozioni, spostamenti) rispetto al contenuto attuale
+                changes = _sync_playlist_items(plex_playlist, available_tracks)
+                if any(changes.values()):
+                    logging.info(f"Playlist '{playlist.name}' allineata: +{changes['added']} aggiunte, "
+                                 f"-{changes['removed']} rimosse, {changes['moved']} spostate.")
+                else:
+                    logging.info(f"Playlist '{playlist.name}' già identica ({len(available_tracks)} tracce): nessuna modifica.")
+            except Exception as e:
+                logging.warning(f"⚠️ Aggiornamento incrementale di '{playlist.name}' fallito ({e}), sostituzione completa...")
+                # Rimuove tutte le tracce esistenti per fare un sync pulito
+                plex_playlist.removeItems(plex_playlist.reload().items())
+                # Aggiunge le nuove tracce
+                plex_playlist.addItems(available_tracks)
+                logging.info(f"Playlist '{playlist.name}' sostituita con {len(available_tracks)} tracce.")
         return plex_playlist
 
     except NotFound:
@@ -183,12 +664,58 @@ def _update_plex_playlist(plex: PlexServer, available_tracks: List, playlist: Pl
         logging.error(f"Errore imprevisto durante la gestione della playlist '{playlist.name}': {e}")
         return None
 
-def update_or_create_plex_playlist(plex: PlexServer, playlist: Playlist, tracks: List[Track], userInputs: UserInputs, force_sync_mode: bool = False) -> "Optional[plexapi.playlist.Playlist]":
+def _user_type_for(userInputs: UserInputs) -> str:
+    from ..sync_logic import _determine_user_type_from_token
+    return _determine_user_type_from_token(userInputs.plex_token)
+
+def is_playlist_unchanged(plex: PlexServer, userInputs: UserInputs, service: str, playlist: Playlist) -> bool:
+    """
+    Controllo da fare prima di scaricare le tracce: True se la playlist sorgente non è cambiata
+    (stesso snapshot_id/checksum) dall'ultima sincronizzazione e la playlist Plex scritta allora
+    esiste ancora con lo stesso numero di voci (non cancellata né modificata a mano).
+    """
+    target = get_unchanged_source_playlist_target(_user_type_for(userInputs), service, playlist.id, playlist.snapshot)
+    if target is None:
+        return False
+    rating_key, item_count = target
+    try:
+        leaf_count = plex.fetchItem(rating_key).leafCount
+    except NotFound:
+        logging.info(f"🔄 Playlist '{playlist.name}' invariata su {service} ma non più presente in Plex: verrà ricreata")
+        return False
+    except Exception as e:
+        logging.warning(f"⚠️ Verifica playlist Plex {rating_key} per '{playlist.name}' non riuscita ({e}): sync completa")
+        return False
+    if leaf_count != item_count:
+        logging.info(f"🔄 Playlist '{playlist.name}' invariata su {service} ma modificata in Plex "
+                     f"({leaf_count} voci invece di {item_count}): verrà risincronizzata")
+        return False
+    logging.info(f"⏭️ Playlist '{playlist.name}' invariata su {service} (snapshot {playlist.snapshot[:12]}): sync saltata")
+    return True
+
+def mark_playlist_synced(userInputs: UserInputs, service: str, source_playlist_id: str, playlist: Playlist):
+    """
+    Da chiamare dopo una sincronizzazione riuscita, con l'ID della playlist sorgente e la playlist
+    restituita da update_or_create_plex_playlist (id = ratingKey Plex).
+    """
+    mark_source_playlist_synced(_user_type_for(userInputs), service, source_playlist_id, playlist.snapshot,
+                                playlist.missing_count, playlist.id, playlist.plex_item_count)
+
+def update_or_create_plex_playlist(plex: PlexServer, playlist: Playlist, tracks: Iterable[Track], userInputs: UserInputs, force_sync_mode: bool = False) -> "Optional[plexapi.playlist.Playlist]":
     """
     Crea o aggiorna una playlist Plex, salva le tracce mancanti e restituisce l'oggetto playlist creato.
+    tracks: lista o generatore (le tracce vengono abbinate mentre la sorgente le scarica)
     force_sync_mode: Se True, forza la modalità SYNC anche se userInputs.append_instead_of_sync è True
+    Restituisce None (playlist non toccata) anche se lo stop interrompe la risoluzione:
+    in modalità SYNC una lista parziale toglierebbe dalla playlist le tracce non ancora risolte.
     """
-    available_tracks, potentially_missing = _get_available_plex_tracks(plex, tracks)
+    available_tracks, truly_missing_tracks, complete, total = _get_available_plex_tracks(plex, tracks, playlist.name)
+    # Include le tracce presenti nell'indice ma non risolte: nemmeno quelle sono nella playlist
+    playlist.missing_count = total - len(available_tracks)
+    if not complete:
+        logging.warning(f"🛑 Playlist '{playlist.name}' non aggiornata: risoluzione interrotta dallo stop "
+                        f"({len(available_tracks)} tracce risolte finora)")
+        return None
     
     created_playlist = None
     if len(available_tracks) >= userInputs.plex_min_songs:
@@ -202,6 +729,10 @@ def update_or_create_plex_playlist(plex: PlexServer, playlist: Playlist, tracks:
 
     if created_playlist:
         playlist.id = created_playlist.ratingKey
+        try:
+            playlist.plex_item_count = created_playlist.reload().leafCount
+        except Exception:
+            playlist.plex_item_count = len(available_tracks)
         if playlist.description and userInputs.add_playlist_description:
             try:
                 created_playlist.edit(summary=playlist.description)
@@ -217,24 +748,16 @@ def update_or_create_plex_playlist(plex: PlexServer, playlist: Playlist, tracks:
                 logging.error(f"Failed to update poster for playlist {playlist.name}: {e}")
         logging.info(f"Updated playlist {playlist.name} with summary and poster.")
 
-    if potentially_missing:
-        truly_missing_tracks = []
-        for track in potentially_missing:
-            if not check_track_in_index(track.title, track.artist):
-                truly_missing_tracks.append(track)
-            else:
-                logging.info(f"De-duplicazione finale: Traccia '{track.title}' non trovata da API ma PRESENTE nell'indice locale.")
-        
-        if truly_missing_tracks:
-            logging.info(f"Trovate {len(truly_missing_tracks)} tracce veramente mancanti per '{playlist.name}'. Le aggiungo al database.")
-            for track in truly_missing_tracks:
-                track_data = {
-                    'title': track.title,
-                    'artist': track.artist,
-                    'album': track.album,
-                    'source_playlist_title': playlist.name,
-                    'source_playlist_id': playlist.id 
-                }
-                add_missing_track(track_data)
+    if truly_missing_tracks:
+        # Inserite dopo la scrittura della playlist: source_playlist_id deve essere il ratingKey Plex
+        logging.info(f"Trovate {len(truly_missing_tracks)} tracce veramente mancanti per '{playlist.name}'. Le aggiungo al database.")
+        for start in range(0, len(truly_missing_tracks), SYNC_PIPELINE_CHUNK_SIZE):
+            add_missing_tracks([{
+                'title': track.title,
+                'artist': track.artist,
+                'album': track.album,
+                'source_playlist_title': playlist.name,
+                'source_playlist_id': playlist.id
+            } for track in truly_missing_tracks[start:start + SYNC_PIPELINE_CHUNK_SIZE]])
     
     return created_playlist
\ No newline at end of file
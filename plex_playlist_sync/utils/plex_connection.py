@@ -0,0 +1,109 @@
+"""
+Gestore centralizzato delle connessioni Plex.
+Restituisce istanze PlexServer riutilizzabili, una per (url, token, timeout), che condividono
+una requests.Session per server con pool di connessioni keep-alive dimensionato per la sync concorrente.
+Evita la richiesta di identità e la nuova Session a ogni PlexServer(...) costruito.
+Un 401 da Plex (token revocato o cambiato) scarta subito le istanze in cache per quel token.
+"""
+import os
+import time
+import logging
+import threading
+from typing import Dict, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from plexapi.server import PlexServer
+
+logger = logging.getLogger(__name__)
+
+# Connessioni HTTP mantenute aperte verso ogni server Plex
+PLEX_POOL_SIZE = int(os.getenv("PLEX_POOL_SIZE", "16"))
+# Ogni quanti secondi verificare che un'istanza in cache risponda ancora
+PLEX_HEALTH_CHECK_SECONDS = int(os.getenv("PLEX_HEALTH_CHECK_SECONDS", "60"))
+# Timeout della verifica di salute (richiesta leggera a /identity)
+PLEX_HEALTH_CHECK_TIMEOUT = 5
+
+_sessions: Dict[str, requests.Session] = {}
+_servers: Dict[Tuple[str, str, int], Tuple[PlexServer, float]] = {}
+_key_locks: Dict[Tuple[str, str, int], threading.Lock] = {}
+_registry_lock = threading.Lock()
+
+
+def _get_session(base_url: str) -> requests.Session:
+    """Session condivisa da tutti i token dello stesso server (il token viaggia negli header di ogni richiesta)."""
+    session = _sessions.get(base_url)
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=PLEX_POOL_SIZE, pool_maxsize=PLEX_POOL_SIZE)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers["Connection"] = "keep-alive"
+        session.hooks["response"].append(_evict_on_unauthorized(base_url))
+        _sessions[base_url] = session
+    return session
+
+
+def _evict_on_unauthorized(base_url: str):
+    """Hook di risposta: un 401 invalida le istanze in cache del token usato nella richiesta."""
+    def _hook(response, *args, **kwargs):
+        if response.status_code == 401:
+            token = response.request.headers.get("X-Plex-Token")
+            if token:
+                logger.warning(f"🔑 Plex ha rifiutato il token {token[:4]}... per {base_url}: connessione in cache scartata")
+                invalidate_plex_server(base_url, token)
+    return _hook
+
+
+def _is_healthy(server: PlexServer) -> bool:
+    try:
+        server.query("/identity", timeout=PLEX_HEALTH_CHECK_TIMEOUT)
+        return True
+    except Exception as e:
+        logger.warning(f"⚠️ Connessione Plex in cache non più valida, la ricreo: {e}")
+        return False
+
+
+def get_plex_server(plex_url: str, plex_token: str, timeout: int = 120) -> PlexServer:
+    """
+    Restituisce un PlexServer connesso per (url, token, timeout), riusando l'istanza in cache se ancora sana.
+    plexapi conserva `timeout` nel server e lo usa per ogni richiesta successiva, non solo per la
+    connessione: per questo fa parte della chiave (chiamanti con timeout diversi non si influenzano).
+    Solleva le stesse eccezioni di PlexServer(...) se il server non è raggiungibile.
+    """
+    base_url = (plex_url or "").rstrip("/")
+    key = (base_url, plex_token or "", timeout)
+    with _registry_lock:
+        key_lock = _key_locks.setdefault(key, threading.Lock())
+
+    # Lock per chiave: più thread che chiedono lo stesso server attendono una sola connessione
+    with key_lock:
+        cached = _servers.get(key)
+        if cached is not None:
+            server, checked_at = cached
+            if time.time() - checked_at < PLEX_HEALTH_CHECK_SECONDS:
+                return server
+            if _is_healthy(server):
+                _servers[key] = (server, time.time())
+                return server
+            _servers.pop(key, None)
+
+        with _registry_lock:
+            session = _get_session(base_url)
+        server = PlexServer(base_url, plex_token, session=session, timeout=timeout)
+        _servers[key] = (server, time.time())
+        logger.debug(f"🔌 Nuova connessione Plex per {base_url} (token {str(plex_token)[:4]}...)")
+        return server
+
+
+def invalidate_plex_server(plex_url: str, plex_token: str):
+    """Scarta le istanze in cache (qualsiasi timeout), es. dopo un cambio di token o un errore di autenticazione."""
+    prefix = ((plex_url or "").rstrip("/"), plex_token or "")
+    with _registry_lock:
+        for key in [key for key in list(_servers) if key[:2] == prefix]:
+            _servers.pop(key, None)
+
+
+def get_plex_connection_stats() -> dict:
+    """Istanze PlexServer in cache, Session per server e dimensione del pool (per /api/stats)."""
+    return {'servers': len(_servers), 'sessions': len(_sessions), 'pool_size': PLEX_POOL_SIZE}
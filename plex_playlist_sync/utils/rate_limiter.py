@@ -0,0 +1,224 @@
+"""
+Rate limiter token-bucket condivisi per processo, uno per servizio esterno (Spotify, Deezer, Plex).
+Tutti i thread che parlano con lo stesso servizio passano dallo stesso bucket,
+così la concorrenza non si traduce in raffiche che fanno scattare i limiti delle API.
+Quando un servizio risponde 429 (o 403 con Retry-After) il bucket viene sospeso per tutti i thread.
+"""
+import os
+import time
+import random
+import logging
+import threading
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+
+import requests
+import requests.adapters
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+# Richieste al secondo di default per servizio (sovrascrivibili con <SERVIZIO>_RATE_LIMIT / <SERVIZIO>_RATE_BURST)
+DEFAULT_RATES = {
+    'spotify': 5.0,
+    'deezer': 8.0,   # Limite pubblico Deezer: 50 richieste ogni 5 secondi
+    'plex': 20.0,
+}
+
+# Ritentativi sui 5xx transitori fatti dall'adapter della session (sovrascrivibili con <SERVIZIO>_SERVER_RETRIES).
+# Spotipy non monta il suo Retry quando riceve una session esterna; Deezer li ritenta già in DeezerClient.get()
+DEFAULT_SERVER_ERROR_RETRIES = {
+    'spotify': 3,
+}
+_SERVER_ERROR_STATUSES = (500, 502, 503, 504)
+
+
+class TokenBucket:
+    """
+    Bucket di `burst` gettoni ricaricato a `rate` gettoni al secondo.
+    acquire() blocca il thread chiamante finché non c'è un gettone disponibile.
+    Con rate <= 0 il limiter è disattivato (restano solo le pause chieste dal servizio).
+    """
+
+    def __init__(self, name: str, rate: float, burst: int):
+        self.name = name
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self._blocked_until = 0.0
+        self.total_waited = 0.0
+        self.throttled = 0
+
+    def _refill(self, now: float):
+        if now <= self._updated:
+            return  # Bucket sospeso da backoff(): la ricarica riparte alla fine della pausa
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, tokens: float = 1.0) -> float:
+        """Prende `tokens` gettoni, attendendo se necessario. Restituisce i secondi di attesa."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._blocked_until:
+                    wait = self._blocked_until - now
+                elif self.rate <= 0:
+                    return waited
+                else:
+                    self._refill(now)
+                    if self._tokens >= tokens:
+                        self._tokens -= tokens
+                        self.total_waited += waited
+                        return waited
+                    wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+    def backoff(self, seconds: float):
+        """Sospende il bucket per `seconds` (es. Retry-After): tutti i thread attendono, non solo il chiamante."""
+        with self._lock:
+            until = time.monotonic() + max(0.0, seconds)
+            if until > self._blocked_until:
+                self._blocked_until = until
+                self._tokens = 0.0
+                self._updated = until
+            self.throttled += 1
+        logger.warning(f"⏳ Rate limit '{self.name}': pausa di {seconds:.1f}s richiesta dal servizio")
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._refill(time.monotonic())
+            return {'rate': self.rate, 'burst': self.burst, 'tokens': round(self._tokens, 2),
+                    'total_waited': round(self.total_waited, 2), 'throttled': self.throttled,
+                    'blocked_for': round(max(0.0, self._blocked_until - time.monotonic()), 2)}
+
+
+_limiters: Dict[str, TokenBucket] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(name: str) -> TokenBucket:
+    """Ottieni il limiter globale (per processo) del servizio indicato, creandolo dalla configurazione env."""
+    limiter: Optional[TokenBucket] = _limiters.get(name)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(name)
+            if limiter is None:
+                prefix = name.upper()
+                rate = float(os.getenv(f"{prefix}_RATE_LIMIT", str(DEFAULT_RATES.get(name, 10.0))))
+                burst = int(os.getenv(f"{prefix}_RATE_BURST", str(max(1, int(rate)))))
+                limiter = TokenBucket(name, rate, burst)
+                _limiters[name] = limiter
+                logger.debug(f"Rate limiter '{name}': {rate} req/s, burst {burst}")
+    return limiter
+
+
+def get_rate_limiter_stats() -> Dict[str, dict]:
+    """Statistiche di tutti i limiter creati finora."""
+    return {name: limiter.stats() for name, limiter in list(_limiters.items())}
+
+
+def parse_retry_after(value) -> Optional[float]:
+    """Interpreta l'header Retry-After (secondi o data HTTP); None se assente o non valido."""
+    if value is None or value == "":
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(str(value)).timestamp() - time.time())
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+def _throttle_delay(response: requests.Response, attempt: int) -> Optional[float]:
+    """Secondi da attendere se la risposta segnala un rate limit, altrimenti None."""
+    retry_after = parse_retry_after(response.headers.get("Retry-After"))
+    if response.status_code == 429:
+        return retry_after if retry_after is not None else min(30.0, 2 ** attempt)
+    if response.status_code == 403 and retry_after is not None:
+        return retry_after
+    # Deezer segnala la quota superata con HTTP 200 e {"error": {"code": 4}}
+    if response.status_code == 200 and b'"code":4' in response.content[:200]:
+        try:
+            if (response.json().get("error") or {}).get("code") == 4:
+                return min(10.0, 2 ** attempt)
+        except ValueError:
+            return None
+    return None
+
+
+class RateLimitedSession(requests.Session):
+    """
+    Session che fa passare ogni richiesta dal limiter del servizio.
+    Se il servizio chiede di rallentare sospende il bucket (Retry-After o backoff esponenziale con jitter)
+    e ritenta fino a max_retries volte; restituisce l'ultima risposta ottenuta.
+    Con server_error_retries > 0 l'adapter ritenta anche i 5xx transitori con backoff (il Retry di spotipy).
+    Usabile anche come requests_session di spotipy, così tutte le chiamate sp.* sono coperte.
+    È condivisa per processo: close() non chiude il pool, altrimenti Spotify.__del__
+    di un client di breve durata lo chiuderebbe per tutti gli altri.
+    """
+
+    def __init__(self, service: str, max_retries: int = 3, pool_size: int = 16, server_error_retries: int = 0):
+        super().__init__()
+        self.service = service
+        self.limiter = get_rate_limiter(service)
+        self.max_retries = max_retries
+        retry = Retry(
+            total=server_error_retries,
+            connect=server_error_retries,
+            read=False,
+            status=server_error_retries,
+            backoff_factor=0.3,
+            status_forcelist=_SERVER_ERROR_STATUSES,
+            allowed_methods=frozenset(['GET', 'POST', 'PUT', 'DELETE']),
+            raise_on_status=False,  # Finiti i tentativi si restituisce l'ultima risposta, come per i 429
+        ) if server_error_retries > 0 else 0
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+
+    def request(self, method, url, *args, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire()
+            response = super().request(method, url, *args, **kwargs)
+            delay = _throttle_delay(response, attempt)
+            if delay is None or attempt == self.max_retries:
+                return response
+            self.limiter.backoff(delay + random.uniform(0, 0.25))
+        return response
+
+    def close(self):
+        pass
+
+
+_sessions: Dict[str, RateLimitedSession] = {}
+_sessions_lock = threading.Lock()
+
+
+def get_rate_limited_session(service: str) -> RateLimitedSession:
+    """Session condivisa (per processo) verso il servizio indicato."""
+    session = _sessions.get(service)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(service)
+            if session is None:
+                retries = int(os.getenv(f"{service.upper()}_SERVER_RETRIES",
+                                        str(DEFAULT_SERVER_ERROR_RETRIES.get(service, 0))))
+                session = RateLimitedSession(service, server_error_retries=retries)
+                _sessions[service] = session
+    return session
+
+
+def rate_limited_request(service: str, method: str, url: str, **kwargs) -> requests.Response:
+    """Richiesta HTTP tramite la session limitata del servizio (timeout di default 10s)."""
+    kwargs.setdefault("timeout", 10)
+    return get_rate_limited_session(service).request(method, url, **kwargs)
+
+
+def rate_limited_get(service: str, url: str, **kwargs) -> requests.Response:
+    return rate_limited_request(service, "GET", url, **kwargs)
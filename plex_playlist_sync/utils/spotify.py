@@ -2,6 +2,7 @@ import logging
 from typing import List
 import os
 import time
+import concurrent.futures
 
 import spotipy
 from spotipy.exceptions import SpotifyException
@@ -12,7 +13,26 @@ from plexapi.server import PlexServer
 import re
 
 from .helperClasses import Playlist, Track, UserInputs
-from .plex import update_or_create_plex_playlist
+from .plex import update_or_create_plex_playlist, is_playlist_unchanged, mark_playlist_synced
+from .rate_limiter import get_rate_limiter, get_rate_limited_session, parse_retry_after
+from .sync_engine import run_playlist_jobs, SYNCED, UNCHANGED, EMPTY, FAILED, CANCELLED
+
+# Limiter condiviso da tutti i thread che interrogano le API Spotify
+_spotify_limiter = get_rate_limiter('spotify')
+
+
+# Paginazione tracce: pagine da 100 (massimo API), scaricate in parallelo da un pool condiviso
+SP_PAGE_SIZE = 100
+SPOTIFY_PAGE_WORKERS = int(os.getenv("SPOTIFY_PAGE_WORKERS", "4"))
+SP_TRACK_FIELDS = "items(track(name,artists(name),album(name),external_urls(spotify)))"
+_sp_page_executor = concurrent.futures.ThreadPoolExecutor(max_workers=SPOTIFY_PAGE_WORKERS,
+                                                          thread_name_prefix="spotify-pages")
+
+
+def _spotify_retry_after(error: SpotifyException, attempt: int) -> float:
+    """Attesa richiesta da Spotify (header Retry-After) o, in mancanza, backoff esponenziale."""
+    retry_after = parse_retry_after((getattr(error, 'headers', None) or {}).get('Retry-After'))
+    return retry_after if retry_after is not None else 2 ** attempt
  
 
 def get_spotify_credentials():
@@ -39,7 +59,8 @@ def get_spotify_credentials():
                 client_id=client_id,
                 client_secret=client_secret,
                 cache_handler=memory_cache  # Use memory cache instead
-            )
+            ),
+            requests_session=get_rate_limited_session('spotify')  # Limiter condiviso + Retry-After su ogni chiamata
         )
         
         logging.info("✅ Credenziali Spotify configurate correttamente")
@@ -73,6 +94,7 @@ def _get_sp_user_playlists(
                     name=playlist["name"] + suffix,
                     description=playlist.get("description", ""),
                     poster=playlist.get("images", [{}])[0].get("url", ""),
+                    snapshot=playlist.get("snapshot_id") or "",
                 )
             )
     except Exception as e:
@@ -126,6 +148,7 @@ def _get_sp_playlists_by_ids(
                     name=pl["name"] + suffix,
                     description=pl.get("description", ""),
                     poster=pl.get("images", [{}])[0].get("url", ""),
+                    snapshot=pl.get("snapshot_id") or "",
                 )
             )
         except Exception as e:
@@ -176,38 +199,74 @@ def get_spotify_public_playlist(sp: spotipy.Spotify, url_or_id: str) -> dict:
         return None
 
 
+def _parse_sp_track_items(items) -> List[tuple]:
+    """Riduce gli item di una pagina a tuple compatte (titolo, artista, album, url)."""
+    rows = []
+    for item in items:
+        track = item.get("track")
+        # Salta tracce rimosse, episodi podcast e file locali senza artista
+        if not track or not track.get("artists"):
+            continue
+        rows.append((
+            track.get("name") or "",
+            track["artists"][0].get("name") or "",
+            (track.get("album") or {}).get("name") or "",
+            (track.get("external_urls") or {}).get("spotify", ""),
+        ))
+    return rows
+
+
 def _get_sp_tracks_from_playlist(
     sp: spotipy.Spotify, playlist: Playlist
 ) -> List[Track]:
-    """Return list of tracks with metadata."""
+    """
+    Return list of tracks with metadata.
+    La prima pagina fornisce `total`; le pagine restanti vengono scaricate in parallelo
+    (pool condiviso, ordine preservato) chiedendo a Spotify solo i campi usati.
+    """
 
-    def extract_sp_track_metadata(track) -> Track:
-        title = track["track"]["name"]
-        artist = track["track"]["artists"][0]["name"]
-        album = track["track"]["album"]["name"]
-        url = track["track"]["external_urls"].get("spotify", "")
-        return Track(title, artist, album, url)
+    def fetch_page(offset: int) -> List[tuple]:
+        page = sp.playlist_items(playlist.id, fields=SP_TRACK_FIELDS, limit=SP_PAGE_SIZE, offset=offset)
+        return _parse_sp_track_items(page.get("items", []))
 
-    sp_playlist_tracks = sp.playlist_items(playlist.id)
+    first_page = sp.playlist_items(playlist.id, fields=f"total,{SP_TRACK_FIELDS}", limit=SP_PAGE_SIZE, offset=0)
+    rows = _parse_sp_track_items(first_page.get("items", []))
 
-    tracks = list(
-        map(
-            extract_sp_track_metadata,
-            [i for i in sp_playlist_tracks["items"] if i.get("track")],
-        )
-    )
-
-    while sp_playlist_tracks["next"]:
-        sp_playlist_tracks = sp.next(sp_playlist_tracks)
-        tracks.extend(
-            list(
-                map(
-                    extract_sp_track_metadata,
-                    [i for i in sp_playlist_tracks["items"] if i.get("track")],
-                )
-            )
-        )
-    return tracks
+    offsets = range(SP_PAGE_SIZE, first_page.get("total") or 0, SP_PAGE_SIZE)
+    if offsets:
+        logging.debug(f"Spotify '{playlist.name}': {len(offsets) + 1} pagine, {len(offsets)} scaricate in parallelo")
+        for page_rows in _sp_page_executor.map(fetch_page, offsets):
+            rows.extend(page_rows)
+
+    return [Track(*row) for row in rows]
+
+
+def _sync_spotify_playlist(sp: spotipy.Spotify, plex: PlexServer, playlist: Playlist, userInputs: UserInputs) -> str:
+    """Sincronizza una singola playlist Spotify e restituisce l'esito per il motore di sync."""
+    if is_playlist_unchanged(plex, userInputs, 'spotify', playlist):
+        return UNCHANGED
+    source_id = playlist.id  # update_or_create_plex_playlist lo sostituisce con il ratingKey Plex
+
+    tracks = _get_sp_tracks_from_playlist(sp, playlist)
+    if not tracks:
+        logging.warning(f"⚠️ No tracks found in playlist '{playlist.name}'")
+        return EMPTY
+    if update_or_create_plex_playlist(plex, playlist, tracks, userInputs):
+        mark_playlist_synced(userInputs, 'spotify', source_id, playlist)
+        logging.info(f"✅ Synced playlist '{playlist.name}' with {len(tracks)} tracks")
+        return SYNCED
+    # Nessuna playlist scritta (stop o brani insufficienti): lo snapshot non va registrato
+    from ..sync_logic import check_stop_flag_direct
+    return CANCELLED if check_stop_flag_direct() else EMPTY
+
+
+def _sync_spotify_playlist_by_id(sp: spotipy.Spotify, plex: PlexServer, playlist_id: str, suffix: str,
+                                 userInputs: UserInputs) -> str:
+    """Come _sync_spotify_playlist, ma recupera anche i metadati nel worker."""
+    playlists = _get_sp_playlists_by_ids(sp, [playlist_id], suffix)
+    if not playlists:
+        return FAILED
+    return _sync_spotify_playlist(sp, plex, playlists[0], userInputs)
 
 
 def spotify_playlist_sync_with_discovery(sp: spotipy.Spotify, plex: PlexServer, userInputs: UserInputs) -> None:
@@ -234,21 +293,9 @@ def spotify_playlist_sync_with_discovery(sp: spotipy.Spotify, plex: PlexServer,
             logging.info(f"   - {playlist.name} (ID: {playlist.id})")
         
         # Process each discovered playlist
-        for playlist in discovered_playlists:
-            try:
-                logging.info(f"🎵 Processing discovered playlist: {playlist.name}")
-                
-                # Get tracks for this playlist  
-                tracks = _get_sp_tracks_from_playlist(sp, playlist)
-                if tracks:
-                    update_or_create_plex_playlist(plex, playlist, tracks, userInputs)
-                    logging.info(f"✅ Synced playlist '{playlist.name}' with {len(tracks)} tracks")
-                else:
-                    logging.warning(f"⚠️ No tracks found in playlist '{playlist.name}'")
-                    
-            except Exception as playlist_error:
-                logging.error(f"❌ Error processing playlist '{playlist.name}': {playlist_error}")
-                continue
+        jobs = [(playlist.name, lambda playlist=playlist: _sync_spotify_playlist(sp, plex, playlist, userInputs))
+                for playlist in discovered_playlists]
+        run_playlist_jobs("Spotify auto-discovery sync", jobs, userInputs.sync_workers)
         
         logging.info(f"🎉 Auto-discovery completed: processed {len(discovered_playlists)} Spotify playlists")
         
@@ -266,20 +313,16 @@ def spotify_playlist_sync(
 
     suffix = " - Spotify" if userInputs.append_service_suffix else ""
     if userInputs.spotify_playlist_ids:
-        ids = userInputs.spotify_playlist_ids.split(",")
-        playlists = _get_sp_playlists_by_ids(sp, ids, suffix)
+        # Anche i metadati di ogni playlist vengono letti dai worker, in parallelo
+        ids = [pid.strip() for pid in userInputs.spotify_playlist_ids.split(",") if pid.strip()]
+        jobs = [(pid, lambda pid=pid: _sync_spotify_playlist_by_id(sp, plex, pid, suffix, userInputs))
+                for pid in ids]
     else:
         playlists = _get_sp_user_playlists(sp, userInputs.spotify_user_id, userInputs, suffix)
-    if playlists:
-        for playlist in playlists:
-            # Check if stop was requested
-            from ..sync_logic import check_stop_flag_direct
-            if check_stop_flag_direct():
-                logging.info("🛑 Stop requested during Spotify playlist sync")
-                return
-            
-            tracks = _get_sp_tracks_from_playlist(sp, playlist)
-            update_or_create_plex_playlist(plex, playlist, tracks, userInputs)
+        jobs = [(playlist.name, lambda playlist=playlist: _sync_spotify_playlist(sp, plex, playlist, userInputs))
+                for playlist in playlists]
+    if jobs:
+        run_playlist_jobs("Spotify sync", jobs, userInputs.sync_workers)
     else:
         logging.error("No spotify playlists found for given user")
 
@@ -408,9 +451,9 @@ def get_spotify_featured_playlists(sp: spotipy.Spotify, country: str = 'IT', lim
                 return []
             elif e.http_status == 429:  # Rate limit
                 if attempt < max_retries:
-                    wait_time = 2 ** attempt
+                    wait_time = _spotify_retry_after(e, attempt)
                     logging.warning(f"⏳ Rate limit raggiunto, attendo {wait_time}s prima del tentativo {attempt + 2}/{max_retries + 1}")
-                    time.sleep(wait_time)
+                    _spotify_limiter.backoff(wait_time)
                     continue
                 else:
                     logging.error(f"❌ Rate limit persistente dopo {max_retries} tentativi")
@@ -477,9 +520,9 @@ def get_spotify_category_playlists(sp: spotipy.Spotify, category_id: str, countr
                 return []
             elif e.http_status == 429:  # Rate limit
                 if attempt < max_retries:
-                    wait_time = 2 ** attempt
+                    wait_time = _spotify_retry_after(e, attempt)
                     logging.warning(f"⏳ Rate limit per categoria '{category_id}', attendo {wait_time}s")
-                    time.sleep(wait_time)
+                    _spotify_limiter.backoff(wait_time)
                     continue
                 else:
                     logging.error(f"❌ Rate limit persistente per categoria '{category_id}'")
@@ -764,9 +807,6 @@ def get_all_playlist_tracks_with_fallback(client, sp, url: str, playlist_id: str
                         
                         offset += 100
                         
-                        # Rispetta rate limits
-                        time.sleep(0.1)
-                        
                     except Exception as api_error:
                         logging.warning(f"⚠️ Errore paginazione API Spotify: {api_error}")
                         break
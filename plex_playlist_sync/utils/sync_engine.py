@@ -0,0 +1,64 @@
+"""
+Motore di sincronizzazione concorrente delle playlist.
+Esegue i job (una playlist ciascuno) su un pool di worker limitato, interrompe
+in modo cooperativo al flag di stop e riassume i risultati in un'unica riga di log.
+"""
+import time
+import logging
+import concurrent.futures
+from collections import Counter
+from typing import Callable, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Esiti possibili di un job
+SYNCED = 'synced'        # Playlist Plex creata/aggiornata
+UNCHANGED = 'unchanged'  # Sorgente invariata, sync saltata
+EMPTY = 'empty'          # Nessuna traccia o brani insufficienti
+FAILED = 'failed'        # Errore durante il job
+CANCELLED = 'cancelled'  # Non eseguito per richiesta di stop
+
+
+def run_playlist_jobs(label: str, jobs: List[Tuple[str, Callable[[], str]]], workers: int = 1) -> Dict[str, int]:
+    """
+    Esegue i job [(nome playlist, funzione senza argomenti che restituisce un esito)].
+    Con workers <= 1 i job girano in sequenza nel thread chiamante, come prima.
+    Restituisce il conteggio degli esiti.
+    """
+    from ..sync_logic import check_stop_flag_direct
+
+    start_time = time.time()
+    results: Counter = Counter()
+    if not jobs:
+        return dict(results)
+
+    def _run(name: str, job: Callable[[], str]) -> str:
+        # Cancellazione cooperativa: i job in coda non partono dopo una richiesta di stop
+        if check_stop_flag_direct():
+            return CANCELLED
+        try:
+            return job() or SYNCED
+        except Exception as e:
+            logger.error(f"❌ Error syncing playlist '{name}': {e}")
+            return FAILED
+
+    workers = max(1, min(workers, len(jobs)))
+    if workers == 1:
+        for name, job in jobs:
+            results[_run(name, job)] += 1
+    else:
+        logger.info(f"⚡ {label}: syncing {len(jobs)} playlists with {workers} workers")
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="playlist-sync") as executor:
+            futures = {executor.submit(_run, name, job): name for name, job in jobs}
+            stop_logged = False
+            for future in concurrent.futures.as_completed(futures):
+                results[CANCELLED if future.cancelled() else future.result()] += 1
+                if not stop_logged and check_stop_flag_direct():
+                    stop_logged = True
+                    logger.info(f"🛑 Stop requested during {label}: cancelling queued playlists")
+                    for pending in futures:
+                        pending.cancel()
+
+    summary = ", ".join(f"{count} {status}" for status, count in results.most_common())
+    logger.info(f"📊 {label}: {len(jobs)} playlists in {time.time() - start_time:.1f}s ({summary})")
+    return dict(results)
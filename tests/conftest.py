@@ -0,0 +1,29 @@
+"""
+Fixture condivise dei test: ogni test che tocca il database lavora su un file SQLite temporaneo,
+con scrittore unico, pool di lettura e indice candidati creati da zero.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from plex_playlist_sync.utils import candidate_index, database
+
+
+@pytest.fixture
+def temp_db(tmp_path, monkeypatch):
+    """Database inizializzato in tmp_path; restituisce il percorso del file."""
+    db_path = str(tmp_path / "sync_database.db")
+    monkeypatch.setattr(database, "DB_PATH", db_path)
+    monkeypatch.setattr(database, "_db_writer", None)
+    monkeypatch.setattr(database, "_db_read_pool", None)
+    monkeypatch.setattr(database, "_library_fts_available", None)
+    monkeypatch.setattr(candidate_index, "_candidate_index", None)
+    database.initialize_db()
+    yield db_path
+    if database._db_writer is not None:
+        database._db_writer.stop()
+    if database._db_read_pool is not None:
+        database._db_read_pool.close_all()
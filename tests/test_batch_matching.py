@@ -0,0 +1,38 @@
+"""Matching batch di intere liste di tracce contro l'indice della libreria."""
+from plex_playlist_sync.utils.database import (
+    bulk_add_tracks_to_index, check_track_in_index_smart, match_tracks_batch,
+)
+
+LIBRARY = [
+    ('bohemian rhapsody', 'queen', 'a night at the opera', None, None, 1, None),
+    ('yesterday', 'the beatles', 'help', None, None, 2, None),
+    ('smells like teen spirit', 'nirvana', 'nevermind', None, None, 3, None),
+]
+
+
+def test_results_keep_input_order_and_duplicates(temp_db):
+    bulk_add_tracks_to_index(LIBRARY)
+    pairs = [("Yesterday", "The Beatles"), ("Unknown Song", "Nobody"), ("Yesterday", "The Beatles")]
+    results = match_tracks_batch(pairs)
+    assert [r['matched'] for r in results] == [True, False, True]
+    assert results[0]['method'] == 'exact'
+    assert results[0] == results[2]
+
+
+def test_fuzzy_matches_agree_with_single_track_check(temp_db):
+    bulk_add_tracks_to_index(LIBRARY)
+    pairs = [("Bohemian Rhapsody - Remastered 2011", "Queen"), ("Smells Like Teen Spirit", "Nirvana"),
+             ("Wonderwall", "Oasis")]
+    results = match_tracks_batch(pairs, mode='smart')
+    assert [r['matched'] for r in results] == [check_track_in_index_smart(t, a) for t, a in pairs]
+    assert results[1]['matched'] and not results[2]['matched']
+
+
+def test_exact_mode_skips_fuzzy_matching(temp_db):
+    bulk_add_tracks_to_index(LIBRARY)
+    results = match_tracks_batch([("Bohemian Rhapsody - Remastered 2011", "Queen")], mode='exact')
+    assert results[0]['matched'] is False
+
+
+def test_empty_input(temp_db):
+    assert match_tracks_batch([]) == []
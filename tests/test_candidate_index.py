@@ -0,0 +1,56 @@
+"""Richiamo dell'indice candidati n-gram dopo scritture incrementali e cancellazioni."""
+from plex_playlist_sync.utils.database import (
+    bulk_add_tracks_to_index, delete_tracks_by_rating_keys, flush_db_writes, get_candidate_index,
+)
+
+
+def _row(title, artist, rating_key, album='album'):
+    return (title, artist, album, None, None, rating_key, None)
+
+
+def test_candidates_include_rows_added_after_build(temp_db):
+    bulk_add_tracks_to_index([_row('bohemian rhapsody', 'queen', 1), _row('yesterday', 'the beatles', 2)])
+    index = get_candidate_index()
+    index.build()
+    assert index.is_built()
+
+    bulk_add_tracks_to_index([_row('smells like teen spirit', 'nirvana', 3)])
+
+    assert ('smells like teen spirit', 'nirvana') in index.candidates('smells like teen spirit', 'nirvana')
+    assert index.candidates('bohemian rhapsody', 'queen')[0] == ('bohemian rhapsody', 'queen')
+
+
+def test_add_rows_patches_a_built_index_without_reload(temp_db):
+    index = get_candidate_index()
+    bulk_add_tracks_to_index([_row('yesterday', 'the beatles', 1)])
+    index.build()
+
+    index.add_rows([('hotel california', 'eagles')])
+
+    assert index.candidates('hotel california', 'eagles')[0] == ('hotel california', 'eagles')
+    assert index.stats()['pairs'] == 2
+
+
+def test_deleted_rating_keys_are_no_longer_candidates(temp_db):
+    bulk_add_tracks_to_index([_row('wonderwall', 'oasis', 1), _row('champagne supernova', 'oasis', 2)])
+    index = get_candidate_index()
+    index.build()
+
+    assert delete_tracks_by_rating_keys([1]) == 1
+
+    assert ('wonderwall', 'oasis') not in index.candidates('wonderwall', 'oasis')
+    assert ('champagne supernova', 'oasis') in index.candidates('champagne supernova', 'oasis')
+
+
+def test_changed_metadata_replaces_stale_candidate(temp_db):
+    bulk_add_tracks_to_index([_row('old title', 'artist', 7)])
+    index = get_candidate_index()
+    index.build()
+
+    bulk_add_tracks_to_index([_row('new title', 'artist', 7)])
+    flush_db_writes()
+
+    assert not index.is_built()  # invalidato: supporta solo aggiunte
+    candidates = index.candidates('old title', 'artist')
+    assert ('old title', 'artist') not in candidates
+    assert ('new title', 'artist') in candidates
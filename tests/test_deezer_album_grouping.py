@@ -0,0 +1,71 @@
+"""Raggruppamento per album delle tracce mancanti prima delle ricerche Deezer."""
+import time
+
+import pytest
+
+from plex_playlist_sync.utils.downloader import DeezerLinkFinder, _normalize_group_key
+
+
+@pytest.fixture
+def searches(monkeypatch):
+    """Sostituisce le ricerche Deezer: album e tracce trovati secondo le tabelle del test."""
+    calls = {'album': [], 'track': [], 'albums': {}, 'tracks': {}, 'delay': 0}
+
+    def _album(artist, album):
+        calls['album'].append((artist, album))
+        return calls['albums'].get(album)
+
+    def _track(track_info):
+        calls['track'].append(track_info['title'])
+        time.sleep(calls['delay'])
+        return calls['tracks'].get(track_info['title'])
+
+    monkeypatch.setattr(DeezerLinkFinder, "find_album_link", staticmethod(_album))
+    monkeypatch.setattr(DeezerLinkFinder, "find_track_link", staticmethod(_track))
+    return calls
+
+
+@pytest.mark.parametrize("a, b", [
+    ("Nevermind (Deluxe Edition)", "nevermind"),
+    ("Beyoncé", "BEYONCE"),
+    ("Abbey Road [Remastered]", "abbey road"),
+    ("AC/DC", "ac dc"),
+])
+def test_group_key_normalization(a, b):
+    assert _normalize_group_key(a) == _normalize_group_key(b)
+
+
+def test_album_group_uses_one_album_search(searches):
+    searches['albums']["Nevermind"] = "https://www.deezer.com/album/1"
+    tracks = [(1, "Smells Like Teen Spirit", "Nirvana", "Nevermind"),
+              (2, "Come As You Are", "nirvana", "Nevermind (Deluxe Edition)"),
+              (3, "Lithium", "NIRVANA", "NEVERMIND")]
+    links = DeezerLinkFinder.find_links_by_album(tracks, max_workers=1)
+    assert {link: sorted(ids) for link, ids in links.items()} == {"https://www.deezer.com/album/1": [1, 2, 3]}
+    assert len(searches['album']) == 1
+    assert searches['track'] == []
+
+
+def test_album_not_found_falls_back_to_each_track(searches):
+    searches['tracks'].update({"Song A": "https://www.deezer.com/album/10", "Song B": "https://www.deezer.com/album/11"})
+    tracks = [(1, "Song A", "Artist", "Compilation"), (2, "Song B", "Artist", "Compilation"),
+              (3, "Song C", "Artist", "Compilation")]
+    links = DeezerLinkFinder.find_links_by_album(tracks, max_workers=1)
+    assert links == {"https://www.deezer.com/album/10": [1], "https://www.deezer.com/album/11": [2]}
+    assert sorted(searches['track']) == ["Song A", "Song B", "Song C"]
+
+
+def test_single_tracks_and_tracks_without_album_skip_the_album_search(searches):
+    searches['tracks'].update({"Alone": "https://www.deezer.com/album/20", "No Album": "https://www.deezer.com/album/21"})
+    tracks = [(1, "Alone", "Artist", "Single"), (2, "No Album", "Artist", ""), (3, "No Album 2", "Artist", None)]
+    links = DeezerLinkFinder.find_links_by_album(tracks, max_workers=2)
+    assert links == {"https://www.deezer.com/album/20": [1], "https://www.deezer.com/album/21": [2]}
+    assert searches['album'] == []
+
+
+def test_stop_request_cancels_remaining_groups(searches):
+    searches['delay'] = 0.05
+    tracks = [(i, f"Song {i}", f"Artist {i}", f"Album {i}") for i in range(20)]
+    links = DeezerLinkFinder.find_links_by_album(tracks, max_workers=1, should_stop=lambda: True)
+    assert links == {}
+    assert len(searches['track']) < len(tracks)
@@ -0,0 +1,82 @@
+"""Cache persistente delle ricerche Deezer: hit, negativi conclusivi e scadenza."""
+import pytest
+
+from plex_playlist_sync.utils import downloader
+from plex_playlist_sync.utils.database import purge_deezer_search_cache
+from plex_playlist_sync.utils.downloader import DeezerLinkFinder, _cached_search, _search_cache_key
+
+
+class _Search:
+    """Ricerca finta che restituisce gli esiti indicati, uno per chiamata."""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.outcomes.pop(0)
+
+
+def test_found_result_is_served_from_cache(temp_db):
+    search = _Search(("https://www.deezer.com/album/1", True))
+    assert _cached_search('track_link', 'k', search) == "https://www.deezer.com/album/1"
+    assert _cached_search('track_link', 'k', search) == "https://www.deezer.com/album/1"
+    assert search.calls == 1
+
+
+def test_conclusive_not_found_is_cached(temp_db):
+    search = _Search((None, True))
+    assert _cached_search('track_link', 'k', search) is None
+    assert _cached_search('track_link', 'k', search) is None
+    assert search.calls == 1
+
+
+def test_inconclusive_miss_is_retried(temp_db):
+    search = _Search((None, False), ("https://www.deezer.com/album/2", True))
+    assert _cached_search('track_link', 'k', search) is None
+    assert _cached_search('track_link', 'k', search) == "https://www.deezer.com/album/2"
+    assert search.calls == 2
+
+
+def test_kinds_do_not_share_entries(temp_db):
+    _cached_search('track_link', 'k', _Search(("track", True)))
+    assert _cached_search('album_link', 'k', _Search(("album", True))) == "album"
+
+
+def test_negative_caching_is_disabled_with_zero_ttl(temp_db, monkeypatch):
+    monkeypatch.setattr(downloader, "DEEZER_CACHE_NEGATIVE_TTL_HOURS", 0)
+    search = _Search((None, True), ("https://www.deezer.com/album/3", True))
+    _cached_search('track_link', 'k', search)
+    assert _cached_search('track_link', 'k', search) == "https://www.deezer.com/album/3"
+
+
+def test_purge_negative_keeps_found_entries(temp_db):
+    found, missing = _Search(("link", True)), _Search((None, True), (None, True))
+    _cached_search('track_link', 'found', found)
+    _cached_search('track_link', 'missing', missing)
+    assert purge_deezer_search_cache('negative') == 1
+    _cached_search('track_link', 'found', found)
+    _cached_search('track_link', 'missing', missing)
+    assert (found.calls, missing.calls) == (1, 2)
+
+
+@pytest.mark.parametrize("a, b", [
+    (("Bohemian  Rhapsody", "QUEEN"), ("bohemian rhapsody", " queen ")),
+    (("Straße", "Rammstein"), ("STRASSE", "rammstein")),
+])
+def test_cache_key_ignores_case_and_whitespace(a, b):
+    assert _search_cache_key(*a) == _search_cache_key(*b)
+
+
+def test_track_link_lookup_goes_through_the_cache(temp_db, monkeypatch):
+    searches = []
+
+    def _fake_search(title, artist):
+        searches.append((title, artist))
+        return "https://www.deezer.com/album/4", True
+
+    monkeypatch.setattr(DeezerLinkFinder, "_search_track_link", staticmethod(_fake_search))
+    for title in ("Song", "  song "):
+        assert DeezerLinkFinder.find_track_link({'title': title, 'artist': "Artist"}) == "https://www.deezer.com/album/4"
+    assert searches == [("Song", "Artist")]
@@ -0,0 +1,109 @@
+"""Coda persistente dei download: accodamento, claim atomico, scadenza del lease e ritentativi."""
+import pytest
+
+from plex_playlist_sync.utils import download_queue
+from plex_playlist_sync.utils.database import get_db_read_connection, writer_connection
+from plex_playlist_sync.utils.download_queue import (
+    DEAD, DONE, FAILED, RUNNING, claim_jobs, complete_job, enqueue_download, fail_job, get_download_queue_stats,
+)
+
+LINK = "https://www.deezer.com/album/302127"
+
+
+@pytest.fixture
+def queue(temp_db, monkeypatch):
+    # Nessun worker reale: i test reclamano i job a mano
+    monkeypatch.setattr(download_queue, "start_download_workers", lambda count=None: 0)
+    monkeypatch.setattr(download_queue, "DOWNLOAD_MAX_ATTEMPTS", 2)
+    return temp_db
+
+
+def _job(job_id):
+    with get_db_read_connection() as con:
+        return dict(con.execute("SELECT * FROM download_jobs WHERE id = ?", (job_id,)).fetchone())
+
+
+def _expire_lease(job_id):
+    with writer_connection() as con:
+        con.execute("UPDATE download_jobs SET lease_expires = 0 WHERE id = ?", (job_id,))
+
+
+def test_enqueue_merges_track_ids_into_the_active_job(queue):
+    job_id = enqueue_download(LINK, [3, 1])
+    assert enqueue_download(LINK, [2, 3]) == job_id
+    assert _job(job_id)['track_ids'] == '[1, 2, 3]'
+
+
+def test_claim_is_exclusive(queue):
+    job_id = enqueue_download(LINK, [1])
+    jobs = claim_jobs("worker-a", limit=5)
+    assert [job['id'] for job in jobs] == [job_id]
+    assert jobs[0]['attempts'] == 1
+    assert claim_jobs("worker-b", limit=5) == []
+    assert _job(job_id)['state'] == RUNNING
+    assert _job(job_id)['lease_owner'] == "worker-a"
+
+
+def test_claim_respects_limit_and_order(queue):
+    ids = [enqueue_download(f"{LINK}{n}", [n]) for n in range(3)]
+    assert [job['id'] for job in claim_jobs("worker", limit=2)] == ids[:2]
+    assert [job['id'] for job in claim_jobs("worker", limit=2)] == ids[2:]
+
+
+def test_expired_lease_is_reclaimed_by_another_worker(queue):
+    job_id = enqueue_download(LINK, [1])
+    claim_jobs("dead-worker")
+    _expire_lease(job_id)
+
+    jobs = claim_jobs("live-worker")
+    assert [job['id'] for job in jobs] == [job_id]
+    assert jobs[0]['attempts'] == 2
+    # Il vecchio proprietario non può più chiudere il job
+    assert complete_job(job_id, "dead-worker") == [1]
+    assert _job(job_id)['state'] == RUNNING
+
+
+def test_expired_lease_without_attempts_left_goes_dead(queue):
+    job_id = enqueue_download(LINK, [1])
+    claim_jobs("worker")
+    _expire_lease(job_id)
+    claim_jobs("worker")
+    _expire_lease(job_id)
+
+    assert claim_jobs("worker") == []
+    assert _job(job_id)['state'] == DEAD
+
+
+def test_failure_is_retried_after_backoff_then_dead(queue, monkeypatch):
+    monkeypatch.setattr(download_queue, "DOWNLOAD_RETRY_BACKOFF_SECONDS", 0)
+    job_id = enqueue_download(LINK, [1])
+
+    job = claim_jobs("worker")[0]
+    assert fail_job(job_id, "worker", "timeout", job['attempts'], job['max_attempts']) == FAILED
+
+    job = claim_jobs("worker")[0]
+    assert job['attempts'] == 2
+    assert fail_job(job_id, "worker", "timeout", job['attempts'], job['max_attempts']) == DEAD
+    assert claim_jobs("worker") == []
+    assert _job(job_id)['last_error'] == "timeout"
+
+
+def test_failed_job_waits_for_its_backoff(queue, monkeypatch):
+    monkeypatch.setattr(download_queue, "DOWNLOAD_RETRY_BACKOFF_SECONDS", 3600)
+    job_id = enqueue_download(LINK, [1])
+    job = claim_jobs("worker")[0]
+    fail_job(job_id, "worker", "timeout", job['attempts'], job['max_attempts'])
+    assert claim_jobs("worker") == []
+
+
+def test_stats_count_states_and_recent_throughput(queue):
+    done_id = enqueue_download(LINK, [1])
+    enqueue_download(f"{LINK}9", [2])
+    claim_jobs("worker", limit=1)
+    assert complete_job(done_id, "worker") == [1]
+
+    stats = get_download_queue_stats()
+    assert stats['counts'][DONE] == 1
+    assert stats['depth'] == 1
+    assert stats['throughput']['done_last_hour'] == 1
+    assert stats['throughput']['per_minute'] == pytest.approx(0.2)
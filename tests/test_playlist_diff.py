@@ -0,0 +1,134 @@
+"""Aggiornamento minimo delle playlist Plex: sottosequenza stabile e scritture tramite l'API Playlist."""
+import itertools
+import random
+
+import pytest
+
+from plex_playlist_sync.utils.plex import _stable_positions, _sync_playlist_items
+
+
+def _is_increasing(values):
+    return all(a < b for a, b in zip(values, values[1:]))
+
+
+def _longest_increasing_length(sequence):
+    return max((len(c) for r in range(len(sequence) + 1)
+                for c in itertools.combinations(sequence, r) if _is_increasing(c)), default=0)
+
+
+@pytest.mark.parametrize("sequence, expected", [
+    ([], set()),
+    ([4], {0}),
+    ([0, 1, 2, 3], {0, 1, 2, 3}),
+    ([3, 2, 1, 0], {3}),
+    ([1, 0, 2, 3], {1, 2, 3}),
+    ([0, 5, 1, 2, 3, 4], {0, 2, 3, 4, 5}),
+])
+def test_stable_positions_examples(sequence, expected):
+    assert _stable_positions(sequence) == expected
+
+
+def test_stable_positions_is_a_longest_increasing_subsequence():
+    rng = random.Random(7)
+    for _ in range(200):
+        sequence = rng.sample(range(12), rng.randint(0, 9))
+        stable = sorted(_stable_positions(sequence))
+        assert _is_increasing([sequence[i] for i in stable])
+        assert len(stable) == _longest_increasing_length(sequence)
+
+
+class _Item:
+    def __init__(self, rating_key, playlist_item_id=None):
+        self.ratingKey = rating_key
+        self.playlistItemID = playlist_item_id
+        self.title = f"track {rating_key}"
+
+
+class _FakePlaylist:
+    """Riproduce plexapi.Playlist: voci risolte per ratingKey sulla prima copia della lista in cache."""
+
+    title = "test"
+
+    def __init__(self, rating_keys):
+        self._ids = itertools.count(1)
+        self.entries = [_Item(key, next(self._ids)) for key in rating_keys]
+        self._items = None
+        self.calls = []
+
+    def items(self):
+        if self._items is None:
+            self._items = [_Item(e.ratingKey, e.playlistItemID) for e in self.entries]
+        return self._items
+
+    def reload(self):
+        self._items = None
+        return self
+
+    def _item_id(self, item):
+        for cached in self.items():
+            if cached.ratingKey == item.ratingKey:
+                return cached.playlistItemID
+        raise LookupError(item.ratingKey)
+
+    def _position(self, playlist_item_id):
+        return [e.playlistItemID for e in self.entries].index(playlist_item_id)
+
+    def removeItems(self, items):
+        self.calls.append('removeItems')
+        for item in items:
+            del self.entries[self._position(self._item_id(item))]
+
+    def addItems(self, items):
+        self.calls.append('addItems')
+        self.entries += [_Item(item.ratingKey, next(self._ids)) for item in items]
+
+    def moveItem(self, item, after=None):
+        self.calls.append('moveItem')
+        entry = self.entries.pop(self._position(self._item_id(item)))
+        index = self._position(self._item_id(after)) + 1 if after is not None else 0
+        self.entries.insert(index, entry)
+
+    @property
+    def rating_keys(self):
+        return [e.ratingKey for e in self.entries]
+
+
+def _tracks(rating_keys):
+    return [_Item(key) for key in rating_keys]
+
+
+def test_identical_playlist_is_not_touched():
+    playlist = _FakePlaylist([1, 2, 3])
+    assert _sync_playlist_items(playlist, _tracks([1, 2, 3])) == {'added': 0, 'removed': 0, 'moved': 0}
+    assert playlist.calls == []
+
+
+def test_only_out_of_order_items_are_moved():
+    playlist = _FakePlaylist([1, 2, 3, 4, 5])
+    stats = _sync_playlist_items(playlist, _tracks([1, 3, 4, 5, 2]))
+    assert playlist.rating_keys == [1, 3, 4, 5, 2]
+    assert stats == {'added': 0, 'removed': 0, 'moved': 1}
+
+
+def test_surplus_is_removed_in_one_call_and_missing_appended():
+    playlist = _FakePlaylist([1, 9, 2, 8, 3])
+    stats = _sync_playlist_items(playlist, _tracks([1, 2, 3, 4]))
+    assert playlist.rating_keys == [1, 2, 3, 4]
+    assert stats == {'added': 1, 'removed': 2, 'moved': 0}
+    assert playlist.calls == ['removeItems', 'addItems']
+
+
+def test_random_edits_reach_the_target_order():
+    rng = random.Random(3)
+    for _ in range(300):
+        with_duplicates = rng.random() < 0.5
+        pool = range(1, 6) if with_duplicates else range(1, 25)
+        if with_duplicates:
+            current = [rng.choice(pool) for _ in range(rng.randint(0, 8))]
+            target = [rng.choice(pool) for _ in range(rng.randint(0, 8))]
+        else:
+            current = rng.sample(pool, rng.randint(0, 8))
+            target = rng.sample(pool, rng.randint(0, 8))
+        playlist = _FakePlaylist(current)
+        _sync_playlist_items(playlist, _tracks(target))
+        assert playlist.rating_keys == target, (current, target)
@@ -0,0 +1,86 @@
+"""Cache delle connessioni PlexServer: riuso, verifica di salute e invalidazione sul 401."""
+import threading
+
+import pytest
+import requests
+
+from plex_playlist_sync.utils import plex_connection
+from plex_playlist_sync.utils.plex_connection import get_plex_server, invalidate_plex_server
+
+URL = "http://plex.local:32400"
+
+
+class _FakeServer:
+    created = []
+
+    def __init__(self, base_url, token, session=None, timeout=None):
+        self.base_url, self.token, self.session, self.timeout = base_url, token, session, timeout
+        self.healthy = True
+        _FakeServer.created.append(self)
+
+    def query(self, path, timeout=None):
+        if not self.healthy:
+            raise requests.ConnectionError("server down")
+
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    _FakeServer.created = []
+    monkeypatch.setattr(plex_connection, "PlexServer", _FakeServer)
+    monkeypatch.setattr(plex_connection, "_sessions", {})
+    monkeypatch.setattr(plex_connection, "_servers", {})
+    monkeypatch.setattr(plex_connection, "_key_locks", {})
+
+
+def test_same_url_and_token_reuse_one_instance():
+    first = get_plex_server(URL + "/", "token-a")
+    assert get_plex_server(URL, "token-a") is first
+    assert len(_FakeServer.created) == 1
+    assert first.base_url == URL
+
+
+def test_tokens_and_timeouts_get_their_own_instance_but_share_the_session():
+    a = get_plex_server(URL, "token-a")
+    b = get_plex_server(URL, "token-b")
+    c = get_plex_server(URL, "token-a", timeout=30)
+    assert len({id(a), id(b), id(c)}) == 3
+    assert a.session is b.session is c.session
+    assert c.timeout == 30
+
+
+def test_concurrent_callers_wait_for_a_single_connection():
+    servers = []
+    threads = [threading.Thread(target=lambda: servers.append(get_plex_server(URL, "token-a"))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(_FakeServer.created) == 1
+    assert all(server is servers[0] for server in servers)
+
+
+def test_stale_unhealthy_instance_is_replaced(monkeypatch):
+    monkeypatch.setattr(plex_connection, "PLEX_HEALTH_CHECK_SECONDS", 0)
+    first = get_plex_server(URL, "token-a")
+    assert get_plex_server(URL, "token-a") is first  # ancora sano: riusato dopo la verifica
+    first.healthy = False
+    assert get_plex_server(URL, "token-a") is not first
+
+
+def test_invalidate_drops_every_timeout_for_the_token():
+    a = get_plex_server(URL, "token-a")
+    get_plex_server(URL, "token-a", timeout=30)
+    other = get_plex_server(URL, "token-b")
+    invalidate_plex_server(URL, "token-a")
+    assert get_plex_server(URL, "token-a") is not a
+    assert get_plex_server(URL, "token-b") is other
+
+
+def test_unauthorized_response_evicts_the_token():
+    server = get_plex_server(URL, "token-a")
+    response = requests.Response()
+    response.status_code = 401
+    response.request = requests.Request("GET", URL, headers={"X-Plex-Token": "token-a"}).prepare()
+    for hook in server.session.hooks["response"]:
+        hook(response)
+    assert get_plex_server(URL, "token-a") is not server
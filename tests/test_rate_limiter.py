@@ -0,0 +1,92 @@
+"""Token bucket condiviso e interpretazione di Retry-After."""
+import time
+from email.utils import formatdate
+
+import pytest
+
+from plex_playlist_sync.utils import rate_limiter
+from plex_playlist_sync.utils.rate_limiter import TokenBucket, parse_retry_after
+
+
+class _FakeClock:
+    """Sostituisce time.monotonic/time.sleep: le attese avanzano l'orologio senza dormire."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        # Come un vero sleep, avanza almeno di una risoluzione minima (gli arrotondamenti float non bloccano)
+        self.now += max(seconds, 1e-6)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = _FakeClock()
+    monkeypatch.setattr(rate_limiter.time, "monotonic", fake.monotonic)
+    monkeypatch.setattr(rate_limiter.time, "sleep", fake.sleep)
+    return fake
+
+
+def test_burst_is_served_without_waiting(clock):
+    bucket = TokenBucket("test", rate=2.0, burst=3)
+    assert [bucket.acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert clock.sleeps == []
+
+
+def test_acquire_waits_for_refill_at_rate(clock):
+    bucket = TokenBucket("test", rate=2.0, burst=1)
+    bucket.acquire()
+    assert bucket.acquire() == pytest.approx(0.5)
+    assert bucket.stats()['total_waited'] == pytest.approx(0.5)
+
+
+def test_refill_is_capped_at_burst(clock):
+    bucket = TokenBucket("test", rate=10.0, burst=2)
+    bucket.acquire()
+    bucket.acquire()
+    clock.now += 60
+    assert bucket.stats()['tokens'] == 2
+
+
+def test_backoff_pauses_every_caller_then_resumes(clock):
+    bucket = TokenBucket("test", rate=100.0, burst=5)
+    bucket.backoff(3.0)
+    waited = bucket.acquire()
+    assert waited >= 3.0
+    assert bucket.stats()['throttled'] == 1
+    # La pausa più breve non accorcia quella già in corso
+    bucket.backoff(10.0)
+    bucket.backoff(1.0)
+    assert bucket.stats()['blocked_for'] == pytest.approx(10.0)
+
+
+def test_disabled_bucket_never_waits(clock):
+    bucket = TokenBucket("test", rate=0, burst=1)
+    assert sum(bucket.acquire() for _ in range(50)) == 0.0
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("120", 120.0),
+    ("1.5", 1.5),
+    ("-4", 0.0),
+    (7, 7.0),
+    (None, None),
+    ("", None),
+    ("soon", None),
+])
+def test_parse_retry_after_seconds(value, expected):
+    assert parse_retry_after(value) == expected
+
+
+def test_parse_retry_after_http_date():
+    delay = parse_retry_after(formatdate(time.time() + 30, usegmt=True))
+    assert 28 <= delay <= 30
+
+
+def test_parse_retry_after_date_in_the_past_is_zero():
+    assert parse_retry_after(formatdate(time.time() - 300, usegmt=True)) == 0.0
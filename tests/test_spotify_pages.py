@@ -0,0 +1,63 @@
+"""Paginazione parallela delle tracce di una playlist Spotify con filtro dei campi."""
+import threading
+import time
+
+from plex_playlist_sync.utils.helperClasses import Playlist, Track
+from plex_playlist_sync.utils.spotify import SP_PAGE_SIZE, SP_TRACK_FIELDS, _get_sp_tracks_from_playlist
+
+
+def _item(n):
+    return {"track": {"name": f"song {n}", "artists": [{"name": f"artist {n}"}], "album": {"name": "album"},
+                      "external_urls": {"spotify": f"https://open.spotify.com/track/{n}"}}}
+
+
+class _FakeSpotify:
+    """playlist_items() su una playlist di `total` tracce; le pagine successive rispondono in ordine sparso."""
+
+    def __init__(self, total, skipped=()):
+        self.total = total
+        self.skipped = set(skipped)
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def playlist_items(self, playlist_id, fields=None, limit=100, offset=0):
+        with self.lock:
+            self.calls.append((offset, limit, fields))
+        # Pagine più vicine all'inizio rispondono più tardi: l'ordine finale non deve dipenderne
+        time.sleep(0.002 * (self.total - offset) / SP_PAGE_SIZE if offset else 0)
+        items = [{"track": None} if n in self.skipped else _item(n)
+                 for n in range(offset, min(offset + limit, self.total))]
+        return {"items": items, "total": self.total}
+
+
+PLAYLIST = Playlist(id="pl", name="Test", description="", poster="")
+
+
+def test_all_pages_are_fetched_in_order():
+    sp = _FakeSpotify(total=3 * SP_PAGE_SIZE + 17)
+    tracks = _get_sp_tracks_from_playlist(sp, PLAYLIST)
+    assert [t.title for t in tracks] == [f"song {n}" for n in range(3 * SP_PAGE_SIZE + 17)]
+    assert sorted(offset for offset, _, _ in sp.calls) == [0, 100, 200, 300]
+    assert tracks[5] == Track("song 5", "artist 5", "album", "https://open.spotify.com/track/5")
+
+
+def test_requests_ask_only_for_used_fields():
+    sp = _FakeSpotify(total=SP_PAGE_SIZE + 1)
+    _get_sp_tracks_from_playlist(sp, PLAYLIST)
+    fields = {offset: f for offset, _, f in sp.calls}
+    assert fields[0] == f"total,{SP_TRACK_FIELDS}"
+    assert fields[SP_PAGE_SIZE] == SP_TRACK_FIELDS
+    assert all(limit == SP_PAGE_SIZE for _, limit, _ in sp.calls)
+
+
+def test_single_page_playlist_makes_one_request():
+    sp = _FakeSpotify(total=12)
+    assert len(_get_sp_tracks_from_playlist(sp, PLAYLIST)) == 12
+    assert len(sp.calls) == 1
+
+
+def test_removed_tracks_are_skipped():
+    sp = _FakeSpotify(total=150, skipped={3, 120})
+    titles = [t.title for t in _get_sp_tracks_from_playlist(sp, PLAYLIST)]
+    assert len(titles) == 148
+    assert "song 3" not in titles and "song 120" not in titles
@@ -0,0 +1,87 @@
+"""Attribuzione dell'esito ai link di un'invocazione streamrip, con e senza il suo database dei download."""
+import sqlite3
+
+import pytest
+
+from plex_playlist_sync.utils import downloader
+from plex_playlist_sync.utils.downloader import _map_streamrip_output
+
+ALBUM_A = "https://www.deezer.com/album/111"
+ALBUM_B = "https://www.deezer.com/en/album/222"
+TRACK = "https://www.deezer.com/track/333"
+TRACKLISTS = {'111': ['1001', '1002'], '222': ['2001', '2002', '2003']}
+
+
+@pytest.fixture
+def tracklist_calls(temp_db, monkeypatch):
+    calls = []
+
+    def _fake_fetch(album_id):
+        calls.append(album_id)
+        return TRACKLISTS.get(album_id), True
+
+    monkeypatch.setattr(downloader, "_fetch_album_track_ids", _fake_fetch)
+    monkeypatch.setattr(downloader, "_has_recent_music_files", lambda since: False)
+    return calls
+
+
+@pytest.fixture
+def streamrip_db(tmp_path):
+    """Database dei download di streamrip (tabella downloads con gli ID Deezer delle tracce)."""
+    path = str(tmp_path / "downloads.db")
+
+    def _record(*track_ids):
+        with sqlite3.connect(path) as con:
+            con.execute("CREATE TABLE IF NOT EXISTS downloads (id TEXT UNIQUE NOT NULL)")
+            con.executemany("INSERT OR IGNORE INTO downloads (id) VALUES (?)", [(t,) for t in track_ids])
+        return path
+
+    return _record
+
+
+def test_database_attributes_each_link(tracklist_calls, streamrip_db):
+    db_path = streamrip_db('1001', '1002', '9999')
+    results = _map_streamrip_output([ALBUM_A, ALBUM_B], "", 0.0, db_path)
+    assert results == {ALBUM_A: True, ALBUM_B: False}
+
+
+def test_partially_recorded_album_counts_as_downloaded(tracklist_calls, streamrip_db):
+    db_path = streamrip_db('2002')
+    assert _map_streamrip_output([ALBUM_B], "", 0.0, db_path) == {ALBUM_B: True}
+
+
+def test_track_link_needs_no_tracklist(tracklist_calls, streamrip_db):
+    db_path = streamrip_db('333')
+    assert _map_streamrip_output([TRACK, ALBUM_A], "", 0.0, db_path) == {TRACK: True, ALBUM_A: False}
+    assert tracklist_calls == ['111']
+
+
+def test_album_tracklist_is_fetched_once(tracklist_calls, streamrip_db):
+    db_path = streamrip_db('1001')
+    _map_streamrip_output([ALBUM_A], "", 0.0, db_path)
+    _map_streamrip_output([ALBUM_A], "", 0.0, db_path)
+    assert tracklist_calls == ['111']
+
+
+def test_failure_line_for_the_link_wins(tracklist_calls, streamrip_db):
+    db_path = streamrip_db('1001', '2001')
+    stdout = "Album 222 not found\nDetected list of urls"
+    assert _map_streamrip_output([ALBUM_A, ALBUM_B], stdout, 0.0, db_path) == {ALBUM_A: True, ALBUM_B: False}
+
+
+def test_without_database_multiple_links_are_never_reported_downloaded(tracklist_calls):
+    stdout = "Detected list of urls\nTrack downloaded\n100%"
+    assert _map_streamrip_output([ALBUM_A, ALBUM_B], stdout, 0.0, None) == {ALBUM_A: False, ALBUM_B: False}
+    assert tracklist_calls == []
+
+
+def test_without_database_a_single_link_uses_the_output(tracklist_calls):
+    assert _map_streamrip_output([ALBUM_A], "Track downloaded", 0.0, None) == {ALBUM_A: True}
+    assert _map_streamrip_output([ALBUM_A], "", 0.0, None) == {ALBUM_A: False}
+
+
+def test_unreadable_database_falls_back_like_a_missing_one(tracklist_calls, tmp_path):
+    broken = tmp_path / "downloads.db"
+    broken.write_bytes(b"not a database")
+    results = _map_streamrip_output([ALBUM_A, ALBUM_B], "Track downloaded", 0.0, str(broken))
+    assert results == {ALBUM_A: False, ALBUM_B: False}